@@ -3,8 +3,14 @@ import json
 
 import pandas as pd
 import streamlit as st
+import streamlit.components.v1 as components
 import leafmap.foliumap as leafmap
 
+from clusters import ClusterLayer, register_cluster_source
+from map_cache import cached_map_html, map_cache_key
+from map_layers import register_popup_source
+from snapshot import data_version, stamp
+
 st.set_page_config(layout="wide")
 
 # Customize the sidebar
@@ -33,12 +39,12 @@ st.markdown(
 # st.header("Instructions")
 
 # markdown = """
-#1. For the [GitHub repository](https://github.com/opengeos/streamlit-map-template) or [use it as a template](https://github.com/opengeos/streamlit-map-template/generate) for your own project.
-#2. Customize the sidebar by changing the sidebar text and logo in each Python files.
-#3. Find your favorite emoji from https://emojipedia.org.
-#4. Add a new app to the `pages/` directory with an emoji in the file name, e.g., `1_🚀_Chart.py`.
+# 1. For the [GitHub repository](https://github.com/opengeos/streamlit-map-template) or [use it as a template](https://github.com/opengeos/streamlit-map-template/generate) for your own project.
+# 2. Customize the sidebar by changing the sidebar text and logo in each Python files.
+# 3. Find your favorite emoji from https://emojipedia.org.
+# 4. Add a new app to the `pages/` directory with an emoji in the file name, e.g., `1_🚀_Chart.py`.
 
-#"""
+# """
 
 # st.markdown(markdown)
 
@@ -76,21 +82,24 @@ def load_geojson() -> pd.DataFrame:
         errors="coerce",
         dayfirst=True,
     )
-    return df
+    return stamp(df, data_version(), "home")
+
+
+def build_map_html(cluster_url: str, popup_url: str) -> str:
+    m = leafmap.Map(center=[-23.415367, -51.931343], zoom=12)
+    ClusterLayer(cluster_url, popup_url=popup_url, name="Denúncias").add_to(m)
+    m.add_layer_control()
+    return m.to_html()
 
 
 df = load_geojson()
 if df.empty:
     st.warning("Não há dados para exibir no mapa.")
 else:
-    m = leafmap.Map(center=[-23.415367, -51.931343], zoom=12)
-    m.add_points_from_xy(
-        df,
-        x="longitude",
-        y="latitude",
-        popup=["Protocolo", "DataInclusao", "Descrição"],
-        icon_names=["gear", "map", "leaf", "globe"],
-        spin=True,
-        add_legend=True,
+    cluster_url = register_cluster_source(df)
+    popup_url = register_popup_source(df, ["Protocolo", "DataInclusao", "Descrição"])
+    map_html = cached_map_html(
+        map_cache_key("home", data_version(), cluster_url, popup_url),
+        lambda: build_map_html(cluster_url, popup_url),
     )
-    m.to_streamlit(height=500)
+    components.html(map_html, height=500)
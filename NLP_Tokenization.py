@@ -4,23 +4,62 @@ Processa as descrições de denúncias de poluição sonora contidas no arquivo
 lemmatização com o modelo `pt_core_news_lg` do spaCy. Os tokens resultantes são
 armazenados em uma nova coluna (propriedade GeoJSON) chamada
 `descricao_tokens`.
+
+As descrições passam pelo spaCy em lotes (`nlp.pipe`), opcionalmente em vários
+processos, e o modelo é carregado sem os componentes que `_clean_tokens` não
+usa (parser, NER e segmentador de frases): ficam só a tokenização, a
+morfologia (classes gramaticais que o lematizador consulta) e os lemas.
+
+A análise de cada descrição fica num cache SQLite (`token_cache`), chaveado
+pelo texto normalizado e pela versão do modelo: as execuções seguintes só
+levam ao spaCy as descrições novas, e mudanças nas stopwords, aplicadas depois
+do cache, não exigem reprocessamento. Se todas as descrições estiverem no
+cache, o modelo nem é carregado.
+
+Há também um modo leve (`--backend lookup`) que dispensa o modelo: um
+tokenizador por regex e uma tabela forma -> lema derivada uma vez do modelo
+(`--build-lemmas`, gravada em `lemas_pt_core_news_lg.json`), com os mesmos
+filtros de `_clean_tokens`. A geração da tabela relata a concordância com o
+pipeline completo em descrições não usadas para montá-la.
+
+Uso: `python NLP_Tokenization.py [--batch-size 256] [--n-process 1] [--no-cache]
+[--backend spacy|lookup] [--build-lemmas]`.
 """
 
 from __future__ import annotations
 
+import argparse
 import json
+import random
 import re
+import time
+from collections import Counter, defaultdict
 from pathlib import Path
-from typing import Iterable, List
+from typing import Dict, Iterable, List, Sequence, Tuple
 
 import nltk
 import spacy
 
+from token_cache import TokenCache, cache_key
+
 GEOJSON_PATH = Path("mga_denuncias_20-23.geojson")
 TOKEN_PROPERTY = "descricao_tokens"
 URL_REGEX = re.compile(r"https?://\\S+|www\\.\\S+", flags=re.IGNORECASE)
 ALPHA_REGEX = re.compile(r"[a-zà-ú]{2,}", flags=re.IGNORECASE)
 IR_FORMS = {"vou", "vais", "vai", "vamos", "ides", "vão"}
+MODEL_NAME = "pt_core_news_lg"
+# componentes do modelo que não influenciam os tokens nem os lemas
+UNUSED_COMPONENTS = ["parser", "ner", "senter"]
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_N_PROCESS = 1
+# incrementar quando os filtros de `_candidate_tokens` mudarem (invalida o cache)
+ANALYSIS_VERSION = 1
+LEMMA_TABLE_PATH = Path("lemas_pt_core_news_lg.json")
+# palavras e sinais isolados, como o tokenizador do spaCy separa os tokens que interessam
+TOKEN_REGEX = re.compile(r"\w+|[^\w\s]+")
+HOLDOUT_FRACTION = 0.2
+HOLDOUT_SEED = 42
+TOP_DISAGREEMENTS = 10
 
 
 def _ensure_stopwords() -> set[str]:
@@ -83,60 +122,374 @@ def _ensure_stopwords() -> set[str]:
     return {w.lower() for w in stopwords}.union(extras)
 
 
-def _clean_tokens(doc: Iterable[spacy.tokens.Token], stopwords: set[str]) -> List[str]:
-    """Converte tokens do spaCy em uma lista de lemas normalizados."""
-    normalized_tokens: List[str] = []
+def _keeps_form(raw: str) -> bool:
+    """Filtros sobre o texto do token: sem dígitos, sem URL e com ao menos duas letras."""
+    if any(ch.isdigit() for ch in raw):
+        return False
+    if URL_REGEX.search(raw):
+        return False
+    return bool(ALPHA_REGEX.search(raw))
+
+
+def _normalize_lemma(lemma: str, raw: str) -> str:
+    lemma = lemma.strip().lower() or raw
+    return "ir" if lemma in IR_FORMS else lemma
+
+
+def _analyse(doc: Iterable[spacy.tokens.Token]) -> List[Tuple[str, str | None]]:
+    """Pares (texto, lema) de todos os tokens; o lema é None se o token é descartado."""
+    analysis: List[Tuple[str, str | None]] = []
     for token in doc:
         raw = token.text.strip().lower()
-        if not raw or raw in stopwords:
-            continue
-        if token.is_space or token.is_punct or token.like_num:
-            continue
-        if any(ch.isdigit() for ch in raw):
-            continue
-        if URL_REGEX.search(raw):
-            continue
-        if not ALPHA_REGEX.search(raw):
+        if not raw:
             continue
+        if token.is_space or token.is_punct or token.like_num or not _keeps_form(raw):
+            analysis.append((raw, None))
+        else:
+            analysis.append((raw, _normalize_lemma(token.lemma_, raw)))
+    return analysis
 
-        lemma = token.lemma_.strip().lower() or raw
-        lemma = "ir" if lemma in IR_FORMS else lemma
 
-        if lemma in stopwords:
-            continue
+def _candidate_tokens(doc: Iterable[spacy.tokens.Token]) -> List[Tuple[str, str]]:
+    """Pares (texto, lema) dos tokens que passam pelos filtros independentes das stopwords."""
+    return [(raw, lemma) for raw, lemma in _analyse(doc) if lemma is not None]
+
+
+def _filter_stopwords(
+    candidates: Iterable[Sequence[str]], stopwords: set[str]
+) -> List[str]:
+    """Lemas dos candidatos cujo texto e lema não são stopwords."""
+    return [
+        lemma
+        for raw, lemma in candidates
+        if raw not in stopwords and lemma not in stopwords
+    ]
+
+
+def _clean_tokens(doc: Iterable[spacy.tokens.Token], stopwords: set[str]) -> List[str]:
+    """Converte tokens do spaCy em uma lista de lemas normalizados."""
+    return _filter_stopwords(_candidate_tokens(doc), stopwords)
+
+
+def load_pipeline() -> spacy.language.Language:
+    """Carrega o modelo apenas com tokenização, morfologia e lematização."""
+    return spacy.load(MODEL_NAME, exclude=UNUSED_COMPONENTS)
+
+
+def normalize_description(descricao: object) -> str:
+    """Texto da descrição como é enviado ao spaCy (sem URLs, em minúsculas)."""
+    return URL_REGEX.sub(" ", str(descricao or "")).lower()
+
+
+def model_version() -> str:
+    """Identifica o modelo e as regras de `_candidate_tokens` nas chaves do cache."""
+    package = spacy.util.get_package_version(MODEL_NAME)
+    return (
+        f"spacy=={spacy.__version__};{MODEL_NAME}=={package};"
+        f"sem {','.join(UNUSED_COMPONENTS)};regras v{ANALYSIS_VERSION}"
+    )
+
+
+def tokenize_descriptions(
+    descriptions: Sequence[str],
+    stopwords: set[str],
+    nlp: spacy.language.Language | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    n_process: int = DEFAULT_N_PROCESS,
+    cache: TokenCache | None = None,
+) -> Tuple[List[List[str]], int]:
+    """Tokens de cada descrição e quantos textos passaram pelo spaCy.
+
+    As descrições são processadas em lotes pelo `nlp.pipe`. Com `cache`, só
+    os textos ainda não analisados passam pelo spaCy, e o modelo só é
+    carregado (quando `nlp` não é dado) se houver algum.
+    """
+    texts = [normalize_description(descricao) for descricao in descriptions]
+    version = model_version()
+    keys = [cache_key(version, text) for text in texts]
+    analyses = cache.get_many(set(keys)) if cache is not None else {}
+    pending = {key: text for key, text in zip(keys, texts) if key not in analyses}
+    if pending:
+        nlp = nlp or load_pipeline()
+        docs = nlp.pipe(pending.values(), batch_size=batch_size, n_process=n_process)
+        computed = {key: _candidate_tokens(doc) for key, doc in zip(pending, docs)}
+        if cache is not None:
+            cache.put_many(computed)
+        analyses.update(computed)
+    tokens = [_filter_stopwords(analyses[key], stopwords) for key in keys]
+    return tokens, len(pending)
+
+
+def build_lemma_table(
+    analyses: Iterable[Sequence[Tuple[str, str | None]]],
+) -> Dict[str, str | None]:
+    """Lema mais frequente de cada forma nas análises do modelo (None: forma descartada)."""
+    counts: Dict[str, Counter[str | None]] = defaultdict(Counter)
+    for analysis in analyses:
+        for raw, lemma in analysis:
+            counts[raw][lemma] += 1
+    return {raw: lemmas.most_common(1)[0][0] for raw, lemmas in counts.items()}
+
+
+def save_lemma_table(
+    table: Dict[str, str | None], path: Path = LEMMA_TABLE_PATH
+) -> None:
+    with path.open("w", encoding="utf-8") as target:
+        json.dump(
+            {"modelo": model_version(), "lemas": table},
+            target,
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+
+
+def load_lemma_table(path: Path = LEMMA_TABLE_PATH) -> Dict[str, str | None]:
+    if not path.exists():
+        raise FileNotFoundError(
+            f"Tabela de lemas não encontrada: {path}. "
+            "Gere-a com `python NLP_Tokenization.py --build-lemmas`."
+        )
+    with path.open(encoding="utf-8") as source:
+        return json.load(source)["lemas"]
 
-        normalized_tokens.append(lemma)
-    return normalized_tokens
 
+def lookup_candidates(text: str, table: Dict[str, str | None]) -> List[Tuple[str, str]]:
+    """Pares (texto, lema) de `text` pela tabela, com os mesmos filtros do spaCy.
 
-def process_geojson() -> None:
-    """Executa o pipeline de NLP e persiste o resultado no GeoJSON."""
+    Formas fora da tabela passam pelos filtros de texto e ficam como o próprio lema.
+    """
+    candidates: List[Tuple[str, str]] = []
+    for raw in TOKEN_REGEX.findall(text):
+        if raw in table:
+            lemma = table[raw]
+        else:
+            lemma = _normalize_lemma(raw, raw) if _keeps_form(raw) else None
+        if lemma is not None:
+            candidates.append((raw, lemma))
+    return candidates
+
+
+def tokenize_descriptions_lookup(
+    descriptions: Sequence[str], stopwords: set[str], table: Dict[str, str | None]
+) -> List[List[str]]:
+    """Tokens de cada descrição pela tabela de lemas, sem carregar o modelo."""
+    return [
+        _filter_stopwords(
+            lookup_candidates(normalize_description(descricao), table), stopwords
+        )
+        for descricao in descriptions
+    ]
+
+
+def agreement_report(
+    reference: Sequence[List[str]], candidate: Sequence[List[str]]
+) -> Dict[str, object]:
+    """Concordância entre os tokens de referência (spaCy) e os da tabela de lemas."""
+    matched = expected = produced = identical = 0
+    missing: Counter[str] = Counter()
+    extra: Counter[str] = Counter()
+    for ref_tokens, cand_tokens in zip(reference, candidate):
+        ref_counts, cand_counts = Counter(ref_tokens), Counter(cand_tokens)
+        matched += sum((ref_counts & cand_counts).values())
+        expected += len(ref_tokens)
+        produced += len(cand_tokens)
+        identical += ref_tokens == cand_tokens
+        missing.update(ref_counts - cand_counts)
+        extra.update(cand_counts - ref_counts)
+    precision = matched / produced if produced else 1.0
+    recall = matched / expected if expected else 1.0
+    return {
+        "descricoes": len(reference),
+        "identicas": identical / len(reference) if reference else 1.0,
+        "precisao": precision,
+        "revocacao": recall,
+        "f1": (
+            2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        ),
+        "faltantes": missing.most_common(TOP_DISAGREEMENTS),
+        "sobrando": extra.most_common(TOP_DISAGREEMENTS),
+    }
+
+
+def print_agreement(report: Dict[str, object]) -> None:
+    print(f"Concordância com o pipeline completo em {report['descricoes']} descrições:")
+    print(f" - listas de tokens idênticas: {report['identicas']:.1%}")
+    print(
+        f" - precisão {report['precisao']:.1%}, revocação {report['revocacao']:.1%}, "
+        f"F1 {report['f1']:.1%}"
+    )
+    for label, key in (
+        ("Lemas só no spaCy", "faltantes"),
+        ("Lemas só na tabela", "sobrando"),
+    ):
+        pairs = ", ".join(f"{lemma} ({count})" for lemma, count in report[key])
+        print(f" - {label}: {pairs or 'nenhum'}")
+
+
+def build_lemmas(
+    batch_size: int = DEFAULT_BATCH_SIZE, n_process: int = DEFAULT_N_PROCESS
+) -> None:
+    """Gera a tabela de lemas com o modelo completo e relata a concordância.
+
+    A concordância é medida em `HOLDOUT_FRACTION` das descrições, com uma
+    tabela montada só com as demais (como acontece com textos novos); a
+    tabela gravada usa todas as descrições.
+    """
+    stopwords = _ensure_stopwords()
+    with GEOJSON_PATH.open(encoding="utf-8") as source:
+        data = json.load(source)
+    texts = sorted(
+        {
+            normalize_description((feature.get("properties") or {}).get("Descrição"))
+            for feature in data.get("features", [])
+        }
+    )
+    nlp = load_pipeline()
+    started = time.perf_counter()
+    analyses = [
+        _analyse(doc)
+        for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+    ]
+    elapsed = time.perf_counter() - started
+    print(
+        f"{len(texts)} descrições distintas analisadas pelo spaCy em {elapsed:.1f} s "
+        f"({len(texts) / max(elapsed, 1e-9):,.0f} descrições/s)."
+    )
+
+    holdout = set(
+        random.Random(HOLDOUT_SEED).sample(
+            range(len(texts)), int(len(texts) * HOLDOUT_FRACTION)
+        )
+    )
+    train_table = build_lemma_table(
+        analysis
+        for position, analysis in enumerate(analyses)
+        if position not in holdout
+    )
+    positions = sorted(holdout)
+    reference = [
+        _filter_stopwords(
+            [(raw, lemma) for raw, lemma in analyses[position] if lemma is not None],
+            stopwords,
+        )
+        for position in positions
+    ]
+    started = time.perf_counter()
+    candidate = tokenize_descriptions_lookup(
+        [texts[position] for position in positions], stopwords, train_table
+    )
+    elapsed = time.perf_counter() - started
+    print_agreement(agreement_report(reference, candidate))
+    print(
+        f"Tabela de lemas: {len(positions) / max(elapsed, 1e-9):,.0f} descrições/s "
+        "(sem carregar o modelo)."
+    )
+
+    table = build_lemma_table(analyses)
+    save_lemma_table(table)
+    print(f"Tabela com {len(table)} formas gravada em '{LEMMA_TABLE_PATH}'.")
+
+
+def process_geojson(
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    n_process: int = DEFAULT_N_PROCESS,
+    use_cache: bool = True,
+    backend: str = "spacy",
+) -> None:
+    """Executa o pipeline de NLP e persiste o resultado no GeoJSON.
+
+    `backend="lookup"` usa a tabela de lemas em vez do modelo.
+    """
     if not GEOJSON_PATH.exists():
         raise FileNotFoundError(f"Arquivo não encontrado: {GEOJSON_PATH}")
 
     stopwords = _ensure_stopwords()
-    nlp = spacy.load("pt_core_news_lg")
 
     with GEOJSON_PATH.open(encoding="utf-8") as source:
         data = json.load(source)
 
     features = data.get("features", [])
-    for feature in features:
-        props = feature.setdefault("properties", {})
-        descricao = props.get("Descrição") or ""
-        texto_tratado = URL_REGEX.sub(" ", str(descricao)).lower()
-        doc = nlp(texto_tratado)
-        tokens = _clean_tokens(doc, stopwords)
-        props[TOKEN_PROPERTY] = tokens
+    properties = [feature.setdefault("properties", {}) for feature in features]
+    descriptions = [props.get("Descrição") for props in properties]
+    started = time.perf_counter()
+    if backend == "lookup":
+        table = load_lemma_table()
+        tokens = tokenize_descriptions_lookup(descriptions, stopwords, table)
+        source_note = "pela tabela de lemas"
+    else:
+        cache = TokenCache() if use_cache else None
+        try:
+            tokens, analysed = tokenize_descriptions(
+                descriptions,
+                stopwords,
+                batch_size=batch_size,
+                n_process=n_process,
+                cache=cache,
+            )
+        finally:
+            if cache is not None:
+                cache.close()
+        source_note = (
+            f"{analysed} textos novos passaram pelo spaCy e os demais vieram do cache"
+        )
+    elapsed = time.perf_counter() - started
+    for props, descricao_tokens in zip(properties, tokens):
+        props[TOKEN_PROPERTY] = descricao_tokens
 
     with GEOJSON_PATH.open("w", encoding="utf-8") as target:
         json.dump(data, target, ensure_ascii=False, indent=2)
 
     print(
-        f"Processadas {len(features)} denúncias. "
+        f"Processadas {len(features)} denúncias em {elapsed:.1f} s "
+        f"({len(features) / max(elapsed, 1e-9):,.0f} denúncias/s); "
+        f"{source_note}. "
         f"Tokens armazenados na coluna '{TOKEN_PROPERTY}'."
     )
 
 
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Tokeniza e lematiza as descrições das denúncias no GeoJSON."
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="descrições por lote enviado ao spaCy",
+    )
+    parser.add_argument(
+        "--n-process",
+        type=int,
+        default=DEFAULT_N_PROCESS,
+        help="processos do nlp.pipe (-1 usa todos os núcleos)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="reprocessa todas as descrições, sem ler nem gravar o cache de tokens",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["spacy", "lookup"],
+        default="spacy",
+        help="lookup usa a tabela de lemas e um tokenizador por regex, sem o modelo",
+    )
+    parser.add_argument(
+        "--build-lemmas",
+        action="store_true",
+        help="gera a tabela de lemas com o modelo e relata a concordância com ele",
+    )
+    args = parser.parse_args()
+    if args.build_lemmas:
+        build_lemmas(batch_size=args.batch_size, n_process=args.n_process)
+        return
+    process_geojson(
+        batch_size=args.batch_size,
+        n_process=args.n_process,
+        use_cache=not args.no_cache,
+        backend=args.backend,
+    )
+
+
 if __name__ == "__main__":
-    process_geojson()
+    main()
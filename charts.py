@@ -0,0 +1,101 @@
+"""
+Construção dos gráficos Altair a partir de tabelas já agregadas em Python.
+
+Os gráficos de Pareto recebem apenas a tabela de frequências (uma linha por
+categoria), compartilhada pelas camadas de barras, linha e pontos através de
+um único conjunto de dados nomeado na especificação Vega-Lite. A quantidade de
+categorias enviadas ao navegador é limitada, agrupando a cauda em "Outros".
+"""
+
+from __future__ import annotations
+
+import altair as alt
+import pandas as pd
+
+MISSING_LABEL = "Não informado"
+OTHERS_LABEL = "Outros"
+MAX_PARETO_CATEGORIES = 60
+PARETO_COLUMNS = ["categoria", "contagem", "percentual", "percentual_acumulado"]
+
+
+def pareto_table(values: pd.Series) -> pd.DataFrame:
+    """Conta as categorias e calcula os percentuais simples e acumulados (0-100)."""
+    counts = values.fillna(MISSING_LABEL).astype(str).value_counts()
+    total = counts.sum()
+    if total == 0:
+        return pd.DataFrame(columns=PARETO_COLUMNS)
+    freq = counts.rename_axis("categoria").reset_index(name="contagem")
+    freq["percentual"] = freq["contagem"] / total * 100
+    freq["percentual_acumulado"] = freq["percentual"].cumsum()
+    return freq
+
+
+def cap_categories(
+    freq: pd.DataFrame, max_categories: int = MAX_PARETO_CATEGORIES
+) -> pd.DataFrame:
+    """Mantém as maiores categorias e soma o restante numa única barra "Outros"."""
+    if len(freq) <= max_categories:
+        return freq
+    head = freq.iloc[: max_categories - 1]
+    tail = freq.iloc[max_categories - 1 :]
+    others = pd.DataFrame(
+        {
+            "categoria": [f"{OTHERS_LABEL} ({len(tail):,} categorias)"],
+            "contagem": [tail["contagem"].sum()],
+            "percentual": [tail["percentual"].sum()],
+            "percentual_acumulado": [tail["percentual_acumulado"].iloc[-1]],
+        }
+    )
+    return pd.concat([head[PARETO_COLUMNS], others], ignore_index=True)
+
+
+def pareto_chart(
+    freq: pd.DataFrame,
+    category_title: str,
+    count_title: str = "Denúncias",
+    bar_color: str = "#3B82F6",
+    line_color: str = "#F97316",
+    height: int = 380,
+    max_categories: int = MAX_PARETO_CATEGORIES,
+) -> alt.LayerChart:
+    """Monta o Pareto (barras + percentual acumulado) com um único dataset compartilhado.
+
+    `freq` deve estar ordenada de forma decrescente e conter as colunas de
+    `PARETO_COLUMNS`; a ordem das linhas define a ordem do eixo X.
+    """
+    data = cap_categories(freq[PARETO_COLUMNS], max_categories).copy()
+    data["percentual"] = data["percentual"].round(2)
+    data["percentual_acumulado"] = data["percentual_acumulado"].round(2)
+
+    x = alt.X("categoria:N", sort=None, title=category_title)
+    cumulative_tooltip = alt.Tooltip(
+        "percentual_acumulado:Q", title="% Acumulado", format=".1f"
+    )
+    base = alt.Chart().encode(x=x)
+
+    bars = base.mark_bar(color=bar_color).encode(
+        y=alt.Y("contagem:Q", title=count_title),
+        tooltip=[
+            alt.Tooltip("categoria:N", title=category_title),
+            alt.Tooltip("contagem:Q", title="Quantidade"),
+            alt.Tooltip("percentual:Q", title="% Frequência", format=".1f"),
+            cumulative_tooltip,
+        ],
+    )
+    line = base.mark_line(color=line_color).encode(
+        y=alt.Y(
+            "percentual_acumulado:Q",
+            axis=alt.Axis(title="% acumulado (%)", format=".1f"),
+        ),
+        tooltip=[alt.Tooltip("categoria:N", title=category_title), cumulative_tooltip],
+    )
+    points = base.mark_point(color=line_color, size=60).encode(
+        y=alt.Y("percentual_acumulado:Q"),
+        tooltip=[alt.Tooltip("categoria:N", title=category_title), cumulative_tooltip],
+    )
+
+    return (
+        alt.layer(bars, line, points, data=data)
+        .resolve_scale(y="independent")
+        .properties(height=height)
+    )
@@ -0,0 +1,331 @@
+"""
+Agrupamento hierárquico de marcadores (no estilo do supercluster) servido sob demanda.
+
+O índice é montado uma vez por versão dos dados: partindo das denúncias
+individuais (nível `max_zoom + 1`), cada nível de zoom agrupa os itens do
+nível seguinte numa grade de células com `radius` pixels de tela naquele zoom,
+juntando-os num centróide ponderado pela contagem. Cada item guarda o pai no
+nível de cima, o que permite descobrir em que zoom um grupo se divide.
+
+O mapa pede ao servidor local apenas os grupos do zoom atual dentro da área
+visível (`/clusters/<chave>/<zoom>?bbox=oeste,sul,leste,norte`) e, ao clicar
+num grupo, o zoom em que ele se expande (`/clusters/<chave>/expand/<nível>/<i>`).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from folium.map import Layer
+from jinja2 import Template
+
+from local_server import ensure_server, register_route
+from snapshot import fingerprint
+from vector_tiles import mercator_xy
+
+CLUSTER_ROUTE = "clusters"
+TILE_SIZE = 256
+DEFAULT_RADIUS = 50
+DEFAULT_MAX_ZOOM = 16
+MAX_CLUSTER_SOURCES = 8
+COORD_DECIMALS = 6
+
+_JSON = "application/json; charset=utf-8"
+
+
+def mercator_to_latlon(x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    lon = x * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1.0 - 2.0 * y))))
+    return lat, lon
+
+
+@dataclass
+class _Level:
+    x: np.ndarray
+    y: np.ndarray
+    count: np.ndarray
+    # posição do pai no nível de zoom anterior (vazio no nível 0)
+    parent: np.ndarray
+    # linha de uma denúncia do grupo (a única, quando a contagem é 1)
+    leaf: np.ndarray
+    # filhos (no nível seguinte) de cada item, em formato CSR
+    child_order: np.ndarray | None = None
+    child_offsets: np.ndarray | None = None
+
+
+class ClusterIndex:
+    """Hierarquia de grupos por nível de zoom, de 0 até `max_zoom + 1` (pontos)."""
+
+    def __init__(
+        self,
+        latitude: np.ndarray,
+        longitude: np.ndarray,
+        radius: int = DEFAULT_RADIUS,
+        max_zoom: int = DEFAULT_MAX_ZOOM,
+    ):
+        self.radius = radius
+        self.max_zoom = max_zoom
+        x, y = mercator_xy(latitude, longitude)
+        leaves = _Level(
+            x=x,
+            y=y,
+            count=np.ones(len(x), dtype=np.int64),
+            parent=np.empty(0),
+            leaf=np.arange(len(x), dtype=np.int64),
+        )
+        levels = [leaves]
+        for zoom in range(max_zoom, -1, -1):
+            levels.append(self._merge(levels[-1], zoom))
+        levels.reverse()
+        for zoom in range(max_zoom + 1):
+            parent = levels[zoom + 1].parent
+            order = np.argsort(parent, kind="stable")
+            offsets = np.searchsorted(parent[order], np.arange(len(levels[zoom].x) + 1))
+            levels[zoom].child_order = order
+            levels[zoom].child_offsets = offsets
+        self.levels = levels
+
+    def _merge(self, level: _Level, zoom: int) -> _Level:
+        # célula de `radius` pixels de tela no zoom atual, em coordenadas [0, 1]
+        cell = self.radius / (TILE_SIZE * float(1 << zoom))
+        col = np.floor(level.x / cell).astype(np.int64)
+        row = np.floor(level.y / cell).astype(np.int64)
+        keys = row * (int(col.max()) + 1 if len(col) else 1) + col
+        _, parent = np.unique(keys, return_inverse=True)
+        n = int(parent.max()) + 1 if len(parent) else 0
+        weights = level.count.astype(float)
+        count = np.bincount(parent, weights=weights, minlength=n)
+        level.parent = parent.astype(np.int64)
+        leaf = np.empty(n, dtype=np.int64)
+        leaf[level.parent] = level.leaf
+        return _Level(
+            x=np.bincount(parent, weights=level.x * weights, minlength=n) / count,
+            y=np.bincount(parent, weights=level.y * weights, minlength=n) / count,
+            count=count.astype(np.int64),
+            parent=np.empty(0),
+            leaf=leaf,
+        )
+
+    def level_for_zoom(self, zoom: float) -> int:
+        return int(min(max(math.floor(zoom), 0), self.max_zoom + 1))
+
+    def query(self, zoom: float, bbox: tuple[float, float, float, float]) -> dict:
+        """Itens `[lat, lon, contagem, id]` do nível do zoom dentro de `bbox`.
+
+        Para grupos, `id` é a posição no nível (usada na expansão); para
+        denúncias isoladas, é a posição da linha nos dados originais.
+        """
+        level_number = self.level_for_zoom(zoom)
+        level = self.levels[level_number]
+        west, south, east, north = bbox
+        (x0, x1), (y0, y1) = mercator_xy(
+            np.array([north, south]), np.array([west, east])
+        )
+        inside = np.flatnonzero(
+            (level.x >= x0) & (level.x <= x1) & (level.y >= y0) & (level.y <= y1)
+        )
+        lat, lon = mercator_to_latlon(level.x[inside], level.y[inside])
+        items = np.column_stack(
+            [
+                np.round(lat, COORD_DECIMALS),
+                np.round(lon, COORD_DECIMALS),
+                level.count[inside],
+                np.where(level.count[inside] == 1, level.leaf[inside], inside),
+            ]
+        ).tolist()
+        return {"level": level_number, "items": items}
+
+    def expansion_zoom(self, level_number: int, index: int) -> int:
+        """Menor zoom em que o grupo se divide em mais de um item."""
+        while level_number <= self.max_zoom:
+            level = self.levels[level_number]
+            start, end = level.child_offsets[index], level.child_offsets[index + 1]
+            level_number += 1
+            if end - start != 1:
+                break
+            index = int(level.child_order[start])
+        return level_number
+
+
+_cluster_sources: dict[str, ClusterIndex] = {}
+# o servidor local lê os índices em outras threads
+_lock = threading.Lock()
+
+
+def _serve_clusters(
+    parts: list[str], query: dict[str, list[str]]
+) -> tuple[int, str, bytes]:
+    not_found = (404, "text/plain; charset=utf-8", b"cluster not found")
+    if len(parts) < 2:
+        return not_found
+    with _lock:
+        index = _cluster_sources.get(parts[0])
+    if index is None:
+        return not_found
+    if (
+        parts[1] == "expand"
+        and len(parts) == 4
+        and parts[2].isdigit()
+        and parts[3].isdigit()
+    ):
+        level_number, item = int(parts[2]), int(parts[3])
+        if level_number > index.max_zoom + 1 or item >= len(
+            index.levels[level_number].x
+        ):
+            return not_found
+        body = {"zoom": index.expansion_zoom(level_number, item)}
+        return 200, _JSON, json.dumps(body).encode("utf-8")
+    if len(parts) != 2:
+        return not_found
+    try:
+        zoom = float(parts[1])
+        bbox = tuple(float(value) for value in query.get("bbox", [""])[0].split(","))
+    except ValueError:
+        return not_found
+    if len(bbox) != 4:
+        return not_found
+    return 200, _JSON, json.dumps(index.query(zoom, bbox)).encode("utf-8")
+
+
+def register_cluster_source(
+    data: pd.DataFrame,
+    radius: int = DEFAULT_RADIUS,
+    max_zoom: int = DEFAULT_MAX_ZOOM,
+    latitude: str = "latitude",
+    longitude: str = "longitude",
+) -> str:
+    """Monta (uma vez por versão dos dados) o índice de `data` e devolve o prefixo da URL."""
+    key = hashlib.sha1(
+        f"{fingerprint(data)}{radius}{max_zoom}".encode("utf-8")
+    ).hexdigest()[:16]
+    with _lock:
+        known = key in _cluster_sources
+    if not known:
+        index = ClusterIndex(
+            data[latitude].to_numpy(dtype=float),
+            data[longitude].to_numpy(dtype=float),
+            radius=radius,
+            max_zoom=max_zoom,
+        )
+        with _lock:
+            _cluster_sources.setdefault(key, index)
+            while len(_cluster_sources) > MAX_CLUSTER_SOURCES:
+                del _cluster_sources[next(iter(_cluster_sources))]
+    register_route(CLUSTER_ROUTE, _serve_clusters)
+    return f"{ensure_server()}/{CLUSTER_ROUTE}/{key}/"
+
+
+class ClusterLayer(Layer):
+    """Grupos de `register_cluster_source`, buscados a cada movimento do mapa.
+
+    Parameters
+    ----------
+    url : prefixo devolvido por `register_cluster_source`.
+    popup_url : prefixo de `map_layers.register_popup_source` para as denúncias
+        individuais (mesma ordem de linhas usada no índice).
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function () {
+            var map = {{ this._parent.get_name() }};
+            var options = {{ this.options_js }};
+            var renderer = L.canvas({padding: 0.5});
+            var group = L.layerGroup();
+            var request = 0;
+
+            function clusterIcon(count) {
+                var size = count < 100 ? 30 : count < 1000 ? 38 : 46;
+                var color = count < 100 ? "rgba(110, 204, 57, 0.8)"
+                    : count < 1000 ? "rgba(240, 194, 12, 0.8)" : "rgba(241, 128, 23, 0.8)";
+                return L.divIcon({
+                    html: '<div style="width:' + size + 'px;height:' + size + 'px;line-height:' + size
+                        + 'px;border-radius:50%;background:' + color + ';text-align:center;'
+                        + 'font:bold 12px sans-serif;color:#1F2937">' + count.toLocaleString("pt-BR") + "</div>",
+                    className: "",
+                    iconSize: [size, size]
+                });
+            }
+
+            function bindLazyPopup(marker, row) {
+                marker.bindPopup("Carregando…", {maxWidth: 360});
+                marker.once("popupopen", function () {
+                    fetch(options.popupUrl + row)
+                        .then(function (response) {
+                            if (!response.ok) { throw new Error(response.status); }
+                            return response.text();
+                        })
+                        .then(function (content) { marker.setPopupContent(content); })
+                        .catch(function () {
+                            marker.setPopupContent("Detalhes indisponíveis no momento.");
+                        });
+                });
+            }
+
+            function expand(level, index, latlng) {
+                fetch(options.url + "expand/" + level + "/" + index)
+                    .then(function (response) { return response.json(); })
+                    .then(function (result) { map.flyTo(latlng, result.zoom); })
+                    .catch(function () { map.flyTo(latlng, map.getZoom() + 2); });
+            }
+
+            function refresh() {
+                if (!map.hasLayer(group)) { return; }
+                var bounds = map.getBounds().pad(0.25);
+                var bbox = [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()].join(",");
+                var current = ++request;
+                fetch(options.url + map.getZoom() + "?bbox=" + bbox)
+                    .then(function (response) { return response.json(); })
+                    .then(function (result) {
+                        if (current !== request) { return; }
+                        group.clearLayers();
+                        result.items.forEach(function (item) {
+                            var latlng = L.latLng(item[0], item[1]);
+                            if (item[2] > 1) {
+                                L.marker(latlng, {icon: clusterIcon(item[2])})
+                                    .on("click", function () { expand(result.level, item[3], latlng); })
+                                    .addTo(group);
+                                return;
+                            }
+                            var marker = L.circleMarker(latlng, {
+                                renderer: renderer,
+                                radius: 5,
+                                color: "#1D4ED8",
+                                weight: 1,
+                                fillColor: "#3B82F6",
+                                fillOpacity: 0.85
+                            });
+                            if (options.popupUrl) { bindLazyPopup(marker, item[3]); }
+                            marker.addTo(group);
+                        });
+                    })
+                    .catch(function () {});
+            }
+
+            group.on("add", refresh);
+            map.on("moveend", refresh);
+            return group;
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(
+        self,
+        url: str,
+        popup_url: str | None = None,
+        name: str = "Denúncias",
+        overlay: bool = True,
+        control: bool = True,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "ClusterLayer"
+        self.options_js = json.dumps({"url": url, "popupUrl": popup_url})
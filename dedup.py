@@ -0,0 +1,129 @@
+"""
+Detecção de denúncias repetidas de um mesmo incidente.
+
+Duas denúncias são do mesmo incidente quando estão a até `radius_m` metros e
+a até `window_hours` horas uma da outra (o mesmo endereço geocodificado na
+mesma noite cai aqui). Em vez de comparar todos os pares, cada denúncia é
+espalhada numa célula espacial de `radius_m` metros e num intervalo de
+`window_hours` horas, e só se comparam denúncias de baldes vizinhos: com as
+chaves dos baldes ordenadas, os pares candidatos saem de buscas binárias
+(`np.searchsorted`) para o próprio balde e os 13 deslocamentos da metade
+superior da vizinhança 3 x 3 x 3. O custo é O(n log n) mais o número de pares
+candidatos.
+
+Os pares confirmados formam um grafo cujas componentes conexas são os
+incidentes (`duplicate_groups`); `flag_duplicates` acrescenta o incidente e
+o número de denúncias dele a cada linha.
+"""
+
+from __future__ import annotations
+
+import itertools
+import math
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from spatial_index import EARTH_RADIUS
+
+DEFAULT_RADIUS_M = 30
+DEFAULT_WINDOW_HOURS = 12
+HOUR = np.timedelta64(1, "h")
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180.0
+# metade dos 26 baldes vizinhos: cada par de baldes distintos aparece uma vez
+NEIGHBOUR_OFFSETS = [
+    offset for offset in itertools.product((-1, 0, 1), repeat=3) if offset > (0, 0, 0)
+]
+
+
+def duplicate_groups(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    times: np.ndarray,
+    radius_m: float = DEFAULT_RADIUS_M,
+    window_hours: float = DEFAULT_WINDOW_HOURS,
+) -> np.ndarray:
+    """Incidente de cada denúncia (0..k-1); denúncias sem data ficam sozinhas."""
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    times = np.asarray(times, dtype="datetime64[ns]")
+    n = len(latitude)
+    valid = np.flatnonzero(
+        ~np.isnat(times) & np.isfinite(latitude) & np.isfinite(longitude)
+    )
+    groups = np.empty(n, dtype=np.int64)
+    if not valid.size:
+        groups[:] = np.arange(n)
+        return groups
+
+    scale = METERS_PER_DEGREE * math.cos(math.radians(float(latitude[valid].mean())))
+    x = longitude[valid] * scale
+    y = latitude[valid] * METERS_PER_DEGREE
+    hours = (times[valid] - times[valid].min()) / HOUR
+    cells = np.column_stack(
+        [
+            np.floor(x / radius_m),
+            np.floor(y / radius_m),
+            np.floor(hours / window_hours),
+        ]
+    ).astype(np.int64)
+    # chave única por balde, com margem de 1 para os deslocamentos não se sobreporem
+    cells -= cells.min(axis=0) - 1
+    dims = cells.max(axis=0) + 2
+    strides = np.array([dims[1] * dims[2], dims[2], 1], dtype=np.int64)
+    keys = cells @ strides
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    rows, cols = [], []
+    for offset in [(0, 0, 0), *NEIGHBOUR_OFFSETS]:
+        # somar uma constante mantém as chaves ordenadas: a busca percorre o vetor em ordem
+        target = sorted_keys + np.asarray(offset, dtype=np.int64) @ strides
+        lo = np.searchsorted(sorted_keys, target, side="left")
+        counts = np.searchsorted(sorted_keys, target, side="right") - lo
+        a = order[np.repeat(np.arange(len(keys)), counts)]
+        b = order[
+            np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        ]
+        if offset == (0, 0, 0):
+            a, b = a[a < b], b[a < b]
+        close = (np.hypot(x[a] - x[b], y[a] - y[b]) <= radius_m) & (
+            np.abs(hours[a] - hours[b]) <= window_hours
+        )
+        rows.append(a[close])
+        cols.append(b[close])
+
+    rows = np.concatenate(rows)
+    graph = sparse.coo_matrix(
+        (np.ones(len(rows), dtype=np.int8), (rows, np.concatenate(cols))),
+        shape=(len(valid), len(valid)),
+    )
+    count, labels = connected_components(graph, directed=False)
+    groups[valid] = labels
+    missing = np.setdiff1d(np.arange(n), valid, assume_unique=True)
+    groups[missing] = count + np.arange(len(missing))
+    return groups
+
+
+def flag_duplicates(
+    data: pd.DataFrame,
+    radius_m: float = DEFAULT_RADIUS_M,
+    window_hours: float = DEFAULT_WINDOW_HOURS,
+    time_col: str = "DataInclusao",
+    latitude: str = "latitude",
+    longitude: str = "longitude",
+) -> pd.DataFrame:
+    """Cópia de `data` com as colunas `incidente` e `denuncias_no_incidente`."""
+    groups = duplicate_groups(
+        data[latitude].to_numpy(dtype=float),
+        data[longitude].to_numpy(dtype=float),
+        data[time_col].to_numpy(),
+        radius_m,
+        window_hours,
+    )
+    result = data.copy()
+    result["incidente"] = groups
+    result["denuncias_no_incidente"] = np.bincount(groups)[groups] if len(groups) else 0
+    return result
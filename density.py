@@ -0,0 +1,363 @@
+"""
+Mapa de calor rasterizado no servidor.
+
+Em vez de enviar todas as coordenadas para o Leaflet.heat recalcular a
+densidade a cada movimento do mapa, os pontos são acumulados numa grade em
+pixels Web Mercator do zoom atual (`np.bincount`) e suavizados por um
+núcleo gaussiano aplicado via FFT. O resultado vira um PNG colorido servido
+pelo servidor local e exibido como `ImageOverlay`.
+
+Enquanto a extensão dos dados cabe em `MAX_RASTER_SIDE` pixels, cada zoom
+gera uma única imagem; acima disso, a imagem cobre só a janela de tiles ao
+redor da área visível, também limitada a `MAX_RASTER_SIDE` pixels por lado. As imagens ficam em cache por zoom, raio e janela.
+A escala de cores de cada zoom é fixa (calculada sobre a extensão inteira),
+para que janelas vizinhas tenham cores coerentes.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import math
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from folium.map import Layer
+from jinja2 import Template
+from PIL import Image
+
+from local_server import ensure_server, register_route
+from snapshot import fingerprint
+from vector_tiles import mercator_xy
+
+HEAT_ROUTE = "heatmap"
+TILE_SIZE = 256
+MAX_RASTER_SIDE = 2048
+MAX_HEAT_SOURCES = 8
+MAX_CACHED_IMAGES = 256
+DEFAULT_RADIUS = 20
+REFERENCE_QUANTILE = 0.999
+# gradiente padrão do Leaflet.heat (posição, cor)
+GRADIENT = [
+    (0.0, (0, 0, 255)),
+    (0.4, (0, 0, 255)),
+    (0.6, (0, 255, 255)),
+    (0.7, (0, 255, 0)),
+    (0.8, (255, 255, 0)),
+    (1.0, (255, 0, 0)),
+]
+
+
+def radius_to_sigma(radius: float) -> float:
+    """Converte o raio (px, como no Leaflet.heat) no desvio do núcleo gaussiano."""
+    return max(float(radius), 1.0) / 2.0
+
+
+def _fast_length(n: int) -> int:
+    """Menor tamanho >= n da forma 2^a·3^b·5^c (onde a FFT é mais rápida)."""
+    best = 1 << max(n - 1, 0).bit_length()
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            candidate = power35
+            while candidate < n:
+                candidate *= 2
+            best = min(best, candidate)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+def gaussian_blur(grid: np.ndarray, sigma: float) -> np.ndarray:
+    """Convolução gaussiana via FFT, preservando a massa da grade.
+
+    A grade é completada com zeros (3σ) antes da transformada para evitar
+    que a convolução circular vaze de uma borda para a outra.
+    """
+    if sigma <= 0:
+        return grid
+    pad = int(math.ceil(3 * sigma))
+    rows = _fast_length(grid.shape[0] + pad)
+    cols = _fast_length(grid.shape[1] + pad)
+    fy = np.fft.fftfreq(rows)[:, None]
+    fx = np.fft.rfftfreq(cols)[None, :]
+    response = np.exp(-2.0 * (math.pi * sigma) ** 2 * (fy**2 + fx**2))
+    blurred = np.fft.irfft2(
+        np.fft.rfft2(grid, s=(rows, cols)) * response, s=(rows, cols)
+    )
+    return np.clip(blurred[: grid.shape[0], : grid.shape[1]], 0.0, None)
+
+
+def colorize(intensity: np.ndarray, max_opacity: float = 0.8) -> np.ndarray:
+    """Aplica o gradiente a valores em [0, 1] e devolve uma imagem RGBA (uint8)."""
+    t = np.clip(intensity, 0.0, 1.0)
+    stops = [stop for stop, _ in GRADIENT]
+    rgba = np.empty(t.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        values = [color[channel] for _, color in GRADIENT]
+        rgba[..., channel] = np.interp(t, stops, values).astype(np.uint8)
+    alpha = np.clip(t / 0.4, 0.0, 1.0) * max_opacity
+    alpha[t < 0.01] = 0.0
+    rgba[..., 3] = (alpha * 255).astype(np.uint8)
+    return rgba
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buffer, format="PNG", compress_level=3)
+    return buffer.getvalue()
+
+
+class DensitySource:
+    """Pontos (Web Mercator normalizado, ordenados por x) para rasterização."""
+
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray):
+        x, y = mercator_xy(latitude, longitude)
+        order = np.argsort(x, kind="stable")
+        self.x = x[order]
+        self.y = y[order]
+        if len(self.x):
+            self.bounds = (
+                float(self.x.min()),
+                float(self.y.min()),
+                float(self.x.max()),
+                float(self.y.max()),
+            )
+        else:
+            self.bounds = (0.0, 0.0, 0.0, 0.0)
+        self.reference_max = lru_cache(maxsize=64)(self._reference_max)
+
+    def extent_tiles(self, z: int) -> tuple[int, int, int, int]:
+        """Janela de tiles (x0, y0, x1, y1; x1/y1 exclusivos) que cobre os dados."""
+        scale = 1 << z
+        min_x, min_y, max_x, max_y = self.bounds
+        return (
+            int(min_x * scale),
+            int(min_y * scale),
+            int(max_x * scale) + 1,
+            int(max_y * scale) + 1,
+        )
+
+    def density(
+        self, z: int, window: tuple[int, int, int, int], sigma: float
+    ) -> np.ndarray:
+        """Densidade suavizada na janela de tiles `window`, em pontos por pixel."""
+        x0, y0, x1, y1 = window
+        width, height = (x1 - x0) * TILE_SIZE, (y1 - y0) * TILE_SIZE
+        pad = int(math.ceil(3 * sigma))
+        world = TILE_SIZE * float(1 << z)
+        left, top = x0 * TILE_SIZE - pad, y0 * TILE_SIZE - pad
+        lo, hi = np.searchsorted(
+            self.x, [left / world, (left + width + 2 * pad) / world]
+        )
+        rows, cols = height + 2 * pad, width + 2 * pad
+        px = np.floor(self.x[lo:hi] * world - left).astype(np.int64)
+        py = np.floor(self.y[lo:hi] * world - top).astype(np.int64)
+        inside = (px >= 0) & (px < cols) & (py >= 0) & (py < rows)
+        grid = (
+            np.bincount(py[inside] * cols + px[inside], minlength=rows * cols)
+            .reshape(rows, cols)
+            .astype(np.float64)
+        )
+        return gaussian_blur(grid, sigma)[pad : pad + height, pad : pad + width]
+
+    def _reference_max(self, z: int, sigma: float) -> float:
+        # mesma largura de banda em metros, calculada num zoom em que a extensão
+        # inteira cabe numa imagem; a densidade por pixel escala com 4^(Δzoom)
+        ref_zoom = z
+        while ref_zoom > 0:
+            x0, y0, x1, y1 = self.extent_tiles(ref_zoom)
+            if max(x1 - x0, y1 - y0) * TILE_SIZE <= MAX_RASTER_SIDE:
+                break
+            ref_zoom -= 1
+        ref_sigma = max(sigma / (1 << (z - ref_zoom)), 0.5)
+        grid = self.density(ref_zoom, self.extent_tiles(ref_zoom), ref_sigma)
+        positive = grid[grid > 0]
+        if positive.size == 0:
+            return 1.0
+        return float(np.quantile(positive, REFERENCE_QUANTILE)) / 4 ** (z - ref_zoom)
+
+    def render_png(
+        self, z: int, window: tuple[int, int, int, int], radius: float
+    ) -> bytes:
+        sigma = radius_to_sigma(radius)
+        grid = self.density(z, window, sigma)
+        return encode_png(colorize(grid / self.reference_max(z, sigma)))
+
+
+_heat_sources: OrderedDict[str, DensitySource] = OrderedDict()
+_image_cache: OrderedDict[tuple, bytes] = OrderedDict()
+# protege as duas tabelas: o servidor local atende as imagens em outras threads
+_lock = threading.Lock()
+
+
+def _serve_heatmap(
+    parts: list[str], query: dict[str, list[str]]
+) -> tuple[int, str, bytes]:
+    not_found = (404, "text/plain; charset=utf-8", b"heatmap not found")
+    if len(parts) != 7:
+        return not_found
+    numbers = parts[1:6] + [parts[6].removesuffix(".png")]
+    if not all(number.isdigit() for number in numbers):
+        return not_found
+    radius, z, x0, y0, x1, y1 = (int(number) for number in numbers)
+    if not (0 < radius <= 200 and z <= 22 and x1 > x0 and y1 > y0):
+        return not_found
+    # a camada nunca pede janelas maiores que `maxSide` (ver `HeatRasterLayer`)
+    if max(x1 - x0, y1 - y0) * TILE_SIZE > MAX_RASTER_SIDE:
+        return 400, "text/plain; charset=utf-8", b"window too large"
+    cache_key = (parts[0], radius, z, x0, y0, x1, y1)
+    with _lock:
+        source = _heat_sources.get(parts[0])
+        body = _image_cache.get(cache_key)
+        if body is not None:
+            _image_cache.move_to_end(cache_key)
+    if source is None:
+        return not_found
+    if body is None:
+        body = source.render_png(z, (x0, y0, x1, y1), radius)
+        with _lock:
+            # a fonte pode ter sido descartada durante a renderização
+            if parts[0] in _heat_sources:
+                _image_cache[cache_key] = body
+                while len(_image_cache) > MAX_CACHED_IMAGES:
+                    _image_cache.popitem(last=False)
+    return 200, "image/png", body
+
+
+def register_heat_source(
+    data: pd.DataFrame,
+    radius: int = DEFAULT_RADIUS,
+    latitude: str = "latitude",
+    longitude: str = "longitude",
+) -> str:
+    """Disponibiliza a densidade de `data` no servidor local.
+
+    Devolve o prefixo de URL ao qual a camada acrescenta `z/x0/y0/x1/y1.png`.
+    """
+    key = hashlib.sha1(
+        f"{fingerprint(data)}{latitude}{longitude}".encode("utf-8")
+    ).hexdigest()[:16]
+    with _lock:
+        known = key in _heat_sources
+        if known:
+            _heat_sources.move_to_end(key)
+    if not known:
+        source = DensitySource(
+            data[latitude].to_numpy(dtype=float), data[longitude].to_numpy(dtype=float)
+        )
+        with _lock:
+            _heat_sources.setdefault(key, source)
+            _heat_sources.move_to_end(key)
+            while len(_heat_sources) > MAX_HEAT_SOURCES:
+                evicted, _ = _heat_sources.popitem(last=False)
+                for cached in [k for k in _image_cache if k[0] == evicted]:
+                    del _image_cache[cached]
+    register_route(HEAT_ROUTE, _serve_heatmap)
+    return f"{ensure_server()}/{HEAT_ROUTE}/{key}/{int(radius)}/"
+
+
+class HeatRasterLayer(Layer):
+    """Exibe o raster de `register_heat_source`, trocando a imagem a cada zoom.
+
+    Parameters
+    ----------
+    url : prefixo devolvido por `register_heat_source`.
+    bounds : [[lat_min, lon_min], [lat_max, lon_max]] dos dados.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function () {
+            var map = {{ this._parent.get_name() }};
+            var options = {{ this.options_js }};
+            var dataBounds = L.latLngBounds(options.bounds);
+            var group = L.layerGroup();
+            var overlay = null;
+            var current = null;
+
+            function tileRange(bounds, zoom) {
+                var nw = map.project(bounds.getNorthWest(), zoom).divideBy(options.tileSize).floor();
+                var se = map.project(bounds.getSouthEast(), zoom).divideBy(options.tileSize).floor();
+                return [nw.x, nw.y, se.x + 1, se.y + 1];
+            }
+
+            function update() {
+                if (!map.hasLayer(group)) { return; }
+                var zoom = Math.round(map.getZoom());
+                var range = tileRange(dataBounds, zoom);
+                var side = Math.max(range[2] - range[0], range[3] - range[1]) * options.tileSize;
+                if (side > options.maxSide) {
+                    var view = tileRange(map.getBounds(), zoom);
+                    range = [
+                        Math.max(range[0], view[0] - 1),
+                        Math.max(range[1], view[1] - 1),
+                        Math.min(range[2], view[2] + 1),
+                        Math.min(range[3], view[3] + 1)
+                    ];
+                    if (range[2] <= range[0] || range[3] <= range[1]) { return; }
+                    // telas maiores que maxSide ficam com a janela central
+                    var maxTiles = Math.floor(options.maxSide / options.tileSize);
+                    for (var axis = 0; axis < 2; axis++) {
+                        var extra = range[axis + 2] - range[axis] - maxTiles;
+                        if (extra > 0) {
+                            range[axis] += Math.floor(extra / 2);
+                            range[axis + 2] = range[axis] + maxTiles;
+                        }
+                    }
+                }
+                var key = zoom + "/" + range.join("/");
+                if (key === current) { return; }
+                current = key;
+                var corners = L.latLngBounds(
+                    map.unproject([range[0] * options.tileSize, range[1] * options.tileSize], zoom),
+                    map.unproject([range[2] * options.tileSize, range[3] * options.tileSize], zoom)
+                );
+                var next = L.imageOverlay(options.url + key + ".png", corners, {
+                    opacity: 1,
+                    interactive: false
+                });
+                next.once("load", function () {
+                    if (key !== current) {
+                        group.removeLayer(next);
+                        return;
+                    }
+                    if (overlay) { group.removeLayer(overlay); }
+                    overlay = next;
+                });
+                group.addLayer(next);
+            }
+
+            group.on("add", function () { current = null; update(); });
+            map.on("zoomend moveend", update);
+            return group;
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(
+        self,
+        url: str,
+        bounds: list[list[float]],
+        name: str = "Mapa de calor",
+        overlay: bool = True,
+        control: bool = True,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "HeatRasterLayer"
+        self.options_js = json.dumps(
+            {
+                "url": url,
+                "bounds": bounds,
+                "tileSize": TILE_SIZE,
+                "maxSide": MAX_RASTER_SIDE,
+            }
+        )
@@ -0,0 +1,160 @@
+"""
+Curva do cotovelo (WCSS por número de clusters) com ajustes encadeados e em paralelo.
+
+Os valores de k são divididos em blocos contíguos, um por processo do pool
+(`POOL_WORKERS`, a fração dos núcleos que cabe a cada trabalho de `jobs`).
+Dentro de cada bloco os ajustes são encadeados: o k + 1 parte dos centróides
+do k, com o cluster de maior soma de quadrados dividido em dois ao longo do
+seu eixo principal, e faz uma única inicialização. Só o primeiro k de cada
+bloco usa o k-means++. Acima de `MINIBATCH_MIN_POINTS` pontos os ajustes
+usam `MiniBatchKMeans`.
+
+Para cada k também são calculados a silhueta e o índice de Calinski–Harabasz,
+sobre uma amostra fixa de até `SCORE_SAMPLE` pontos.
+
+Abaixo de `PARALLEL_MIN_POINTS` pontos, subir processos custa mais que os
+próprios ajustes, e a curva inteira é calculada como um único bloco no
+processo da página.
+"""
+
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import os
+import threading
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import calinski_harabasz_score, silhouette_score
+
+from jobs import MAX_WORKERS as JOB_WORKERS
+
+PARALLEL_MIN_POINTS = 50_000
+MINIBATCH_MIN_POINTS = 500_000
+SCORE_SAMPLE = 1_000
+ELBOW_COLUMNS = ["Clusters", "WCSS", "Silhueta", "Calinski-Harabasz"]
+# até `JOB_WORKERS` curvas podem rodar ao mesmo tempo, cada uma em seu trabalho
+POOL_WORKERS = max(1, (os.cpu_count() or 1) // JOB_WORKERS)
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # "spawn" evita copiar, via fork, as threads do servidor do Streamlit
+            _executor = ProcessPoolExecutor(
+                max_workers=POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            atexit.register(_executor.shutdown, cancel_futures=True)
+        return _executor
+
+
+def split_seed(
+    points: np.ndarray, centers: np.ndarray, labels: np.ndarray
+) -> np.ndarray:
+    """Centróides iniciais para k + 1: divide o cluster de maior soma de quadrados."""
+    residuals = ((points - centers[labels]) ** 2).sum(axis=1)
+    worst = int(
+        np.argmax(np.bincount(labels, weights=residuals, minlength=len(centers)))
+    )
+    members = points[labels == worst]
+    if len(members) < 2:
+        return np.vstack([centers, points[np.argmax(residuals)]])
+    center = members.mean(axis=0)
+    variances, vectors = np.linalg.eigh(np.cov(members, rowvar=False))
+    offset = vectors[:, -1] * np.sqrt(max(variances[-1], 0.0))
+    seeds = centers.copy()
+    seeds[worst] = center - offset
+    return np.vstack([seeds, center + offset])
+
+
+def _scores(sample: np.ndarray, labels: np.ndarray) -> tuple[float, float]:
+    n_labels = len(np.unique(labels))
+    if not 2 <= n_labels < len(sample):
+        return float("nan"), float("nan")
+    return (
+        float(silhouette_score(sample, labels)),
+        float(calinski_harabasz_score(sample, labels)),
+    )
+
+
+def fit_chain(
+    points: np.ndarray,
+    ks: list[int],
+    sample_index: np.ndarray,
+    random_state: int = 42,
+    progress: Callable[[float], None] | None = None,
+) -> list[tuple[int, float, float, float]]:
+    """Ajusta os `ks` (consecutivos) em sequência, cada um semeado pelo anterior.
+
+    `progress(fração)` é chamada após cada k.
+    """
+    model_class = MiniBatchKMeans if len(points) >= MINIBATCH_MIN_POINTS else KMeans
+    rows = []
+    init: np.ndarray | None = None
+    for k in ks:
+        if init is None:
+            model = model_class(n_clusters=k, n_init="auto", random_state=random_state)
+        else:
+            model = model_class(
+                n_clusters=k, init=init, n_init=1, random_state=random_state
+            )
+        labels = model.fit_predict(points)
+        silhouette, calinski = _scores(points[sample_index], labels[sample_index])
+        rows.append((k, float(model.inertia_), silhouette, calinski))
+        init = split_seed(points, model.cluster_centers_, labels)
+        if progress is not None:
+            progress(len(rows) / len(ks))
+    return rows
+
+
+def elbow_curve(
+    points: np.ndarray,
+    max_clusters: int = 10,
+    random_state: int = 42,
+    workers: int | None = None,
+    progress: Callable[[float], None] | None = None,
+) -> pd.DataFrame:
+    """WCSS, silhueta e Calinski–Harabasz para k = 1..`max_clusters`.
+
+    `progress(fração)` é chamada após cada k (ou cada bloco, no pool); uma
+    exceção lançada por ela interrompe o cálculo.
+    """
+    points = np.ascontiguousarray(points, dtype=float)
+    ks = list(range(1, min(max_clusters, len(points)) + 1))
+    if not ks:
+        return pd.DataFrame(columns=ELBOW_COLUMNS)
+    rng = np.random.default_rng(random_state)
+    sample_index = np.sort(
+        rng.choice(len(points), size=min(SCORE_SAMPLE, len(points)), replace=False)
+    )
+
+    workers = workers or POOL_WORKERS
+    n_chunks = min(workers, len(ks)) if len(points) >= PARALLEL_MIN_POINTS else 1
+    chunks = [list(map(int, chunk)) for chunk in np.array_split(ks, n_chunks)]
+    if n_chunks == 1:
+        rows = fit_chain(points, ks, sample_index, random_state, progress)
+    else:
+        futures = [
+            _pool().submit(fit_chain, points, chunk, sample_index, random_state)
+            for chunk in chunks
+        ]
+        rows = []
+        try:
+            for future in as_completed(futures):
+                rows.extend(future.result())
+                if progress is not None:
+                    progress(len(rows) / len(ks))
+        finally:
+            for future in futures:
+                future.cancel()
+        rows.sort()
+    return pd.DataFrame(rows, columns=ELBOW_COLUMNS)
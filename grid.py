@@ -0,0 +1,219 @@
+"""
+Agregação das denúncias em grades quadradas ou hexagonais.
+
+As coordenadas são projetadas uma única vez em metros (projeção
+equirretangular local, adequada à escala de um município) e cada ponto
+recebe, numa passada vetorizada do NumPy, o identificador da sua célula em
+todas as formas e resoluções de `GRID_SHAPES` x `GRID_RESOLUTIONS`. O índice
+resultante é calculado por carga de dados; as contagens de uma seleção de
+filtros saem de um `np.bincount` sobre as posições selecionadas, quebradas
+por `Tipo de Fonte`.
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+GRID_SHAPES = {
+    "hexagonal": "Hexagonal",
+    "quadrada": "Quadrada",
+}
+# distância entre lados opostos da célula, em metros
+GRID_RESOLUTIONS = (250, 500, 1000, 2000)
+CATEGORY_COLUMN = "Tipo de Fonte"
+MISSING_LABEL = "Não informado"
+EARTH_RADIUS = 6_371_008.8
+COORD_DECIMALS = 6
+
+_SQRT3 = math.sqrt(3.0)
+_KEY_OFFSET = 1 << 31
+
+
+def _pack(q: np.ndarray, r: np.ndarray) -> np.ndarray:
+    return (q.astype(np.int64) + _KEY_OFFSET) * (1 << 32) + (
+        r.astype(np.int64) + _KEY_OFFSET
+    )
+
+
+def _unpack(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return keys // (1 << 32) - _KEY_OFFSET, keys % (1 << 32) - _KEY_OFFSET
+
+
+def square_cells(
+    x: np.ndarray, y: np.ndarray, size: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Coluna e linha da célula quadrada de lado `size` que contém cada ponto."""
+    return np.floor(x / size).astype(np.int64), np.floor(y / size).astype(np.int64)
+
+
+def hex_cells(
+    x: np.ndarray, y: np.ndarray, size: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Coordenadas axiais (q, r) do hexágono (vértice para cima) que contém cada ponto.
+
+    `size` é a distância entre lados opostos; o arredondamento é feito em
+    coordenadas cúbicas, corrigindo o eixo com o maior erro.
+    """
+    radius = size / _SQRT3
+    qf = (_SQRT3 / 3.0 * x - y / 3.0) / radius
+    rf = (2.0 / 3.0 * y) / radius
+    sf = -qf - rf
+    q, r, s = np.rint(qf), np.rint(rf), np.rint(sf)
+    dq, dr, ds = np.abs(q - qf), np.abs(r - rf), np.abs(s - sf)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    q = np.where(fix_q, -r - s, q)
+    r = np.where(fix_r, -q - s, r)
+    return q.astype(np.int64), r.astype(np.int64)
+
+
+def _cell_centers(shape: str, size: float, q: np.ndarray, r: np.ndarray) -> np.ndarray:
+    """Centros (n, 2) das células, em metros (x, y)."""
+    if shape == "quadrada":
+        return np.column_stack([(q + 0.5) * size, (r + 0.5) * size]).astype(float)
+    radius = size / _SQRT3
+    return np.column_stack([radius * _SQRT3 * (q + r / 2.0), radius * 1.5 * r]).astype(
+        float
+    )
+
+
+def _cell_vertices(shape: str, size: float, q: np.ndarray, r: np.ndarray) -> np.ndarray:
+    """Vértices (n, k, 2) das células, em metros (x, y), fechando o anel."""
+    if shape == "quadrada":
+        offsets = np.array([[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]], dtype=float) * size
+        origin = np.column_stack([q * size, r * size]).astype(float)
+        return origin[:, None, :] + offsets[None, :, :]
+    radius = size / _SQRT3
+    centers = _cell_centers(shape, size, q, r)
+    angles = np.radians(60.0 * np.arange(7) - 30.0)
+    offsets = np.column_stack([np.cos(angles), np.sin(angles)]) * radius
+    return centers[:, None, :] + offsets[None, :, :]
+
+
+@dataclass
+class GridIndex:
+    """Células de cada denúncia em todas as formas e resoluções."""
+
+    index: pd.Index
+    origin: tuple[float, float]
+    cos_lat: float
+    categories: list[str]
+    category_codes: np.ndarray
+    # (forma, resolução) -> (código da célula por ponto, chaves das células)
+    assignments: dict[tuple[str, int], tuple[np.ndarray, np.ndarray]] = field(
+        default_factory=dict
+    )
+
+    def to_latlon(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        lat0, lon0 = self.origin
+        lat = lat0 + np.degrees(y / EARTH_RADIUS)
+        lon = lon0 + np.degrees(x / (EARTH_RADIUS * self.cos_lat))
+        return lat, lon
+
+    def positions(self, subset: pd.DataFrame) -> np.ndarray:
+        """Posições, no índice, das linhas de `subset` (um recorte dos dados originais)."""
+        positions = self.index.get_indexer(subset.index)
+        return positions[positions >= 0]
+
+    def cell_counts(
+        self, shape: str, size: int, positions: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Matriz (células x categorias) com as contagens das posições selecionadas."""
+        codes, keys = self.assignments[(shape, size)]
+        category_codes = self.category_codes
+        if positions is not None:
+            codes, category_codes = codes[positions], category_codes[positions]
+        n_categories = len(self.categories)
+        return np.bincount(
+            codes * n_categories + category_codes,
+            minlength=len(keys) * n_categories,
+        ).reshape(len(keys), n_categories)
+
+    def cell_centers(
+        self, shape: str, size: int, cells: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Latitude e longitude do centro das células indicadas (todas, por padrão)."""
+        _, keys = self.assignments[(shape, size)]
+        q, r = _unpack(keys if cells is None else keys[cells])
+        centers = _cell_centers(shape, size, q, r)
+        return self.to_latlon(centers[:, 0], centers[:, 1])
+
+    def cell_polygons(self, shape: str, size: int, cells: np.ndarray) -> np.ndarray:
+        """Anéis (n, k, 2) em [lon, lat] das células indicadas."""
+        _, keys = self.assignments[(shape, size)]
+        q, r = _unpack(keys[cells])
+        vertices = _cell_vertices(shape, size, q, r)
+        lat, lon = self.to_latlon(vertices[..., 0], vertices[..., 1])
+        return np.round(np.stack([lon, lat], axis=-1), COORD_DECIMALS)
+
+
+def build_grid_index(
+    data: pd.DataFrame,
+    latitude: str = "latitude",
+    longitude: str = "longitude",
+    category: str = CATEGORY_COLUMN,
+    shapes: tuple[str, ...] = tuple(GRID_SHAPES),
+    resolutions: tuple[int, ...] = GRID_RESOLUTIONS,
+) -> GridIndex:
+    """Projeta os pontos uma vez e atribui as células em todas as grades."""
+    lat = data[latitude].to_numpy(dtype=float)
+    lon = data[longitude].to_numpy(dtype=float)
+    origin = (float(np.nanmin(lat)), float(np.nanmin(lon))) if len(lat) else (0.0, 0.0)
+    cos_lat = math.cos(math.radians(float(np.nanmean(lat)))) if len(lat) else 1.0
+    x = np.radians(lon - origin[1]) * EARTH_RADIUS * cos_lat
+    y = np.radians(lat - origin[0]) * EARTH_RADIUS
+
+    if category in data.columns:
+        labels = data[category].astype(object).where(data[category].notna(), "")
+        labels = labels.astype(str).str.strip().replace("", MISSING_LABEL)
+        category_codes, uniques = pd.factorize(labels, sort=True)
+        categories = list(uniques)
+    else:
+        category_codes = np.zeros(len(data), dtype=np.int64)
+        categories = [MISSING_LABEL]
+
+    grid = GridIndex(
+        index=data.index,
+        origin=origin,
+        cos_lat=cos_lat,
+        categories=categories,
+        category_codes=np.asarray(category_codes, dtype=np.int64),
+    )
+    for shape in shapes:
+        assign = square_cells if shape == "quadrada" else hex_cells
+        for size in resolutions:
+            keys, codes = np.unique(_pack(*assign(x, y, size)), return_inverse=True)
+            grid.assignments[(shape, size)] = (codes.astype(np.int64), keys)
+    return grid
+
+
+def cells_feature_collection(
+    grid: GridIndex,
+    shape: str,
+    size: int,
+    positions: np.ndarray | None = None,
+) -> dict:
+    """Um polígono por célula não vazia, com o total e a quebra por `Tipo de Fonte`."""
+    counts = grid.cell_counts(shape, size, positions)
+    totals = counts.sum(axis=1)
+    cells = np.flatnonzero(totals)
+    rings = grid.cell_polygons(shape, size, cells).tolist()
+    features = []
+    for ring, cell in zip(rings, cells.tolist()):
+        breakdown = [
+            [grid.categories[code], int(counts[cell, code])]
+            for code in np.argsort(-counts[cell], kind="stable").tolist()
+            if counts[cell, code]
+        ]
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [ring]},
+                "properties": {"total": int(totals[cell]), "tipos": breakdown},
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
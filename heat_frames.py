@@ -0,0 +1,191 @@
+"""
+Quadros do mapa de calor temporal (`HeatMapWithTime`) com custo linear.
+
+As denúncias são ordenadas uma única vez pelo instante de inclusão; cada
+quadro é um recorte contíguo desse índice, localizado com `searchsorted`
+nas fronteiras dos períodos (hora, dia ou semana ISO), sem reagrupar o
+DataFrame. Modos disponíveis:
+
+- `delta`: apenas as denúncias do período (cada ponto aparece uma vez);
+- `janela`: as denúncias dos últimos `window` períodos;
+- `grade`: contagens por célula de uma grade fixa, ponderadas, na janela
+  móvel ou acumuladas desde o início. O tamanho de cada quadro fica limitado
+  pelo número de células ocupadas, e não pelo de denúncias.
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from rollups import RESOLUTIONS, TIME_COLUMN, floor_period
+
+FRAME_RESOLUTIONS = ("hora", "dia", "semana")
+FRAME_MODES = {
+    "delta": "Por período",
+    "janela": "Janela móvel",
+    "grade": "Grade ponderada",
+}
+FRAME_LABEL_FORMATS = {
+    "hora": "%d/%m/%Y %H:00",
+    "dia": "%d/%m/%Y",
+    "semana": "Semana de %d/%m/%Y",
+}
+MAX_FRAMES = 1500
+DEFAULT_CELL_METERS = 200
+COORD_DECIMALS = 5
+WEIGHT_DECIMALS = 3
+METERS_PER_DEGREE = 111_320.0
+
+
+@dataclass
+class TimeIndex:
+    """Coordenadas das denúncias ordenadas pelo instante de inclusão."""
+
+    times: np.ndarray
+    latitude: np.ndarray
+    longitude: np.ndarray
+
+    @classmethod
+    def from_frame(
+        cls,
+        data: pd.DataFrame,
+        time_col: str = TIME_COLUMN,
+        latitude: str = "latitude",
+        longitude: str = "longitude",
+    ) -> TimeIndex:
+        times = pd.to_datetime(data[time_col], errors="coerce").to_numpy(
+            "datetime64[ns]"
+        )
+        valid = ~np.isnat(times)
+        order = np.argsort(times[valid], kind="stable")
+        return cls(
+            times=times[valid][order],
+            latitude=data[latitude].to_numpy(dtype=float)[valid][order],
+            longitude=data[longitude].to_numpy(dtype=float)[valid][order],
+        )
+
+    def span(self, start: pd.Timestamp, end: pd.Timestamp) -> slice:
+        """Posições das denúncias em [start, end)."""
+        lo, hi = np.searchsorted(
+            self.times,
+            [np.datetime64(pd.Timestamp(start)), np.datetime64(pd.Timestamp(end))],
+            side="left",
+        )
+        return slice(int(lo), int(hi))
+
+    def period_edges(
+        self, span: slice, resolution: str
+    ) -> tuple[pd.DatetimeIndex, np.ndarray]:
+        """Períodos que cobrem `span` (inclusive os vazios) e suas fronteiras no índice.
+
+        O período `i` corresponde às posições `edges[i]:edges[i + 1]`.
+        """
+        times = self.times[span]
+        if not len(times):
+            return pd.DatetimeIndex([]), np.array([span.start], dtype=np.int64)
+        first, last = floor_period(pd.Series(times[[0, -1]]), resolution)
+        labels = pd.date_range(first, last, freq=RESOLUTIONS[resolution])
+        starts = np.searchsorted(times, labels.to_numpy("datetime64[ns]"), side="left")
+        edges = np.append(starts, len(times)).astype(np.int64) + span.start
+        return labels, edges
+
+
+def frame_count(start: pd.Timestamp, end: pd.Timestamp, resolution: str) -> int:
+    """Quantidade de quadros que o intervalo [start, end) gera na resolução."""
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if end <= start:
+        return 0
+    # `end` é exclusivo: o último quadro é o período do instante anterior a ele
+    bounds = floor_period(pd.Series([start, end - pd.Timedelta(1, "ns")]), resolution)
+    return len(
+        pd.date_range(bounds.iloc[0], bounds.iloc[1], freq=RESOLUTIONS[resolution])
+    )
+
+
+def frame_labels(labels: pd.DatetimeIndex, resolution: str) -> list[str]:
+    return list(labels.strftime(FRAME_LABEL_FORMATS[resolution]))
+
+
+def _rounded_coords(index: TimeIndex, lo: int, hi: int) -> np.ndarray:
+    return np.round(
+        np.column_stack([index.latitude[lo:hi], index.longitude[lo:hi]]), COORD_DECIMALS
+    )
+
+
+def delta_frames(index: TimeIndex, edges: np.ndarray) -> list[list[list[float]]]:
+    """Cada quadro traz só as denúncias do seu período."""
+    coords = _rounded_coords(index, edges[0], edges[-1])
+    offsets = edges - edges[0]
+    return [coords[offsets[i] : offsets[i + 1]].tolist() for i in range(len(edges) - 1)]
+
+
+def window_frames(
+    index: TimeIndex, edges: np.ndarray, window: int
+) -> list[list[list[float]]]:
+    """Cada quadro traz as denúncias dos últimos `window` períodos."""
+    coords = _rounded_coords(index, edges[0], edges[-1])
+    offsets = edges - edges[0]
+    return [
+        coords[offsets[max(0, i - window + 1)] : offsets[i + 1]].tolist()
+        for i in range(len(edges) - 1)
+    ]
+
+
+def grid_frames(
+    index: TimeIndex,
+    edges: np.ndarray,
+    window: int | None = 1,
+    cell_meters: float = DEFAULT_CELL_METERS,
+) -> list[list[list[float]]]:
+    """Quadros `[lat, lon, peso]` por célula, com peso normalizado pelo máximo.
+
+    Cada denúncia é associada à sua célula uma única vez; as contagens da janela
+    são atualizadas somando o período que entra e subtraindo o que sai.
+    `window=None` acumula desde o primeiro período.
+    """
+    lo, hi = int(edges[0]), int(edges[-1])
+    n_frames = len(edges) - 1
+    if hi <= lo:
+        return [[] for _ in range(n_frames)]
+    lat, lon = index.latitude[lo:hi], index.longitude[lo:hi]
+    cell_lat = cell_meters / METERS_PER_DEGREE
+    cell_lon = cell_lat / max(math.cos(math.radians(float(lat.mean()))), 1e-6)
+    row = np.floor((lat - lat.min()) / cell_lat).astype(np.int64)
+    col = np.floor((lon - lon.min()) / cell_lon).astype(np.int64)
+    _, cells = np.unique(row * (int(col.max()) + 1) + col, return_inverse=True)
+    n_cells = int(cells.max()) + 1
+    totals = np.bincount(cells, minlength=n_cells)
+    centers = np.round(
+        np.column_stack(
+            [
+                np.bincount(cells, weights=lat, minlength=n_cells) / totals,
+                np.bincount(cells, weights=lon, minlength=n_cells) / totals,
+            ]
+        ),
+        COORD_DECIMALS,
+    )
+
+    offsets = edges - lo
+    counts = np.zeros(n_cells, dtype=np.int64)
+    snapshots = []
+    peak = 1
+    for i in range(n_frames):
+        counts += np.bincount(cells[offsets[i] : offsets[i + 1]], minlength=n_cells)
+        if window is not None and i >= window:
+            leaving = cells[offsets[i - window] : offsets[i - window + 1]]
+            counts -= np.bincount(leaving, minlength=n_cells)
+        occupied = np.flatnonzero(counts)
+        snapshots.append((occupied, counts[occupied].copy()))
+        if occupied.size:
+            peak = max(peak, int(counts[occupied].max()))
+
+    return [
+        np.column_stack(
+            [centers[occupied], np.round(values / peak, WEIGHT_DECIMALS)]
+        ).tolist()
+        for occupied, values in snapshots
+    ]
@@ -0,0 +1,196 @@
+"""
+Execução em segundo plano dos agrupamentos, com progresso e cancelamento.
+
+Cada trabalho pertence a um grupo (ex.: o agrupamento de uma sessão) e é
+identificado pelos parâmetros que o definem. Submeter uma chave nova num
+grupo cancela o trabalho anterior desse grupo ainda pendente ou em execução;
+submeter uma chave conhecida devolve o mesmo trabalho, de modo que uma nova
+execução do script não recalcula nada. Enquanto o trabalho mais recente roda,
+a página continua exibindo o último concluído.
+
+Os grupos guardam só o trabalho mais recente, e o registro é limitado: um
+grupo sem submissões há `GROUP_TTL_S` segundos (a sessão foi fechada) ou
+além dos `MAX_GROUPS` usados mais recentemente é esquecido, o trabalho dele
+ainda em execução é cancelado e os concluídos passam a poder ser descartados
+(as páginas guardam o último resultado da sessão em `st.session_state`).
+
+O cancelamento é cooperativo: a função recebe o próprio `Job` e chama
+`job.report(fração, mensagem)` entre as etapas; se o trabalho tiver sido
+substituído, `report` lança `JobCancelled`. Os trabalhos rodam num pool de
+threads único por processo, fora da thread do script do Streamlit (NumPy e
+scikit-learn liberam o GIL nas partes pesadas); por isso as funções
+submetidas não devem chamar `st.*`.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any
+
+PENDING = "pendente"
+RUNNING = "executando"
+COMPLETED = "concluído"
+CANCELLED = "cancelado"
+FAILED = "erro"
+FINAL_STATES = (COMPLETED, CANCELLED, FAILED)
+
+MAX_WORKERS = 4
+MAX_JOBS = 32
+MAX_GROUPS = 16
+GROUP_TTL_S = 30 * 60
+
+
+class JobCancelled(Exception):
+    """O trabalho foi substituído por outro do mesmo grupo."""
+
+
+@dataclass(eq=False)
+class Job:
+    group: str
+    key: Hashable
+    status: str = PENDING
+    progress: float = 0.0
+    message: str = ""
+    result: Any = None
+    error: BaseException | None = None
+    _cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINAL_STATES
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def report(self, fraction: float, message: str = "") -> None:
+        """Atualiza o progresso; lança `JobCancelled` se o trabalho foi substituído."""
+        if self._cancel.is_set():
+            raise JobCancelled(self.key)
+        self.progress = min(max(float(fraction), 0.0), 1.0)
+        if message:
+            self.message = message
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done.wait(timeout)
+
+    def get(self, poll: Job | None = None) -> Any:
+        """Resultado do trabalho, aguardando a conclusão.
+
+        Dentro de outro trabalho, passe-o em `poll` para que a espera seja
+        interrompida caso ele seja cancelado.
+        """
+        while not self.wait(0.2):
+            if poll is not None:
+                poll.report(poll.progress)
+        if self.status == FAILED:
+            raise self.error
+        if self.status == CANCELLED:
+            raise JobCancelled(self.key)
+        return self.result
+
+
+class JobRunner:
+    """Pool de threads com os trabalhos indexados por (grupo, chave)."""
+
+    def __init__(
+        self,
+        max_workers: int = MAX_WORKERS,
+        max_jobs: int = MAX_JOBS,
+        max_groups: int = MAX_GROUPS,
+        group_ttl: float = GROUP_TTL_S,
+    ):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="jobs"
+        )
+        self._lock = threading.Lock()
+        self._max_jobs = max_jobs
+        self._max_groups = max_groups
+        self._group_ttl = group_ttl
+        self._jobs: OrderedDict[tuple[str, Hashable], Job] = OrderedDict()
+        # grupo -> (trabalho mais recente, instante da última submissão), do mais antigo ao mais novo
+        self._latest: OrderedDict[str, tuple[Job, float]] = OrderedDict()
+
+    def submit(self, group: str, key: Hashable, fn: Callable[[Job], Any]) -> Job:
+        """Trabalho de `fn(job)` para `key`, reaproveitado se já existir e não tiver falhado."""
+        with self._lock:
+            job = self._jobs.get((group, key))
+            reuse = job is not None and job.status not in (CANCELLED, FAILED)
+            previous, _ = self._latest.get(group, (None, 0.0))
+            if previous is not None and previous is not job and not previous.done:
+                previous.cancel()
+            if reuse:
+                self._jobs.move_to_end((group, key))
+            else:
+                job = Job(group=group, key=key)
+                self._jobs[(group, key)] = job
+            self._latest[group] = (job, time.monotonic())
+            self._latest.move_to_end(group)
+            self._expire_groups()
+            self._evict()
+        if not reuse:
+            self._executor.submit(self._run, job, fn)
+        return job
+
+    def _expire_groups(self) -> None:
+        """Esquece os grupos ociosos além do TTL ou do limite, cancelando o que ainda roda."""
+        deadline = time.monotonic() - self._group_ttl
+        while self._latest:
+            group, (job, touched) = next(iter(self._latest.items()))
+            if touched >= deadline and len(self._latest) <= self._max_groups:
+                break
+            del self._latest[group]
+            if not job.done:
+                job.cancel()
+
+    def _evict(self) -> None:
+        """Descarta os concluídos de grupos esquecidos e, depois, os mais antigos além do limite."""
+        keep = {id(job) for job, _ in self._latest.values()}
+        for job_key, job in list(self._jobs.items()):
+            if job.done and job_key[0] not in self._latest:
+                del self._jobs[job_key]
+        for job_key in list(self._jobs):
+            if len(self._jobs) <= self._max_jobs:
+                break
+            job = self._jobs[job_key]
+            if job.done and id(job) not in keep:
+                del self._jobs[job_key]
+
+    def _run(self, job: Job, fn: Callable[[Job], Any]) -> None:
+        try:
+            if job.cancelled:
+                raise JobCancelled(job.key)
+            job.status = RUNNING
+            job.result = fn(job)
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as exc:  # o erro é exibido pela página, não derruba o pool
+            job.error = exc
+            job.status = FAILED
+        else:
+            job.progress = 1.0
+            job.status = COMPLETED
+        finally:
+            job._done.set()
+
+
+_runner: JobRunner | None = None
+_runner_lock = threading.Lock()
+
+
+def runner() -> JobRunner:
+    """Executor compartilhado por todas as sessões do processo."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
@@ -0,0 +1,118 @@
+"""
+Servidor HTTP local, executado numa thread em segundo plano, para os mapas
+buscarem conteúdo sob demanda (popups, tiles etc.) sem reenviar a página.
+
+Cada recurso registra uma rota pelo primeiro segmento do caminho
+(`/<rota>/...`). O servidor é iniciado uma única vez por processo, na porta
+`DENUNCIAS_SERVER_PORT` (8765 por padrão; se estiver ocupada, uma porta livre
+é escolhida). Quando o navegador não acessa a máquina do Streamlit pelo
+`localhost` (proxy reverso, deploy remoto), defina `DENUNCIAS_SERVER_URL` com
+o endereço público que encaminha para essa porta.
+
+As respostas só liberam CORS para as origens dos mapas: `null` e a do
+próprio app Streamlit (os iframes de `components.html` herdam a origem da
+página), mais as listadas em `DENUNCIAS_ALLOWED_ORIGINS` (separadas por
+vírgula). Outras páginas abertas no navegador não conseguem ler os dados.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+SERVER_HOST = os.getenv("DENUNCIAS_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("DENUNCIAS_SERVER_PORT", "8765"))
+SERVER_URL = os.getenv("DENUNCIAS_SERVER_URL", "")
+EXTRA_ORIGINS = os.getenv("DENUNCIAS_ALLOWED_ORIGINS", "")
+
+# handler(segmentos do caminho após a rota, query string) -> (status, content-type, corpo)
+RouteHandler = Callable[[list[str], dict[str, list[str]]], tuple[int, str, bytes]]
+
+_routes: dict[str, RouteHandler] = {}
+_server: ThreadingHTTPServer | None = None
+_lock = threading.Lock()
+
+
+def _allowed_origins() -> frozenset[str]:
+    origins = {"null"}
+    origins.update(
+        origin.strip().rstrip("/")
+        for origin in EXTRA_ORIGINS.split(",")
+        if origin.strip()
+    )
+    try:
+        from streamlit import config
+    except ImportError:
+        return frozenset(origins)
+    port = config.get_option("server.port")
+    browser_port = config.get_option("browser.serverPort") or port
+    for host in ("localhost", "127.0.0.1"):
+        origins.update({f"http://{host}:{port}", f"http://{host}:{browser_port}"})
+    address = config.get_option("browser.serverAddress")
+    if address and address not in ("localhost", "127.0.0.1"):
+        for scheme in ("http", "https"):
+            origins.add(f"{scheme}://{address}:{browser_port}")
+            origins.add(f"{scheme}://{address}")
+    return frozenset(origins)
+
+
+_origins: frozenset[str] = frozenset()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:  # noqa: N802 - nome exigido pelo BaseHTTPRequestHandler
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        handler = _routes.get(parts[0]) if parts else None
+        if handler is None:
+            status, content_type, body = 404, "text/plain; charset=utf-8", b"not found"
+        else:
+            try:
+                status, content_type, body = handler(parts[1:], parse_qs(url.query))
+            except Exception as exc:  # o erro não pode derrubar a thread do servidor
+                status, content_type = 500, "text/plain; charset=utf-8"
+                body = str(exc).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        origin = self.headers.get("Origin")
+        if origin in _origins:
+            self.send_header("Access-Control-Allow-Origin", origin)
+        self.send_header("Vary", "Origin")
+        self.send_header("Cache-Control", "max-age=3600")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        return
+
+
+def register_route(name: str, handler: RouteHandler) -> None:
+    """Associa `handler` às requisições `/<name>/...`."""
+    _routes[name] = handler
+
+
+def ensure_server() -> str:
+    """Inicia o servidor (se necessário) e devolve a URL base vista pelo navegador."""
+    global _server, _origins
+    with _lock:
+        if _server is None:
+            _origins = _allowed_origins()
+            try:
+                server = ThreadingHTTPServer((SERVER_HOST, SERVER_PORT), _Handler)
+            except OSError:
+                server = ThreadingHTTPServer((SERVER_HOST, 0), _Handler)
+            server.daemon_threads = True
+            thread = threading.Thread(
+                target=server.serve_forever, name="denuncias-local-server", daemon=True
+            )
+            thread.start()
+            _server = server
+        port = _server.server_address[1]
+    if SERVER_URL:
+        return SERVER_URL.rstrip("/")
+    host = "localhost" if SERVER_HOST in ("127.0.0.1", "0.0.0.0") else SERVER_HOST
+    return f"http://{host}:{port}"
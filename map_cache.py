@@ -0,0 +1,52 @@
+"""
+Cache limitado do HTML já renderizado dos mapas.
+
+Montar um `leafmap.Map`/`folium.Map`, adicionar todas as camadas e serializar
+o HTML custa caro e se repetia a cada rerun, mesmo quando só widgets alheios
+ao mapa mudavam. As páginas descrevem o estado do mapa numa chave (versão dos
+dados, linhas exibidas, mapa base e opções de camada) e só renderizam de novo
+quando essa chave ainda não está no cache. O cache é compartilhado pelas
+sessões do processo e limitado por número de entradas e total de bytes (LRU).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+
+MAX_ENTRIES = 32
+MAX_BYTES = 256 * 1024 * 1024
+
+_entries: OrderedDict[str, str] = OrderedDict()
+_total_bytes = 0
+_lock = threading.Lock()
+
+
+def map_cache_key(*parts: object) -> str:
+    """Chave estável a partir das partes que definem o estado do mapa."""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def cached_map_html(key: str, render: Callable[[], str]) -> str:
+    """Devolve o HTML guardado para `key` ou chama `render` e guarda o resultado."""
+    global _total_bytes
+    with _lock:
+        if key in _entries:
+            _entries.move_to_end(key)
+            return _entries[key]
+
+    html = render()
+    size = len(html.encode("utf-8"))
+    if size > MAX_BYTES:
+        return html
+
+    with _lock:
+        if key not in _entries:
+            _entries[key] = html
+            _total_bytes += size
+        while len(_entries) > MAX_ENTRIES or _total_bytes > MAX_BYTES:
+            _, evicted = _entries.popitem(last=False)
+            _total_bytes -= len(evicted.encode("utf-8"))
+    return html
@@ -0,0 +1,588 @@
+"""
+Camadas Leaflet leves para desenhar grandes volumes de denúncias.
+
+Em vez de um marcador (com HTML de popup próprio) por denúncia, os pontos são
+enviados ao navegador como um único vetor de coordenadas e desenhados num
+renderizador canvas. Abaixo do nível de zoom limite, os pontos visíveis são
+agregados em células de densidade no espaço de pixels; a partir dele, apenas
+os pontos dentro da área visível viram marcadores individuais.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import html
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+from branca.element import Element
+from folium.map import Layer
+from jinja2 import Template
+
+from local_server import ensure_server, register_route
+from snapshot import fingerprint
+
+DEFAULT_ZOOM_THRESHOLD = 15
+DEFAULT_CELL_SIZE = 48
+COORD_DECIMALS = 6
+# passo de quantização das coordenadas compactas (≈ 1 m em latitude)
+DEFAULT_COORD_PRECISION_M = 1.0
+METERS_PER_DEGREE = 111_320.0
+POPUP_ROUTE = "popup"
+MAX_POPUP_SOURCES = 16
+# YlOrRd, 5 classes
+CHOROPLETH_PALETTE = ("#FFFFB2", "#FECC5C", "#FD8D3C", "#F03B20", "#BD0026")
+
+_popup_sources: OrderedDict[str, tuple[pd.DataFrame, list[str]]] = OrderedDict()
+# o servidor local lê as fontes em outras threads
+_popup_lock = threading.Lock()
+
+
+def popup_labels(data: pd.DataFrame, fields: Sequence[str]) -> list[str]:
+    """Monta o HTML curto de popup (campo: valor) para cada linha."""
+    fields = [field for field in fields if field in data.columns]
+    if not fields:
+        return []
+    parts = []
+    for field in fields:
+        values = data[field].astype(str).where(data[field].notna(), "")
+        parts.append(f"<b>{html.escape(field)}</b>: " + values.map(html.escape))
+    labels = parts[0]
+    for part in parts[1:]:
+        labels = labels + "<br>" + part
+    return labels.tolist()
+
+
+def points_feature_collection(
+    data: pd.DataFrame,
+    properties: dict[str, str] | None = None,
+    latitude: str = "latitude",
+    longitude: str = "longitude",
+) -> dict:
+    """Monta uma FeatureCollection de pontos direto das colunas, sem `iterrows`.
+
+    `properties` mapeia o nome da propriedade GeoJSON para a coluna de origem.
+    """
+    properties = properties or {}
+    coords = np.round(
+        data[[longitude, latitude]].to_numpy(dtype=float), COORD_DECIMALS
+    ).tolist()
+    columns = {
+        name: data[column].astype(object).where(data[column].notna(), None).tolist()
+        for name, column in properties.items()
+    }
+    names = list(columns)
+    rows = zip(*columns.values()) if names else ([] for _ in coords)
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": point},
+                "properties": dict(zip(names, values)),
+            }
+            for point, values in zip(coords, rows)
+        ],
+    }
+
+
+def _serve_popup(
+    parts: list[str], query: dict[str, list[str]]
+) -> tuple[int, str, bytes]:
+    if len(parts) != 2 or not parts[1].isdigit():
+        return 404, "text/plain; charset=utf-8", b"popup not found"
+    with _popup_lock:
+        source = _popup_sources.get(parts[0])
+    if source is None:
+        return 404, "text/plain; charset=utf-8", b"popup not found"
+    frame, fields = source
+    row = int(parts[1])
+    if row >= len(frame):
+        return 404, "text/plain; charset=utf-8", b"popup not found"
+    body = popup_labels(frame.iloc[[row]], fields)[0]
+    return 200, "text/html; charset=utf-8", body.encode("utf-8")
+
+
+def register_popup_source(
+    data: pd.DataFrame, fields: Sequence[str], extra_key: str = ""
+) -> str:
+    """Disponibiliza os popups de `data` no servidor local e devolve o prefixo da URL.
+
+    A linha `i` de `data` é servida em `<prefixo><i>`. As fontes ficam num
+    cache limitado, identificadas pela impressão digital de `data`
+    (`snapshot.fingerprint`) e pelos campos. Colunas derivadas de estado da sessão (ex.: regras
+    personalizadas) devem entrar em `extra_key`.
+    """
+    fields = [field for field in fields if field in data.columns]
+    key = hashlib.sha1(
+        f"{fingerprint(data)}{fields!r}{extra_key}".encode("utf-8")
+    ).hexdigest()[:16]
+    with _popup_lock:
+        if key in _popup_sources:
+            _popup_sources.move_to_end(key)
+        else:
+            _popup_sources[key] = (data[fields].reset_index(drop=True), fields)
+            while len(_popup_sources) > MAX_POPUP_SOURCES:
+                _popup_sources.popitem(last=False)
+    register_route(POPUP_ROUTE, _serve_popup)
+    return f"{ensure_server()}/{POPUP_ROUTE}/{key}/"
+
+
+DELTA_DECODER_JS = """
+function decodeDeltaCoords(encoded, bytes, step, lat0, lon0) {
+    var binary = atob(encoded);
+    var buffer = new Uint8Array(binary.length);
+    for (var i = 0; i < binary.length; i++) { buffer[i] = binary.charCodeAt(i); }
+    var deltas = bytes === 2 ? new Int16Array(buffer.buffer) : new Int32Array(buffer.buffer);
+    var coords = new Float64Array(deltas.length);
+    var lat = lat0, lon = lon0;
+    for (var j = 0; j < deltas.length; j += 2) {
+        lat += deltas[j];
+        lon += deltas[j + 1];
+        coords[j] = lat * step;
+        coords[j + 1] = lon * step;
+    }
+    return coords;
+}
+"""
+
+
+def encode_coordinates(
+    latlon: np.ndarray, precision_m: float = DEFAULT_COORD_PRECISION_M
+) -> str:
+    """Expressão JS que reconstrói `latlon` (n x 2) como vetor plano [lat, lon, ...].
+
+    As coordenadas são quantizadas em passos de `precision_m` metros e enviadas
+    como diferenças em relação ao ponto anterior, num typed array (Int16 quando
+    todas as diferenças cabem, senão Int32) codificado em base64. A ordem das
+    linhas é mantida, pois os popups e tiles usam a posição da linha.
+    """
+    step = precision_m / METERS_PER_DEGREE
+    steps = np.rint(np.asarray(latlon, dtype=float).reshape(-1, 2) / step).astype(
+        np.int64
+    )
+    origin = steps[0] if len(steps) else np.zeros(2, dtype=np.int64)
+    deltas = np.diff(steps, axis=0, prepend=origin[None, :]).ravel()
+    small = deltas.size == 0 or np.abs(deltas).max() <= np.iinfo(np.int16).max
+    dtype, size = ("<i2", 2) if small else ("<i4", 4)
+    encoded = base64.b64encode(deltas.astype(dtype).tobytes()).decode("ascii")
+    return f'decodeDeltaCoords("{encoded}", {size}, {step!r}, {int(origin[0])}, {int(origin[1])})'
+
+
+class _RawJs(Element):
+    """Trecho de JavaScript inserido na página sem passar pelo compilador do Jinja."""
+
+    def __init__(self, source: str):
+        super().__init__()
+        self._source = source
+
+    def render(self, **kwargs) -> str:
+        return self._source
+
+
+class _InlineDataLayer(Layer):
+    """Camada cujos dados volumosos viram variáveis JS `<nome>_<chave>`.
+
+    O branca recompila como template Jinja todo script gerado pelas camadas;
+    com dezenas de MB de coordenadas isso domina o tempo de montagem do mapa.
+    Os dados em `inline_data` são emitidos à parte, como texto bruto.
+    """
+
+    def __init__(self, name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self.inline_data: dict[str, str] = {}
+        # funções JS compartilhadas (emitidas uma vez por página, pelo nome)
+        self.helpers: dict[str, str] = {}
+
+    def render(self, **kwargs):
+        figure = self.get_root()
+        for name, source in self.helpers.items():
+            figure.script.add_child(_RawJs(source), name=name)
+        for key, source in self.inline_data.items():
+            figure.script.add_child(
+                _RawJs(f"var {self.get_name()}_{key} = {source};"),
+                name=f"{self.get_name()}_{key}",
+            )
+        super().render(**kwargs)
+
+
+class LodPointLayer(_InlineDataLayer):
+    """Pontos em canvas com agregação por células abaixo de `zoom_threshold`.
+
+    Parameters
+    ----------
+    data : DataFrame com as colunas de latitude e longitude.
+    popups : HTML opcional de popup por ponto (mesma ordem de `data`).
+    popup_url : prefixo devolvido por `register_popup_source`; quando
+        informado (e `popups` não), o popup é buscado ao clicar no marcador.
+    zoom_threshold : zoom a partir do qual os pontos aparecem individualmente.
+    cell_size : tamanho, em pixels de tela, das células de densidade.
+    coord_precision : passo, em metros, das coordenadas compactas (ver
+        `encode_coordinates`); `None` envia as coordenadas em JSON.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function () {
+            var map = {{ this._parent.get_name() }};
+            var coords = {{ this.get_name() }}_coords;
+            var popups = {{ this.get_name() }}_popups;
+            var options = {{ this.options_js }};
+            var renderer = L.canvas({padding: 0.5});
+            var group = L.layerGroup();
+            var palette = ["#FDE68A", "#FDBA74", "#F97316", "#EF4444", "#991B1B"];
+
+            function cellStyle(count, maxCount) {
+                var t = Math.log(count + 1) / Math.log(maxCount + 1);
+                return {
+                    renderer: renderer,
+                    radius: 6 + 14 * t,
+                    color: "#7C2D12",
+                    weight: 1,
+                    fillColor: palette[Math.min(palette.length - 1, Math.floor(t * palette.length))],
+                    fillOpacity: 0.75
+                };
+            }
+
+            function bindLazyPopup(marker, row) {
+                marker.bindPopup("Carregando…", {maxWidth: 360});
+                marker.once("popupopen", function () {
+                    fetch(options.popupUrl + row)
+                        .then(function (response) {
+                            if (!response.ok) { throw new Error(response.status); }
+                            return response.text();
+                        })
+                        .then(function (content) { marker.setPopupContent(content); })
+                        .catch(function () {
+                            marker.setPopupContent("Detalhes indisponíveis no momento.");
+                        });
+                });
+            }
+
+            function redraw() {
+                if (!map.hasLayer(group)) { return; }
+                group.clearLayers();
+                var zoom = map.getZoom();
+                var bounds = map.getBounds().pad(0.1);
+                var n = coords.length / 2;
+                if (zoom >= options.zoomThreshold) {
+                    for (var i = 0; i < n; i++) {
+                        var latlng = L.latLng(coords[2 * i], coords[2 * i + 1]);
+                        if (!bounds.contains(latlng)) { continue; }
+                        var marker = L.circleMarker(latlng, {
+                            renderer: renderer,
+                            radius: options.radius,
+                            color: options.color,
+                            weight: 1,
+                            fillColor: options.fillColor,
+                            fillOpacity: 0.85
+                        });
+                        if (popups) {
+                            marker.bindPopup(popups[i], {maxWidth: 360});
+                        } else if (options.popupUrl) {
+                            bindLazyPopup(marker, i);
+                        }
+                        group.addLayer(marker);
+                    }
+                    return;
+                }
+                var cells = {};
+                var maxCount = 1;
+                for (var j = 0; j < n; j++) {
+                    var lat = coords[2 * j], lon = coords[2 * j + 1];
+                    if (!bounds.contains([lat, lon])) { continue; }
+                    var p = map.project([lat, lon], zoom);
+                    var key = Math.floor(p.x / options.cellSize) + ":" + Math.floor(p.y / options.cellSize);
+                    var cell = cells[key] || (cells[key] = {count: 0, lat: 0, lon: 0});
+                    cell.count += 1;
+                    cell.lat += lat;
+                    cell.lon += lon;
+                    if (cell.count > maxCount) { maxCount = cell.count; }
+                }
+                Object.keys(cells).forEach(function (key) {
+                    var cell = cells[key];
+                    var center = [cell.lat / cell.count, cell.lon / cell.count];
+                    L.circleMarker(center, cellStyle(cell.count, maxCount))
+                        .bindTooltip(cell.count.toLocaleString("pt-BR") + " denúncias")
+                        .addTo(group);
+                });
+            }
+
+            group.on("add", redraw);
+            map.on("moveend", redraw);
+            return group;
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        latitude: str = "latitude",
+        longitude: str = "longitude",
+        popups: Sequence[str] | None = None,
+        popup_url: str | None = None,
+        name: str = "Denúncias",
+        zoom_threshold: int = DEFAULT_ZOOM_THRESHOLD,
+        cell_size: int = DEFAULT_CELL_SIZE,
+        radius: float = 4,
+        color: str = "#1D4ED8",
+        fill_color: str = "#3B82F6",
+        coord_precision: float | None = DEFAULT_COORD_PRECISION_M,
+        overlay: bool = True,
+        control: bool = True,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "LodPointLayer"
+        latlon = data[[latitude, longitude]].to_numpy(dtype=float)
+        if coord_precision:
+            self.helpers["decode_delta_coords"] = DELTA_DECODER_JS
+            self.inline_data["coords"] = encode_coordinates(latlon, coord_precision)
+        else:
+            coords = np.round(latlon, COORD_DECIMALS).ravel()
+            self.inline_data["coords"] = json.dumps(coords.tolist())
+        self.inline_data["popups"] = (
+            json.dumps(list(popups), ensure_ascii=False).replace("</", "<\\/")
+            if popups
+            else "null"
+        )
+        self.options_js = json.dumps(
+            {
+                "zoomThreshold": zoom_threshold,
+                "cellSize": cell_size,
+                "radius": radius,
+                "color": color,
+                "fillColor": fill_color,
+                "popupUrl": popup_url,
+            }
+        )
+
+
+class GeoJsonPointLayer(_InlineDataLayer):
+    """FeatureCollection de pontos desenhada em canvas e estilizada por uma propriedade.
+
+    Parameters
+    ----------
+    data : FeatureCollection (por exemplo, de `points_feature_collection`).
+    style_property : propriedade usada para escolher o estilo de cada ponto.
+    styles : estilos Leaflet (`color`, `fillColor`...) por valor da propriedade.
+    popup_fields : propriedade -> rótulo exibido no popup, montado no navegador.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function () {
+            var options = {{ this.options_js }};
+            var renderer = L.canvas({padding: 0.5});
+            function escapeHtml(value) {
+                return String(value === null || value === undefined ? "" : value)
+                    .replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+            }
+            return L.geoJSON({{ this.get_name() }}_data, {
+                pointToLayer: function (feature, latlng) {
+                    var style = options.styles[String(feature.properties[options.styleProperty])] || {};
+                    return L.circleMarker(latlng, Object.assign({
+                        renderer: renderer,
+                        radius: options.radius,
+                        weight: 1,
+                        fill: true,
+                        fillOpacity: 0.8
+                    }, style));
+                },
+                onEachFeature: function (feature, layer) {
+                    if (!options.popupFields) { return; }
+                    layer.bindPopup(function () {
+                        return options.popupFields.map(function (field) {
+                            return "<b>" + escapeHtml(field[1]) + "</b> "
+                                + escapeHtml(feature.properties[field[0]]);
+                        }).join("<br>");
+                    });
+                }
+            });
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(
+        self,
+        data: dict,
+        style_property: str,
+        styles: dict,
+        popup_fields: dict[str, str] | None = None,
+        name: str | None = None,
+        radius: float = 4,
+        overlay: bool = True,
+        control: bool = True,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "GeoJsonPointLayer"
+        self.inline_data["data"] = json.dumps(
+            data, ensure_ascii=False, separators=(",", ":")
+        ).replace("</", "<\\/")
+        self.options_js = json.dumps(
+            {
+                "styleProperty": style_property,
+                "styles": {str(key): value for key, value in styles.items()},
+                "popupFields": list(popup_fields.items()) if popup_fields else None,
+                "radius": radius,
+            },
+            ensure_ascii=False,
+        )
+
+
+class CellChoroplethLayer(_InlineDataLayer):
+    """Polígonos de células coloridos por classes de quantis de uma contagem.
+
+    Parameters
+    ----------
+    data : FeatureCollection de polígonos (por exemplo, de
+        `grid.cells_feature_collection`), com a contagem em `value_property`.
+    breakdown_property : propriedade com pares [rótulo, valor] exibidos no popup.
+    palette : cores das classes, da menor para a maior contagem.
+    classes : classe (posição em `palette`) de cada polígono; quando informada,
+        substitui as quebras por quantis e `class_labels` nomeia as classes na legenda.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function () {
+            var map = {{ this._parent.get_name() }};
+            var options = {{ this.options_js }};
+            function escapeHtml(value) {
+                return String(value).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+            }
+            function format(value) { return Number(value).toLocaleString("pt-BR"); }
+            var layer = L.geoJSON({{ this.get_name() }}_data, {
+                renderer: L.canvas({padding: 0.5}),
+                style: function (feature) {
+                    return {
+                        color: "#7C2D12",
+                        weight: 0.6,
+                        fillColor: options.palette[feature.properties.classe],
+                        fillOpacity: options.fillOpacity
+                    };
+                },
+                onEachFeature: function (feature, cell) {
+                    cell.bindPopup(function () {
+                        var lines = ["<b>" + format(feature.properties[options.valueProperty]) + " denúncias</b>"];
+                        (feature.properties[options.breakdownProperty] || []).forEach(function (item) {
+                            var value = typeof item[1] === "number" ? format(item[1]) : escapeHtml(item[1]);
+                            lines.push(escapeHtml(item[0]) + ": " + value);
+                        });
+                        return lines.join("<br>");
+                    }, {maxWidth: 360});
+                }
+            });
+            var legend = L.control({position: "bottomright"});
+            legend.onAdd = function () {
+                var div = L.DomUtil.create("div", "leaflet-control leaflet-bar");
+                div.style.background = "white";
+                div.style.padding = "6px 8px";
+                div.style.font = "12px sans-serif";
+                div.innerHTML = "<b>" + escapeHtml(options.legendTitle) + "</b><br>" + options.classes.map(function (item) {
+                    return '<i style="display:inline-block;width:12px;height:12px;margin-right:4px;background:'
+                        + item[0] + '"></i>' + escapeHtml(item[1]);
+                }).join("<br>");
+                return div;
+            };
+            layer.on("add", function () { legend.addTo(map); });
+            layer.on("remove", function () { legend.remove(); });
+            return layer;
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(
+        self,
+        data: dict,
+        value_property: str = "total",
+        breakdown_property: str = "tipos",
+        palette: Sequence[str] = CHOROPLETH_PALETTE,
+        classes: Sequence[int] | None = None,
+        class_labels: Sequence[str] | None = None,
+        name: str | None = None,
+        legend_title: str = "Denúncias por célula",
+        fill_opacity: float = 0.65,
+        overlay: bool = True,
+        control: bool = True,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "CellChoroplethLayer"
+        if classes is not None:
+            classes = np.asarray(classes, dtype=int)
+            colors = list(palette)
+            legend = [
+                [color, label] for color, label in zip(colors, class_labels or colors)
+            ]
+        else:
+            classes, colors, legend = self._quantile_classes(
+                data, value_property, palette
+            )
+        features = [
+            {**feature, "properties": {**feature["properties"], "classe": int(k)}}
+            for feature, k in zip(data["features"], classes.tolist())
+        ]
+        self.inline_data["data"] = json.dumps(
+            {"type": "FeatureCollection", "features": features},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).replace("</", "<\\/")
+        self.options_js = json.dumps(
+            {
+                "valueProperty": value_property,
+                "breakdownProperty": breakdown_property,
+                "palette": colors,
+                "classes": legend,
+                "legendTitle": legend_title,
+                "fillOpacity": fill_opacity,
+            },
+            ensure_ascii=False,
+        ).replace("</", "<\\/")
+
+    @staticmethod
+    def _quantile_classes(
+        data: dict, value_property: str, palette: Sequence[str]
+    ) -> tuple[np.ndarray, list[str], list[list[str]]]:
+        values = np.array(
+            [feature["properties"][value_property] for feature in data["features"]],
+            dtype=float,
+        )
+        edges = (
+            np.unique(
+                np.round(np.quantile(values, np.linspace(0, 1, len(palette) + 1)))
+            )
+            if values.size
+            else np.array([0.0, 1.0])
+        )
+        if edges.size < 2:
+            edges = np.array([edges[0], edges[0]])
+        n_classes = edges.size - 1
+        classes = np.searchsorted(edges[1:-1], values, side="left")
+        # as classes usam as cores extremas da paleta quando há poucas quebras
+        colors = [
+            palette[round(k * (len(palette) - 1) / max(n_classes - 1, 1))]
+            for k in range(n_classes)
+        ]
+        legend = []
+        for k in range(n_classes):
+            low = int(edges[k]) + (1 if k > 0 else 0)
+            high = int(edges[k + 1])
+            label = f"{low:,}".replace(",", ".")
+            if high > low:
+                label += " – " + f"{high:,}".replace(",", ".")
+            legend.append([colors[k], label])
+        return classes, colors, legend
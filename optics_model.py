@@ -0,0 +1,101 @@
+"""
+Reachability do OPTICS calculada uma única vez por versão dos dados.
+
+O ajuste do OPTICS é a parte cara do agrupamento; a extração dos clusters a
+partir do gráfico de reachability é linear. Por isso o modelo guarda
+`reachability`, `core_distances`, `ordering` e `predecessor` de um único
+ajuste e os rótulos de cada valor do controle saem dele:
+
+- `xi_labels`: método ξ (variação de densidade), usando o tamanho mínimo de
+  cluster escolhido como `min_samples` da extração;
+- `eps_labels`: corte horizontal do gráfico a `eps` metros, equivalente a um
+  DBSCAN com o mesmo `min_samples` do ajuste.
+
+O ajuste recebe a vizinhança pronta do índice espacial
+(`SpatialIndex.neighbour_graph`, matriz esparsa de distâncias em metros até
+`OPTICS_MAX_EPS_M`) em vez de refazer as buscas haversine; reachabilities
+acima desse raio ficam infinitas, o que só separa grupos que o corte por
+`eps` (limitado bem abaixo dele) também separaria.
+
+O ajuste usa o menor `min_samples` oferecido na página
+(`REACHABILITY_MIN_SAMPLES`): é o gráfico mais detalhado, do qual os
+agrupamentos com tamanho mínimo maior continuam extraíveis. Um ajuste no
+maior valor suavizaria o gráfico a ponto de sobrarem os mesmos poucos
+clusters para qualquer posição do controle.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+from sklearn.cluster import OPTICS, cluster_optics_dbscan, cluster_optics_xi
+
+from spatial_index import SpatialIndex
+
+EXTRACTION_METHODS = {
+    "xi": "Variação de densidade (ξ)",
+    "eps": "Corte de distância (eps)",
+}
+REACHABILITY_MIN_SAMPLES = 5
+DEFAULT_XI = 0.05
+OPTICS_MAX_EPS_M = 1_000.0
+
+
+@dataclass
+class Reachability:
+    """Resultado de um ajuste do OPTICS, com distâncias em metros."""
+
+    reachability: np.ndarray
+    core_distances: np.ndarray
+    ordering: np.ndarray
+    predecessor: np.ndarray
+    min_samples: int
+
+    @classmethod
+    def fit(
+        cls,
+        index: SpatialIndex,
+        min_samples: int = REACHABILITY_MIN_SAMPLES,
+        max_eps_m: float = OPTICS_MAX_EPS_M,
+    ) -> Reachability:
+        graph = index.neighbour_graph(max_eps_m, min_neighbours=min_samples)
+        model = OPTICS(metric="precomputed", min_samples=min_samples, max_eps=max_eps_m)
+        # denúncias no mesmo endereço têm reachability 0, e a razão entre
+        # vizinhos do gráfico (método ξ) divide por zero sem alterar o resultado
+        with np.errstate(divide="ignore", invalid="ignore"):
+            model.fit(graph)
+        return cls(
+            reachability=model.reachability_,
+            core_distances=model.core_distances_,
+            ordering=model.ordering_,
+            predecessor=model.predecessor_,
+            min_samples=min_samples,
+        )
+
+    def __len__(self) -> int:
+        return len(self.ordering)
+
+    def xi_labels(self, min_cluster_size: int, xi: float = DEFAULT_XI) -> np.ndarray:
+        """Rótulos (-1 para ruído) dos clusters com ao menos `min_cluster_size` pontos."""
+        if len(self) < 2:
+            return np.full(len(self), -1, dtype=np.int64)
+        min_cluster_size = int(min(max(min_cluster_size, 2), len(self)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            labels, _ = cluster_optics_xi(
+                reachability=self.reachability,
+                predecessor=self.predecessor,
+                ordering=self.ordering,
+                min_samples=min_cluster_size,
+                xi=xi,
+            )
+        return labels
+
+    def eps_labels(self, eps_m: float) -> np.ndarray:
+        """Rótulos (-1 para ruído) do corte do gráfico a `eps_m` metros."""
+        return cluster_optics_dbscan(
+            reachability=self.reachability,
+            core_distances=self.core_distances,
+            ordering=self.ordering,
+            eps=eps_m,
+        )
@@ -1,11 +1,51 @@
 from pathlib import Path
+import base64
 import json
 import re
 
 import pandas as pd
 import streamlit as st
+import streamlit.components.v1 as components
 import leafmap.foliumap as leafmap
 import altair as alt
+import folium
+
+from charts import MAX_PARETO_CATEGORIES, pareto_chart
+from dedup import DEFAULT_RADIUS_M, DEFAULT_WINDOW_HOURS, flag_duplicates
+from grid import (
+    GRID_RESOLUTIONS,
+    GRID_SHAPES,
+    GridIndex,
+    build_grid_index,
+    cells_feature_collection,
+)
+from kde import (
+    BANDWIDTHS_M,
+    DEFAULT_BANDWIDTH_M,
+    DEFAULT_RESOLUTION_M,
+    EXTENTS,
+    KERNELS,
+    MARINGA_BBOX,
+    RESOLUTIONS_M,
+    KdeSurface,
+    kde_surface,
+)
+from map_cache import cached_map_html, map_cache_key
+from map_layers import (
+    CellChoroplethLayer,
+    LodPointLayer,
+    popup_labels,
+    register_popup_source,
+)
+from rollups import (
+    RESOLUTION_LABELS,
+    build_rollups,
+    pick_resolution,
+    resolutions_from,
+    slice_rollup,
+)
+from snapshot import cache_by_fingerprint, data_version, derive, fingerprint, stamp
+from vector_tiles import VectorTileLayer, register_tile_source
 
 st.set_page_config(page_title="Mapa Interativo de Denúncias", layout="wide")
 
@@ -110,13 +150,116 @@ def load_data() -> pd.DataFrame:
     if "bairro_formatado" not in df.columns:
         df["bairro_formatado"] = df["endereco_formatado"].apply(_extract_bairro)
     df["bairro_formatado"] = (
-        df["bairro_formatado"]
-        .fillna(df.get("Bairro"))
-        .fillna("")
-        .astype(str)
+        df["bairro_formatado"].fillna(df.get("Bairro")).fillna("").astype(str)
+    )
+    return stamp(flag_duplicates(df), data_version(), "filtros")
+
+
+@cache_by_fingerprint(show_spinner=False)
+def category_frequencies(data: pd.DataFrame, column: str) -> pd.DataFrame:
+    values = data[column].fillna("Não informado")
+    return (
+        values.groupby(values, dropna=False)
+        .size()
+        .reset_index(name="contagem")
+        .sort_values("contagem", ascending=False)
+        .reset_index(drop=True)
+    )
+
+
+@cache_by_fingerprint(
+    show_spinner="Calculando a superfície de densidade...", max_entries=8
+)
+def compute_kde(
+    data: pd.DataFrame, kernel: str, bandwidth_m: int, resolution_m: int, extent: str
+) -> KdeSurface:
+    return kde_surface(
+        data["latitude"].to_numpy(dtype=float),
+        data["longitude"].to_numpy(dtype=float),
+        kernel,
+        bandwidth_m,
+        resolution_m,
+        MARINGA_BBOX if extent == "maringa" else None,
+    )
+
+
+@st.cache_data(show_spinner=False)
+def load_rollups() -> dict[str, pd.DataFrame]:
+    return build_rollups(load_data())
+
+
+@st.cache_resource(show_spinner=False)
+def load_grid_index() -> GridIndex:
+    return build_grid_index(load_data())
+
+
+def build_map_html(
+    data: pd.DataFrame,
+    basemap: str,
+    light_render: bool,
+    popup_fields: list[str],
+    popup_url: str | None,
+    tile_source: tuple[str, list[str]] | None = None,
+    cells: dict | None = None,
+) -> str:
+    m = leafmap.Map(
+        center=(
+            [data["latitude"].mean(), data["longitude"].mean()]
+            if not data.empty
+            else [-23.415367, -51.931343]
+        ),
+        zoom=12.5,
+        locate_control=True,
+        latlon_control=True,
+        draw_export=True,
+        minimap_control=True,
     )
-    return df
+    m.add_basemap(basemap)
 
+    if not data.empty:
+        if cells:
+            CellChoroplethLayer(cells, name="Denúncias por célula").add_to(m)
+        if tile_source:
+            tile_url, categories = tile_source
+            VectorTileLayer(tile_url, categories, popup_url=popup_url).add_to(m)
+        elif not cells:
+            # sem tiles nem grade, os pontos vão junto com a página
+            if light_render and popup_url:
+                LodPointLayer(data, popup_url=popup_url, name="Denúncias").add_to(m)
+            elif light_render:
+                LodPointLayer(
+                    data,
+                    popups=popup_labels(
+                        data, [col for col in popup_fields if col != "Descrição"]
+                    ),
+                    name="Denúncias",
+                ).add_to(m)
+            else:
+                m.add_points_from_xy(
+                    data=data,
+                    x="longitude",
+                    y="latitude",
+                    popup=popup_fields or None,
+                    layer_name="Denúncias",
+                )
+
+    m.add_layer_control()
+    return m.to_html()
+
+
+def build_kde_map_html(surface: KdeSurface, basemap: str) -> str:
+    west, south, east, north = surface.bounds
+    m = leafmap.Map(center=[(south + north) / 2, (west + east) / 2], zoom=12)
+    m.add_basemap(basemap)
+    png = base64.b64encode(surface.to_png()).decode("ascii")
+    folium.raster_layers.ImageOverlay(
+        image=f"data:image/png;base64,{png}",
+        bounds=surface.image_bounds,
+        name="Densidade (KDE)",
+        interactive=False,
+    ).add_to(m)
+    m.add_layer_control()
+    return m.to_html()
 
 
 df = load_data()
@@ -149,8 +292,17 @@ if isinstance(date_range, (tuple, list)):
 else:
     start_date = end_date = date_range if date_range else min_date
 
+unique_incidents = st.sidebar.checkbox(
+    "Contar incidentes únicos",
+    value=False,
+    help=f"Agrupa as denúncias repetidas de um mesmo incidente (a até {DEFAULT_RADIUS_M} m "
+    f"e {DEFAULT_WINDOW_HOURS} h umas das outras) e conta cada incidente uma vez, "
+    "pela primeira denúncia.",
+)
 night_mode = st.sidebar.checkbox(
-    "Período noturno (20h às 8h)", value=False, help="Seleciona automaticamente o período entre 20:00 e 08:00."
+    "Período noturno (20h às 8h)",
+    value=False,
+    help="Seleciona automaticamente o período entre 20:00 e 08:00.",
 )
 if night_mode:
     hour_range = None  # indicador de período especial
@@ -206,10 +358,7 @@ else:
 
 
 filtered = df.copy()
-filtered = filtered[
-    (filtered["data"] >= start_date)
-    & (filtered["data"] <= end_date)
-]
+filtered = filtered[(filtered["data"] >= start_date) & (filtered["data"] <= end_date)]
 
 if search_address:
     filtered = filtered[
@@ -244,7 +393,23 @@ elif hour_range is not None:
     mask = (filtered["hora"] >= start_hour) & (filtered["hora"] <= end_hour)
     filtered = filtered[mask]
 
+reports_filtered = len(filtered)
+if unique_incidents:
+    filtered = filtered.sort_values("DataInclusao").drop_duplicates("incidente")
+
 filtered = filtered.sort_values("DataInclusao", ascending=False)
+filtered = derive(
+    filtered,
+    df,
+    start_date,
+    end_date,
+    search_address,
+    pattern,
+    search_bairro,
+    night_mode,
+    hour_range,
+    unique_incidents,
+)
 
 st.title("Mapa Interativo de Denúncias de Poluição Sonora em Maringá")
 
@@ -263,9 +428,17 @@ total_filtrado = len(filtered)
 periodo_label = f"{start_date:%d/%m/%Y} - {end_date:%d/%m/%Y}"
 
 metric_col1, metric_col2, metric_col3 = st.columns(3)
-metric_col1.metric("Denúncias filtradas", f"{total_filtrado:,}")
+metric_col1.metric(
+    "Incidentes filtrados" if unique_incidents else "Denúncias filtradas",
+    f"{total_filtrado:,}",
+)
 metric_col2.metric("Denúncias totais", f"{total_denuncias:,}")
 metric_col3.metric("Período selecionado", periodo_label)
+if unique_incidents:
+    st.caption(
+        f"{reports_filtered - total_filtrado:,} denúncias repetidas foram agrupadas nos "
+        "incidentes; a tendência temporal continua contando todas as denúncias."
+    )
 
 dimension_col = chart_dimension
 chart_df = pd.DataFrame()
@@ -273,15 +446,7 @@ chart_ready = False
 categories_display: list[str] = []
 
 if not filtered.empty and dimension_col in filtered.columns:
-    work_df = filtered.copy()
-    work_df[dimension_col] = work_df[dimension_col].fillna("Não informado")
-    freq = (
-        work_df.groupby(dimension_col, dropna=False)
-        .size()
-        .reset_index(name="contagem")
-        .sort_values("contagem", ascending=False)
-        .reset_index(drop=True)
-    )
+    freq = category_frequencies(filtered, dimension_col)
     total_freq = freq["contagem"].sum()
     if total_freq > 0:
         freq["percentual"] = freq["contagem"] / total_freq
@@ -317,8 +482,12 @@ else:
 map_data = filtered.copy()
 if chart_ready and restrict_map and categories_display:
     map_data = map_data[
-        map_data[dimension_col].fillna("Não informado").astype(str).isin(categories_display)
+        map_data[dimension_col]
+        .fillna("Não informado")
+        .astype(str)
+        .isin(categories_display)
     ]
+    map_data = derive(map_data, filtered, dimension_col, categories_display)
 
 map_col, table_col = st.columns((3, 2))
 
@@ -327,47 +496,98 @@ with map_col:
     default_basemap = "OpenTopoMap"
     index = options.index(default_basemap) if default_basemap in options else 0
     basemap = st.selectbox("Mapa base", options, index, key="map_basemap")
+    vector_tiles = st.checkbox(
+        "Tiles vetoriais (carrega só a área visível)",
+        value=False,
+        help="O mapa pede ao servidor local apenas os tiles da área visível: "
+        "contagens por Tipo de Fonte nos zooms baixos e denúncias individuais "
+        "a partir do zoom 15.",
+    )
+    light_render = st.checkbox(
+        "Renderização leve (canvas com agregação por zoom)",
+        value=True,
+        disabled=vector_tiles,
+        help="Envia as coordenadas num único vetor e agrupa os pontos em células "
+        "nos zooms baixos. Marcadores individuais aparecem a partir do zoom 15.",
+    )
+    lazy_popups = st.checkbox(
+        "Popups sob demanda",
+        value=False,
+        disabled=not (light_render or vector_tiles),
+        help="Os marcadores levam apenas o número da linha; protocolo, descrição e "
+        "demais campos são buscados no servidor local quando o marcador é clicado. "
+        "Exige que o navegador alcance esse servidor (em deploy remoto ou atrás de "
+        "proxy, defina DENUNCIAS_SERVER_URL).",
+    )
 
-    m = leafmap.Map(
-        center=[map_data["latitude"].mean(), map_data["longitude"].mean()]
-        if not map_data.empty
-        else [-23.415367, -51.931343],
-        zoom=12.5,
-        locate_control=True,
-        latlon_control=True,
-        draw_export=True,
-        minimap_control=True,
+    cell_map = st.checkbox(
+        "Coroplético por célula",
+        value=False,
+        help="Agrega as denúncias filtradas numa grade e colore cada célula pela "
+        "contagem; o popup traz a quebra por Tipo de Fonte. Substitui os pontos "
+        "no mapa (os tiles vetoriais continuam disponíveis).",
     )
-    m.add_basemap(basemap)
+    grid_shape, grid_size = "hexagonal", GRID_RESOLUTIONS[1]
+    if cell_map:
+        shape_col, size_col = st.columns(2)
+        grid_shape = shape_col.selectbox(
+            "Forma da célula", list(GRID_SHAPES), format_func=GRID_SHAPES.get
+        )
+        grid_size = size_col.selectbox(
+            "Tamanho da célula",
+            GRID_RESOLUTIONS,
+            index=1,
+            format_func=lambda size: (
+                f"{size} m" if size < 1000 else f"{size // 1000} km"
+            ),
+        )
 
+    popup_fields = [
+        "Protocolo",
+        "DataInclusao",
+        "Descrição",
+        "endereco_formatado",
+    ]
+    available_fields = [col for col in popup_fields if col in map_data.columns]
+    popup_url = None
     if map_data.empty:
         st.info("Ajuste os filtros para visualizar as denúncias no mapa.")
-    else:
-        popup_fields = [
-            "Protocolo",
-            "DataInclusao",
-            "Descrição",
-            "endereco_formatado",
-        ]
-        available_fields = [col for col in popup_fields if col in map_data.columns]
-        if available_fields:
-            m.add_points_from_xy(
-                data=map_data,
-                x="longitude",
-                y="latitude",
-                popup=available_fields,
-                layer_name="Denúncias",
-            )
-        else:
-            m.add_points_from_xy(
-                data=map_data,
-                x="longitude",
-                y="latitude",
-                popup=None,
-                layer_name="Denúncias",
-            )
+    elif (vector_tiles or light_render) and lazy_popups:
+        popup_url = register_popup_source(map_data, available_fields)
+
+    tile_source = None
+    if vector_tiles and not map_data.empty:
+        tile_source = register_tile_source(map_data)
+    cells = None
+    if cell_map and not map_data.empty:
+        grid_index = load_grid_index()
+        cells = cells_feature_collection(
+            grid_index, grid_shape, grid_size, grid_index.positions(map_data)
+        )
 
-    m.to_streamlit(height=620)
+    map_key = map_cache_key(
+        "filtros",
+        fingerprint(map_data),
+        basemap,
+        light_render,
+        popup_url,
+        tile_source,
+        (grid_shape, grid_size) if cell_map else None,
+        available_fields,
+    )
+    map_html = cached_map_html(
+        map_key,
+        lambda: build_map_html(
+            map_data,
+            basemap,
+            light_render,
+            available_fields,
+            popup_url,
+            tile_source,
+            cells,
+        ),
+    )
+    components.html(map_html, height=620)
 
 with table_col:
     st.subheader("Detalhes das denúncias exibidas no mapa")
@@ -380,6 +600,7 @@ with table_col:
             "Descrição",
             "endereco_formatado",
             "bairro_formatado",
+            "denuncias_no_incidente",
         ]
         display_columns = [col for col in display_columns if col in map_data.columns]
         if not display_columns:
@@ -400,74 +621,17 @@ else:
     chart_render = chart_df.copy()
     chart_render["categoria"] = chart_render[dimension_col].astype(str)
 
-    x_order = chart_render["categoria"].tolist()
-
-    bars = (
-        alt.Chart(chart_render)
-        .mark_bar(color="#3B82F6")
-        .encode(
-            x=alt.X("categoria:N", sort=x_order, title=dimension_col),
-            y=alt.Y("contagem:Q", title="Denúncias"),
-            tooltip=[
-                alt.Tooltip("categoria:N", title=dimension_col),
-                alt.Tooltip("contagem:Q", title="Quantidade"),
-                alt.Tooltip("percentual:Q", title="% Frequência", format=".1f"),
-                alt.Tooltip(
-                    "percentual_acumulado:Q",
-                    title="% Acumulado",
-                    format=".1f",
-                ),
-            ],
-        )
-    )
-
-    line = (
-        alt.Chart(chart_render)
-        .mark_line(color="#F97316")
-        .encode(
-            x=alt.X("categoria:N", sort=x_order, title=dimension_col),
-            y=alt.Y(
-                "percentual_acumulado:Q",
-                axis=alt.Axis(title="% acumulado (%)", format=".1f"),
-            ),
-            tooltip=[
-                alt.Tooltip("categoria:N", title=dimension_col),
-                alt.Tooltip(
-                    "percentual_acumulado:Q",
-                    title="% Acumulado",
-                    format=".1f",
-                ),
-            ],
-        )
-    )
-
-    points = (
-        alt.Chart(chart_render)
-        .mark_point(color="#F97316", size=60)
-        .encode(
-            x=alt.X("categoria:N", sort=x_order, title=dimension_col),
-            y=alt.Y("percentual_acumulado:Q"),
-            tooltip=[
-                alt.Tooltip("categoria:N", title=dimension_col),
-                alt.Tooltip(
-                    "percentual_acumulado:Q",
-                    title="% Acumulado",
-                    format=".1f",
-                ),
-            ],
-        )
-    )
-
-    histogram = (
-        alt.layer(bars, line, points)
-        .resolve_scale(y="independent")
-        .properties(height=380)
-    )
+    histogram = pareto_chart(chart_render, category_title=dimension_col)
 
     st.altair_chart(histogram, width="stretch")
     st.caption(
         "O gráfico combina a frequência absoluta (barras) com o percentual acumulado (linha) para análise de Pareto."
     )
+    if len(chart_render) > MAX_PARETO_CATEGORIES:
+        st.caption(
+            f"Exibindo as {MAX_PARETO_CATEGORIES - 1} maiores categorias no gráfico; "
+            'as demais foram somadas em "Outros" (a tabela traz todas).'
+        )
 
     resumo_cols = [
         dimension_col,
@@ -487,3 +651,128 @@ else:
         }
     )
     st.dataframe(resumo, hide_index=True, width="stretch")
+
+st.markdown("### Tendência temporal")
+
+rollups = load_rollups()
+auto_resolution = pick_resolution(start_date, end_date)
+trend_resolution = st.selectbox(
+    "Resolução da série",
+    options=["auto", *resolutions_from(auto_resolution)],
+    format_func=lambda r: (
+        f"Automática ({RESOLUTION_LABELS[auto_resolution]})"
+        if r == "auto"
+        else RESOLUTION_LABELS[r]
+    ),
+    key="trend_resolution",
+)
+if trend_resolution == "auto":
+    trend_resolution = auto_resolution
+trend_by = st.radio(
+    "Detalhar tendência por",
+    options=["Total", "Tipo de Fonte"],
+    horizontal=True,
+    key="trend_by",
+)
+
+trend_bairros = None
+if search_bairro:
+    bairro_categories = pd.Series(
+        rollups[trend_resolution]["bairro_formatado"].cat.categories
+    )
+    trend_bairros = bairro_categories[
+        bairro_categories.str.contains(search_bairro, case=False, na=False)
+    ].tolist()
+
+trend = slice_rollup(
+    rollups,
+    trend_resolution,
+    start_date,
+    end_date,
+    bairros=trend_bairros,
+    tipos=None,
+    by=None if trend_by == "Total" else "Tipo de Fonte",
+)
+
+if trend.empty or trend["contagem"].sum() == 0:
+    st.info("Sem denúncias no período para montar a série temporal.")
+else:
+    trend_encoding = {
+        "x": alt.X("periodo:T", title=RESOLUTION_LABELS[trend_resolution]),
+        "y": alt.Y("contagem:Q", title="Denúncias"),
+        "tooltip": [
+            alt.Tooltip("periodo:T", title="Período"),
+            alt.Tooltip("contagem:Q", title="Denúncias", format=",.0f"),
+        ],
+    }
+    if trend_by != "Total":
+        trend_encoding["color"] = alt.Color("Tipo de Fonte:N", title="Tipo de Fonte")
+        trend_encoding["tooltip"].append(alt.Tooltip("Tipo de Fonte:N"))
+    trend_chart = (
+        alt.Chart(trend)
+        .mark_line(point=trend_resolution != "hora")
+        .encode(**trend_encoding)
+        .properties(height=320)
+    )
+    st.altair_chart(trend_chart, width="stretch")
+    st.caption(
+        "Série montada a partir de agregações pré-calculadas; considera apenas o período "
+        "e a busca por bairro selecionados."
+    )
+
+st.markdown("### Superfície de densidade (KDE)")
+st.markdown(
+    "Estimativa de densidade por núcleo das denúncias exibidas no mapa, em denúncias por km². "
+    "O GeoTIFF usa a mesma projeção (EPSG:4326) das camadas do GeoTIFF Extractor e pode ser "
+    "combinado com elas num SIG."
+)
+kde_col1, kde_col2, kde_col3, kde_col4 = st.columns(4)
+kde_kernel = kde_col1.selectbox("Núcleo", list(KERNELS), format_func=KERNELS.get)
+kde_bandwidth = kde_col2.select_slider(
+    "Largura de banda (m)",
+    BANDWIDTHS_M,
+    DEFAULT_BANDWIDTH_M,
+    help="Desvio padrão do núcleo gaussiano ou raio do núcleo de Epanechnikov.",
+)
+kde_resolution = kde_col3.selectbox(
+    "Resolução da grade (m)",
+    RESOLUTIONS_M,
+    index=RESOLUTIONS_M.index(DEFAULT_RESOLUTION_M),
+)
+kde_extent = kde_col4.radio("Área", list(EXTENTS), format_func=EXTENTS.get)
+
+if map_data.empty:
+    st.info("Sem denúncias para estimar a densidade com os filtros atuais.")
+else:
+    try:
+        kde = compute_kde(
+            map_data, kde_kernel, kde_bandwidth, kde_resolution, kde_extent
+        )
+    except ValueError as exc:
+        st.warning(str(exc))
+    else:
+        kde_key = map_cache_key(
+            "filtros_kde",
+            fingerprint(map_data),
+            kde_kernel,
+            kde_bandwidth,
+            kde_resolution,
+            kde_extent,
+            basemap,
+        )
+        components.html(
+            cached_map_html(kde_key, lambda: build_kde_map_html(kde, basemap)),
+            height=520,
+        )
+        rows, cols = kde.density.shape
+        st.caption(
+            f"Grade de {cols:,} x {rows:,} células de {kde_resolution} m com "
+            f"{kde.points:,} denúncias; densidade máxima de "
+            f"{float(kde.density.max()):,.1f} denúncias/km²."
+        )
+        st.download_button(
+            "Baixar GeoTIFF da densidade",
+            data=kde.to_geotiff,
+            file_name=f"kde_{kde_kernel}_{kde_bandwidth}m_{kde_resolution}m.tif",
+            mime="image/tiff",
+        )
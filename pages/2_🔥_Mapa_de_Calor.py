@@ -3,9 +3,26 @@ import json
 
 import pandas as pd
 import streamlit as st
+import streamlit.components.v1 as components
 import leafmap.foliumap as leafmap
 from folium.plugins import HeatMapWithTime
 
+from heat_frames import (
+    DEFAULT_CELL_METERS,
+    FRAME_MODES,
+    FRAME_RESOLUTIONS,
+    MAX_FRAMES,
+    TimeIndex,
+    delta_frames,
+    frame_count,
+    frame_labels,
+    grid_frames,
+    window_frames,
+)
+from map_cache import cached_map_html, map_cache_key
+from rollups import RESOLUTION_LABELS, pick_resolution
+from snapshot import data_version
+
 markdown = """
 Powered by: <https://www.coeficiencia.com.br>
 """
@@ -18,35 +35,39 @@ st.sidebar.image(logo)
 st.title("Mapa de Calor das Denúncias")
 
 data_path = Path(__file__).resolve().parent.parent / "mga_denuncias_20-23.geojson"
-with open(data_path, encoding="utf-8") as f:
-    geojson = json.load(f)
-
-records = []
-for feature in geojson.get("features", []):
-    properties = feature.get("properties", {}) or {}
-    geometry = feature.get("geometry", {}) or {}
-    coordinates = geometry.get("coordinates", [])
-    if not coordinates or len(coordinates) < 2:
-        continue
-    record = properties.copy()
-    record["longitude"] = coordinates[0]
-    record["latitude"] = coordinates[1]
-    records.append(record)
-
-df = pd.DataFrame(records)
-df["DataInclusao"] = pd.to_datetime(df["DataInclusao"], errors="coerce")
-df = df.dropna(subset=["DataInclusao", "latitude", "longitude"]).copy()
-if df.empty:
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_time_index(version: str) -> TimeIndex:
+    """Índice temporal do arquivo, lido e ordenado uma vez por versão dos dados."""
+    with open(data_path, encoding="utf-8") as f:
+        geojson = json.load(f)
+
+    records = []
+    for feature in geojson.get("features", []):
+        properties = feature.get("properties", {}) or {}
+        geometry = feature.get("geometry", {}) or {}
+        coordinates = geometry.get("coordinates", [])
+        if not coordinates or len(coordinates) < 2:
+            continue
+        record = properties.copy()
+        record["longitude"] = coordinates[0]
+        record["latitude"] = coordinates[1]
+        records.append(record)
+
+    df = pd.DataFrame(records, columns=["DataInclusao", "latitude", "longitude"])
+    df["DataInclusao"] = pd.to_datetime(df["DataInclusao"], errors="coerce")
+    df = df.dropna(subset=["DataInclusao", "latitude", "longitude"])
+    return TimeIndex.from_frame(df)
+
+
+time_index = load_time_index(data_version(data_path))
+if not len(time_index.times):
     st.warning("Nenhuma denúncia encontrada no arquivo GeoJSON fornecido.")
     st.stop()
 
-df = df.sort_values("DataInclusao")
-df["latitude"] = df["latitude"].astype(float)
-df["longitude"] = df["longitude"].astype(float)
-df["day"] = df["DataInclusao"].dt.floor("D")
-
-min_day = df["day"].min()
-max_day = df["day"].max()
+min_day = pd.Timestamp(time_index.times[0]).floor("D")
+max_day = pd.Timestamp(time_index.times[-1]).floor("D")
 slider = st.slider(
     "Selecione o intervalo de datas",
     min_value=min_day.to_pydatetime(),
@@ -55,43 +76,125 @@ slider = st.slider(
     format="DD/MM/YYYY",
 )
 start = pd.to_datetime(slider[0]).floor("D")
-end = pd.to_datetime(slider[1]).floor("D")
-
-df_window = df[(df["day"] >= start) & (df["day"] <= end)].copy()
-
-heat_data = []
-time_index = []
-accum = []
-if not df_window.empty:
-    for day, group in df_window.groupby("day"):
-        pts = group[["latitude", "longitude"]].values.tolist()
-        accum.extend(pts)
-        heat_data.append(accum.copy())
-        time_index.append(day.strftime("%Y-%m-%d"))
-
-if heat_data:
-    center_lat = df_window["latitude"].mean()
-    center_lon = df_window["longitude"].mean()
+end = pd.to_datetime(slider[1]).floor("D") + pd.Timedelta(days=1)
+
+mode_col, resolution_col, window_col = st.columns(3)
+with mode_col:
+    frame_mode = st.radio(
+        "Quadros",
+        list(FRAME_MODES),
+        index=list(FRAME_MODES).index("grade"),
+        format_func=FRAME_MODES.get,
+        horizontal=True,
+        help="Por período: só as denúncias de cada período. Janela móvel: as dos "
+        "últimos N períodos. Grade ponderada: contagens por célula, com o volume "
+        "de dados limitado pelo número de células ocupadas.",
+    )
+with resolution_col:
+    resolution = st.selectbox(
+        "Granularidade",
+        FRAME_RESOLUTIONS,
+        index=FRAME_RESOLUTIONS.index("dia"),
+        format_func=RESOLUTION_LABELS.get,
+    )
+with window_col:
+    cumulative = frame_mode == "grade" and st.checkbox(
+        "Acumular desde o início",
+        value=True,
+        help="Cada quadro soma todas as denúncias até o período exibido.",
+    )
+    window = st.number_input(
+        "Períodos na janela",
+        min_value=1,
+        max_value=90,
+        value=7,
+        step=1,
+        disabled=frame_mode == "delta" or cumulative,
+    )
+
+if frame_count(start, end, resolution) > MAX_FRAMES:
+    coarser = pick_resolution(start, end, MAX_FRAMES)
+    coarser = coarser if coarser in FRAME_RESOLUTIONS else FRAME_RESOLUTIONS[-1]
+    st.info(
+        f"O intervalo gera mais de {MAX_FRAMES} quadros na granularidade "
+        f"{RESOLUTION_LABELS[resolution].lower()}; usando "
+        f"{RESOLUTION_LABELS[coarser].lower()}."
+    )
+    resolution = coarser
+
+span = time_index.span(start, end)
+
+
+def build_heat_map_html(
+    span: slice,
+    resolution: str,
+    frame_mode: str,
+    window: int | None,
+    cumulative: bool,
+    center: list[float],
+) -> str:
+    labels, edges = time_index.period_edges(span, resolution)
+    if frame_mode == "delta":
+        heat_data = delta_frames(time_index, edges)
+    elif frame_mode == "janela":
+        heat_data = window_frames(time_index, edges, window)
+    else:
+        heat_data = grid_frames(
+            time_index,
+            edges,
+            window=None if cumulative else window,
+            cell_meters=DEFAULT_CELL_METERS,
+        )
+
+    m = leafmap.Map(
+        center=center,
+        zoom=12,
+        tiles="OpenStreetMap",
+    )
+
+    if heat_data:
+        HeatMapWithTime(
+            heat_data,
+            index=frame_labels(labels, resolution),
+            auto_play=True,
+            max_opacity=0.8,
+            radius=15,
+            gradient=None,
+            use_local_extrema=False,
+        ).add_to(m)
+
+    m.add_layer_control()
+    return m.to_html()
+
+
+if span.stop > span.start:
+    center = [
+        float(time_index.latitude[span].mean()),
+        float(time_index.longitude[span].mean()),
+    ]
 else:
-    center_lat = df["latitude"].mean()
-    center_lon = df["longitude"].mean()
+    center = [float(time_index.latitude.mean()), float(time_index.longitude.mean())]
     st.warning("Nenhuma denúncia encontrada no intervalo selecionado.")
 
-m = leafmap.Map(
-    center=[center_lat, center_lon],
-    zoom=12,
-    tiles="OpenStreetMap",
+# a janela só muda os quadros da janela móvel e da grade não acumulada
+uses_window = frame_mode == "janela" or (frame_mode == "grade" and not cumulative)
+frame_window = window if uses_window else None
+map_key = map_cache_key(
+    "mapa_de_calor",
+    data_version(data_path),
+    start,
+    end,
+    resolution,
+    frame_mode,
+    frame_window,
+    cumulative,
+)
+components.html(
+    cached_map_html(
+        map_key,
+        lambda: build_heat_map_html(
+            span, resolution, frame_mode, frame_window, cumulative, center
+        ),
+    ),
+    height=500,
 )
-
-if heat_data:
-    HeatMapWithTime(
-        heat_data,
-        index=time_index,
-        auto_play=True,
-        max_opacity=0.8,
-        radius=15,
-        gradient=None,
-        use_local_extrema=False,
-    ).add_to(m)
-
-m.to_streamlit(height=500)
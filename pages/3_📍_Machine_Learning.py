@@ -1,5 +1,6 @@
 import os
 import json
+import uuid
 from pathlib import Path
 
 import numpy as np
@@ -8,7 +9,43 @@ import streamlit as st
 import streamlit.components.v1 as components
 import folium
 import altair as alt
-from sklearn.cluster import KMeans, OPTICS
+from sklearn.cluster import KMeans
+
+from elbow import elbow_curve
+from grid import GRID_RESOLUTIONS, GRID_SHAPES, GridIndex, build_grid_index
+from hotspots import (
+    DEFAULT_BAND_M,
+    DISTANCE_BANDS,
+    HOTSPOT_LABELS,
+    HOTSPOT_PALETTE,
+    cell_hotspots,
+    hotspots_feature_collection,
+)
+from jobs import COMPLETED, FAILED, Job, runner
+from map_cache import cached_map_html, map_cache_key
+from map_layers import (
+    CellChoroplethLayer,
+    GeoJsonPointLayer,
+    points_feature_collection,
+    register_popup_source,
+)
+from optics_model import (
+    EXTRACTION_METHODS,
+    OPTICS_MAX_EPS_M,
+    REACHABILITY_MIN_SAMPLES,
+    Reachability,
+)
+from result_store import cached_result, result_key
+from snapshot import data_version, stamp
+from spatial_index import SpatialIndex, get_spatial_index
+from st_dbscan import (
+    DEFAULT_MIN_SAMPLES,
+    DEFAULT_RADIUS_M,
+    DEFAULT_WINDOW_DAYS,
+    episode_table,
+    st_dbscan,
+)
+from vector_tiles import VectorTileLayer, register_tile_source
 
 os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
 
@@ -56,34 +93,137 @@ def load_data() -> pd.DataFrame:
     )
     df = df.dropna(subset=["latitude", "longitude"]).copy()
     df = df[df["latitude"].between(-90, 90) & df["longitude"].between(-180, 180)]
-    return df
+    return stamp(df, data_version(), "machine_learning")
 
 
-@st.cache_data(show_spinner=False)
-def run_optics(points: pd.DataFrame, min_samples: int) -> np.ndarray:
-    coords = points[["latitude", "longitude"]].to_numpy()
-    coords_rad = np.radians(coords)
-    optics = OPTICS(metric="haversine", min_samples=min_samples)
-    return optics.fit_predict(coords_rad)
+@st.cache_resource(show_spinner=False)
+def load_grid_index() -> GridIndex:
+    return build_grid_index(load_data())
 
 
 @st.cache_data(show_spinner=False)
-def run_kmeans(points: pd.DataFrame, n_clusters: int) -> tuple[np.ndarray, float]:
-    coords = points[["latitude", "longitude"]].to_numpy()
-    model = KMeans(n_clusters=n_clusters, n_init="auto", random_state=42)
-    labels = model.fit_predict(coords)
-    return labels, float(model.inertia_)
+def compute_hotspots(
+    shape: str, size: int, band_m: int, source_types: tuple[str, ...]
+) -> pd.DataFrame:
+    grid = load_grid_index()
+    positions = None
+    if source_types:
+        codes = [grid.categories.index(name) for name in source_types]
+        positions = np.flatnonzero(np.isin(grid.category_codes, codes))
+    return cell_hotspots(grid, shape, size, positions, band_m)
 
 
 @st.cache_data(show_spinner=False)
-def compute_wcss(points: pd.DataFrame, max_clusters: int) -> list[float]:
-    values = points[["latitude", "longitude"]]
-    wcss = []
-    for k in range(1, max_clusters + 1):
-        model = KMeans(n_clusters=k, n_init="auto", random_state=42)
-        model.fit(values)
-        wcss.append(float(model.inertia_))
-    return wcss
+def compute_episodes(radius_m: int, window_days: int, min_samples: int) -> pd.DataFrame:
+    df = load_data()
+    labels = st_dbscan(
+        get_spatial_index(df),
+        df["DataInclusao"].to_numpy(),
+        radius_m,
+        window_days,
+        min_samples,
+    )
+    return episode_table(df, labels, radius_m)
+
+
+JOB_POLL_SECONDS = 1.0
+
+
+# As funções abaixo rodam no pool de `jobs`, fora da thread do script: não chamam `st.*`.
+# Os resultados também ficam no disco (`result_store`), chaveados pela chave do trabalho.
+def fit_reachability(job: Job, index: SpatialIndex) -> Reachability:
+    job.report(0.0, "Calculando a reachability do OPTICS...")
+    return cached_result(
+        "reachability",
+        result_key(job.key, REACHABILITY_MIN_SAMPLES, OPTICS_MAX_EPS_M),
+        lambda: Reachability.fit(index),
+    )
+
+
+def run_clustering(
+    job: Job,
+    reachability_job: Job,
+    coords: np.ndarray,
+    extraction: str,
+    min_samples: int | None,
+    eps_m: float | None,
+    n_clusters: int,
+) -> dict:
+    def compute() -> dict:
+        job.report(0.0, "Calculando a reachability do OPTICS...")
+        reachability = reachability_job.get(poll=job)
+        job.report(0.6, "Extraindo os clusters do OPTICS...")
+        optics_labels = (
+            reachability.eps_labels(eps_m)
+            if extraction == "eps"
+            else reachability.xi_labels(min_samples)
+        )
+        result = {
+            "optics_labels": optics_labels,
+            "optics_medians": None,
+            "kmeans_model": None,
+            "kmeans_labels": None,
+            "kmeans_centroids": None,
+            "inertia": None,
+        }
+        clean = optics_labels != -1
+        points = pd.DataFrame(coords[clean], columns=["latitude", "longitude"])
+        points["optics_cluster"] = optics_labels[clean]
+        result["optics_medians"] = (
+            points.groupby("optics_cluster")
+            .agg(
+                latitude=("latitude", "median"),
+                longitude=("longitude", "median"),
+                quantidade=("latitude", "size"),
+            )
+            .reset_index(drop=False)
+            .rename(columns={"optics_cluster": "cluster"})
+        )
+        if clean.sum() >= n_clusters:
+            job.report(0.8, "Ajustando o K-Means...")
+            model = KMeans(n_clusters=n_clusters, n_init="auto", random_state=42)
+            points["kmeans_cluster"] = model.fit_predict(
+                points[["latitude", "longitude"]]
+            )
+            result["kmeans_model"] = model
+            result["kmeans_labels"] = points["kmeans_cluster"].to_numpy()
+            result["kmeans_centroids"] = (
+                points.groupby("kmeans_cluster")
+                .agg(
+                    latitude=("latitude", "mean"),
+                    longitude=("longitude", "mean"),
+                    quantidade=("latitude", "size"),
+                )
+                .reset_index(drop=False)
+            )
+            result["inertia"] = float(model.inertia_)
+        return result
+
+    return cached_result("agrupamento", result_key(*job.key), compute)
+
+
+def run_elbow(job: Job, coords: np.ndarray, max_clusters: int) -> pd.DataFrame:
+    job.report(0.0, "Calculando a curva do cotovelo...")
+    return cached_result(
+        "cotovelo",
+        result_key(*job.key, max_clusters),
+        lambda: elbow_curve(coords, max_clusters, progress=job.report),
+    )
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress(job: Job) -> None:
+    # ao terminar, a página inteira é executada de novo com o resultado
+    if job.done:
+        st.rerun()
+    st.progress(job.progress, text=job.message or "Aguardando na fila...")
+
+
+def latest_result(job: Job, state_key: str) -> Job | None:
+    """O trabalho, se concluído; senão, o último concluído desta sessão."""
+    if job.status == COMPLETED:
+        st.session_state[state_key] = job
+    return st.session_state.get(state_key)
 
 
 df_raw = load_data()
@@ -98,17 +238,66 @@ st.sidebar.markdown(
     **Como ajustar os agrupamentos**
 
     - `Tamanho mínimo de cluster (OPTICS)`: aumente para ignorar ruídos isolados.
+    - `Extração dos clusters (OPTICS)`: troque a variação de densidade por um
+      corte fixo de distância entre vizinhos.
     - `Número de clusters (K-Means)`: teste diferentes agrupamentos esperados.
     - `Máximo de pontos`: reduz a amostra exibida no mapa para manter fluidez.
     """
 )
-min_samples = st.sidebar.slider("Tamanho mínimo de cluster (OPTICS)", 5, 100, 15, 1)
+extraction = st.sidebar.radio(
+    "Extração dos clusters (OPTICS)",
+    list(EXTRACTION_METHODS),
+    format_func=EXTRACTION_METHODS.get,
+)
+if extraction == "eps":
+    min_samples = None
+    eps_m = st.sidebar.slider("Distância máxima entre vizinhos (m)", 10, 500, 100, 10)
+else:
+    min_samples = st.sidebar.slider(
+        "Tamanho mínimo de cluster (OPTICS)", REACHABILITY_MIN_SAMPLES, 100, 15, 1
+    )
+    eps_m = None
 cluster_count = st.sidebar.slider("Número de clusters (K-Means)", 2, 10, 4, 1)
-sample_limit = st.sidebar.slider("Máximo de pontos exibidos no mapa", 200, 5000, 2000, 100)
+max_map_points = max(200, len(df_raw))
+sample_limit = st.sidebar.slider(
+    "Máximo de pontos exibidos no mapa",
+    200,
+    max_map_points,
+    min(5000, max_map_points),
+    100,
+)
 
-optics_labels = run_optics(df_raw, min_samples)
+jobs = runner()
+session_jobs = st.session_state.setdefault("ml_jobs_session", uuid.uuid4().hex)
+version = data_version()
+coords_raw = df_raw[["latitude", "longitude"]].to_numpy(dtype=float)
+spatial_index = get_spatial_index(df_raw)
+reachability_job = jobs.submit(
+    "reachability", version, lambda job: fit_reachability(job, spatial_index)
+)
+clustering_job = jobs.submit(
+    f"agrupamento:{session_jobs}",
+    (version, extraction, min_samples, eps_m, cluster_count),
+    lambda job: run_clustering(
+        job, reachability_job, coords_raw, extraction, min_samples, eps_m, cluster_count
+    ),
+)
+if clustering_job.status == FAILED:
+    st.error(f"Falha ao calcular os agrupamentos: {clustering_job.error}")
+    st.stop()
+clustering = latest_result(clustering_job, "ml_last_clustering")
+if clustering is None or clustering.key[0] != version:
+    show_job_progress(clustering_job)
+    st.stop()
+if clustering is not clustering_job:
+    st.caption(
+        "Exibindo o último agrupamento concluído enquanto os novos parâmetros são processados."
+    )
+    show_job_progress(clustering_job)
+
+clustering_result = clustering.result
 df_optics = df_raw.copy()
-df_optics["optics_cluster"] = optics_labels
+df_optics["optics_cluster"] = clustering_result["optics_labels"]
 
 df_clean = df_optics[df_optics["optics_cluster"] != -1].copy()
 
@@ -125,52 +314,33 @@ highlight_optics = st.sidebar.slider(
     1,
 )
 
-medians_by_optics = (
-    df_clean.groupby("optics_cluster")
-    .agg(
-        latitude=("latitude", "median"),
-        longitude=("longitude", "median"),
-        quantidade=("latitude", "size"),
-    )
-    .reset_index(drop=False)
-    .rename(columns={"optics_cluster": "cluster"})
-)
+medians_by_optics = clustering_result["optics_medians"]
 
-if len(df_clean) < cluster_count:
+if clustering_result["kmeans_labels"] is None:
     st.warning(
         "Há menos pontos limpos do que clusters solicitados. "
         "Reduza o número de clusters ou ajuste o parâmetro do OPTICS."
     )
     st.stop()
 
-kmeans_labels, inertia = run_kmeans(df_clean, cluster_count)
-df_clean["kmeans_cluster"] = kmeans_labels
+df_clean["kmeans_cluster"] = clustering_result["kmeans_labels"]
+inertia = clustering_result["inertia"]
 
-optics_to_kmeans = (
-    df_clean.groupby("optics_cluster")["kmeans_cluster"]
-    .agg(lambda s: s.value_counts().idxmax())
+optics_to_kmeans = df_clean.groupby("optics_cluster")["kmeans_cluster"].agg(
+    lambda s: s.value_counts().idxmax()
 )
 
 cluster_counts = (
-    df_clean["kmeans_cluster"].value_counts()
+    df_clean["kmeans_cluster"]
+    .value_counts()
     .sort_index()
     .rename_axis("cluster")
     .reset_index(name="quantidade")
 )
-cluster_centroids = (
-    df_clean.groupby("kmeans_cluster")
-    .agg(
-        latitude=("latitude", "mean"),
-        longitude=("longitude", "mean"),
-        quantidade=("latitude", "size"),
-    )
-    .reset_index(drop=False)
-)
+cluster_centroids = clustering_result["kmeans_centroids"]
 
 df_for_map = df_clean.copy()
-df_for_map["cluster_name"] = (
-    "Cluster " + (df_for_map["kmeans_cluster"] + 1).astype(str)
-)
+df_for_map["cluster_name"] = "Cluster " + (df_for_map["kmeans_cluster"] + 1).astype(str)
 
 if len(df_for_map) > sample_limit:
     df_for_map = df_for_map.sample(sample_limit, random_state=42)
@@ -182,7 +352,9 @@ center = [
 
 default_key = os.getenv("MAPTILER_KEY", "UYt1hZNFFGFt10Gokner")
 maptiler_key = default_key
-st.sidebar.caption("Mapa base carregado com a chave padrão configurada para o MapTiler.")
+st.sidebar.caption(
+    "Mapa base carregado com a chave padrão configurada para o MapTiler."
+)
 
 tile_layer = (
     f"https://api.maptiler.com/maps/streets-v2/256/{{z}}/{{x}}/{{y}}.png?key={maptiler_key}"
@@ -208,8 +380,12 @@ for idx, cluster_id in enumerate(sorted(df_clean["kmeans_cluster"].unique())):
     base_idx = idx % len(cluster_palette)
     cluster_colors[cluster_id] = cluster_palette[base_idx]
 
-centroids_display = medians_by_optics.sort_values("quantidade", ascending=False).reset_index(drop=True)
-centroids_display["cluster_kmeans"] = centroids_display["cluster"].map(optics_to_kmeans).fillna(-1).astype(int)
+centroids_display = medians_by_optics.sort_values(
+    "quantidade", ascending=False
+).reset_index(drop=True)
+centroids_display["cluster_kmeans"] = (
+    centroids_display["cluster"].map(optics_to_kmeans).fillna(-1).astype(int)
+)
 centroids_display["cor_legenda"] = centroids_display["cluster_kmeans"].map(
     lambda c: cluster_colors.get(c, ("#1F2937", "#9CA3AF"))[1]
 )
@@ -222,98 +398,146 @@ st.markdown(
     "Os centróides OPTICS mais relevantes (configurados na barra lateral) aparecem maiores."
 )
 
-cluster_map = folium.Map(location=center, zoom_start=12.5, tiles=None if maptiler_key else tile_layer)
+df_for_map["data_label"] = (
+    df_for_map["DataInclusao"].dt.strftime("%d/%m/%Y %H:%M").fillna("n/d")
+)
+if "endereco_completo" not in df_for_map.columns:
+    df_for_map["endereco_completo"] = ""
+df_for_map["endereco_completo"] = df_for_map["endereco_completo"].fillna("")
+
+cluster_styles = {
+    cluster_id: {"color": border_color, "fillColor": fill_color}
+    for cluster_id, (border_color, fill_color) in cluster_colors.items()
+}
+
+all_points_tiles = register_tile_source(df_raw)
+all_points_popups = register_popup_source(
+    df_raw, ["Protocolo", "DataInclusao", "Tipo de Fonte", "endereco_completo"]
+)
+
 
-if maptiler_key:
-    folium.TileLayer(
-        tiles=tile_layer,
-        attr="&copy; MapTiler &copy; OpenStreetMap contributors",
-        name="MapTiler Streets",
+def build_cluster_map_html() -> str:
+    cluster_map = folium.Map(
+        location=center,
+        zoom_start=12.5,
+        tiles=None if maptiler_key else tile_layer,
+        prefer_canvas=True,
+    )
+
+    if maptiler_key:
+        folium.TileLayer(
+            tiles=tile_layer,
+            attr="&copy; MapTiler &copy; OpenStreetMap contributors",
+            name="MapTiler Streets",
+        ).add_to(cluster_map)
+
+    VectorTileLayer(
+        *all_points_tiles,
+        popup_url=all_points_popups,
+        name="Todas as denúncias (tiles vetoriais)",
+        show=False,
     ).add_to(cluster_map)
 
-for cluster_id, group in df_for_map.groupby("kmeans_cluster"):
-    border_color, fill_color = cluster_colors[cluster_id]
-    label = f"Cluster {cluster_id + 1}"
-    feature_group = folium.FeatureGroup(name=label)
-    for _, row in group.iterrows():
-        popup_text = (
-            f"<b>Cluster:</b> {label}<br>"
-            f"<b>Data:</b> {row['DataInclusao'].strftime('%d/%m/%Y %H:%M') if pd.notnull(row['DataInclusao']) else 'n/d'}<br>"
-            f"<b>Endereço:</b> {row.get('endereco_completo', '')}"
+    for cluster_id, group in df_for_map.groupby("kmeans_cluster"):
+        GeoJsonPointLayer(
+            points_feature_collection(
+                group,
+                {
+                    "cluster_id": "kmeans_cluster",
+                    "cluster": "cluster_name",
+                    "data": "data_label",
+                    "endereco": "endereco_completo",
+                },
+            ),
+            style_property="cluster_id",
+            styles=cluster_styles,
+            popup_fields={
+                "cluster": "Cluster:",
+                "data": "Data:",
+                "endereco": "Endereço:",
+            },
+            name=f"Cluster {cluster_id + 1}",
+        ).add_to(cluster_map)
+
+    max_optics_count = centroids_display["quantidade"].max()
+    min_optics_count = centroids_display["quantidade"].min()
+
+    def scale_radius(count: int, highlight: bool) -> float:
+        if max_optics_count == min_optics_count:
+            return 14.0 if highlight else 8.0
+        norm = (count - min_optics_count) / (max_optics_count - min_optics_count)
+        if highlight:
+            return 12.0 + norm * 8.0
+        return 5.0 + norm * 4.0
+
+    centroid_layer = folium.FeatureGroup(name="Centróides (OPTICS)", show=True)
+    for idx, row in centroids_display.iterrows():
+        highlight = idx < highlight_optics
+        border_color, fill_color = cluster_colors.get(
+            row["cluster_kmeans"], ("#1F2937", "#9CA3AF")
+        )
+        popup = (
+            f"<b>Cluster:</b> {row['cluster'] + 1}<br>"
+            f"<b>Cluster K-Means predominante:</b> {row['cluster_kmeans'] + 1 if row['cluster_kmeans'] >= 0 else 'n/d'}<br>"
+            f"<b>Denúncias no cluster:</b> {int(row['quantidade']):,}<br>"
+            f"<b>Latitude:</b> {row['latitude']:.6f}<br>"
+            f"<b>Longitude:</b> {row['longitude']:.6f}"
         )
         folium.CircleMarker(
             location=[row["latitude"], row["longitude"]],
-            radius=4,
+            radius=scale_radius(int(row["quantidade"]), highlight),
             color=border_color,
+            weight=3 if highlight else 1,
             fill=True,
             fill_color=fill_color,
-            fill_opacity=0.8,
-            weight=1,
-            popup=popup_text,
-        ).add_to(feature_group)
-    feature_group.add_to(cluster_map)
-
-max_optics_count = centroids_display["quantidade"].max()
-min_optics_count = centroids_display["quantidade"].min()
-
-
-def scale_radius(count: int, highlight: bool) -> float:
-    if max_optics_count == min_optics_count:
-        return 14.0 if highlight else 8.0
-    norm = (count - min_optics_count) / (max_optics_count - min_optics_count)
-    if highlight:
-        return 12.0 + norm * 8.0
-    return 5.0 + norm * 4.0
-
-
-centroid_layer = folium.FeatureGroup(name="Centróides (OPTICS)", show=True)
-for idx, row in centroids_display.iterrows():
-    highlight = idx < highlight_optics
-    border_color, fill_color = cluster_colors.get(row["cluster_kmeans"], ("#1F2937", "#9CA3AF"))
-    popup = (
-        f"<b>Cluster:</b> {row['cluster'] + 1}<br>"
-        f"<b>Cluster K-Means predominante:</b> {row['cluster_kmeans'] + 1 if row['cluster_kmeans'] >= 0 else 'n/d'}<br>"
-        f"<b>Denúncias no cluster:</b> {int(row['quantidade']):,}<br>"
-        f"<b>Latitude:</b> {row['latitude']:.6f}<br>"
-        f"<b>Longitude:</b> {row['longitude']:.6f}"
-    )
-    folium.CircleMarker(
-        location=[row["latitude"], row["longitude"]],
-        radius=scale_radius(int(row["quantidade"]), highlight),
-        color=border_color,
-        weight=3 if highlight else 1,
-        fill=True,
-        fill_color=fill_color,
-        fill_opacity=0.95 if highlight else 0.75,
-        popup=popup,
-    ).add_to(centroid_layer)
-centroid_layer.add_to(cluster_map)
-
-kmeans_centroid_layer = folium.FeatureGroup(name="Centróides (K-Means)", show=True)
-for _, row in cluster_centroids.iterrows():
-    cluster_id = int(row["kmeans_cluster"])
-    border_color, fill_color = cluster_colors.get(cluster_id, ("#1F2937", "#9CA3AF"))
-    popup = (
-        f"<b>Cluster K-Means:</b> {cluster_id + 1}<br>"
-        f"<b>Denúncias no cluster:</b> {int(row['quantidade']):,}<br>"
-        f"<b>Latitude:</b> {row['latitude']:.6f}<br>"
-        f"<b>Longitude:</b> {row['longitude']:.6f}"
-    )
-    folium.CircleMarker(
-        location=[row["latitude"], row["longitude"]],
-        radius=10,
-        color=border_color,
-        weight=4,
-        fill=True,
-        fill_color=fill_color,
-        fill_opacity=0.6,
-        popup=popup,
-    ).add_to(kmeans_centroid_layer)
-kmeans_centroid_layer.add_to(cluster_map)
-
-folium.LayerControl(collapsed=False).add_to(cluster_map)
-
-components.html(cluster_map._repr_html_(), height=600, scrolling=False)
+            fill_opacity=0.95 if highlight else 0.75,
+            popup=popup,
+        ).add_to(centroid_layer)
+    centroid_layer.add_to(cluster_map)
+
+    kmeans_centroid_layer = folium.FeatureGroup(name="Centróides (K-Means)", show=True)
+    for _, row in cluster_centroids.iterrows():
+        cluster_id = int(row["kmeans_cluster"])
+        border_color, fill_color = cluster_colors.get(
+            cluster_id, ("#1F2937", "#9CA3AF")
+        )
+        popup = (
+            f"<b>Cluster K-Means:</b> {cluster_id + 1}<br>"
+            f"<b>Denúncias no cluster:</b> {int(row['quantidade']):,}<br>"
+            f"<b>Latitude:</b> {row['latitude']:.6f}<br>"
+            f"<b>Longitude:</b> {row['longitude']:.6f}"
+        )
+        folium.CircleMarker(
+            location=[row["latitude"], row["longitude"]],
+            radius=10,
+            color=border_color,
+            weight=4,
+            fill=True,
+            fill_color=fill_color,
+            fill_opacity=0.6,
+            popup=popup,
+        ).add_to(kmeans_centroid_layer)
+    kmeans_centroid_layer.add_to(cluster_map)
+
+    folium.LayerControl(collapsed=False).add_to(cluster_map)
+
+    return cluster_map._repr_html_()
+
+
+cluster_map_key = map_cache_key(
+    "machine_learning",
+    *clustering.key,
+    sample_limit,
+    highlight_optics,
+    tile_layer,
+    all_points_tiles,
+    all_points_popups,
+)
+components.html(
+    cached_map_html(cluster_map_key, build_cluster_map_html),
+    height=600,
+    scrolling=False,
+)
 
 st.markdown("### Indicadores gerais")
 st.markdown(
@@ -325,7 +549,7 @@ col_total.metric("Denúncias geocodificadas", f"{len(df_raw):,}")
 col_clean.metric("Pontos após OPTICS", f"{len(df_clean):,}")
 
 ## with st.expander("Visualizar dados brutos"):
-    ## st.dataframe(df_raw.head(1000))
+## st.dataframe(df_raw.head(1000))
 
 st.markdown("### Centróides identificados pelo OPTICS")
 st.markdown(
@@ -334,11 +558,15 @@ st.markdown(
 )
 optics_chart_data = centroids_display.copy()
 optics_chart_data["Cluster OPTICS"] = optics_chart_data["cluster"] + 1
-optics_chart_data["Cluster K-Means predominante"] = optics_chart_data["cluster_kmeans"].apply(
-    lambda v: f"Cluster {int(v) + 1}" if v >= 0 else "Sem K-Means predominante"
+optics_chart_data["Cluster K-Means predominante"] = optics_chart_data[
+    "cluster_kmeans"
+].apply(lambda v: f"Cluster {int(v) + 1}" if v >= 0 else "Sem K-Means predominante")
+optics_chart_data["cluster_optics_label"] = optics_chart_data["Cluster OPTICS"].astype(
+    str
+)
+optics_color_domain = list(
+    dict.fromkeys(optics_chart_data["Cluster K-Means predominante"])
 )
-optics_chart_data["cluster_optics_label"] = optics_chart_data["Cluster OPTICS"].astype(str)
-optics_color_domain = list(dict.fromkeys(optics_chart_data["Cluster K-Means predominante"]))
 optics_color_range = []
 for label in optics_color_domain:
     if label.startswith("Cluster "):
@@ -427,9 +655,9 @@ st.write(
     f"**{inertia:,.2f}**"
 )
 cluster_counts_chart_data = cluster_counts.copy()
-cluster_counts_chart_data["cluster_label"] = (
-    "Cluster " + (cluster_counts_chart_data["cluster"] + 1).astype(str)
-)
+cluster_counts_chart_data["cluster_label"] = "Cluster " + (
+    cluster_counts_chart_data["cluster"] + 1
+).astype(str)
 cluster_counts_chart = (
     alt.Chart(cluster_counts_chart_data)
     .mark_bar(color="#10B981")
@@ -454,42 +682,211 @@ st.markdown(
     """
 )
 
-wcss = compute_wcss(df_clean, max_clusters=10)
-ks = list(range(1, len(wcss) + 1))
-wcss_chart_data = pd.DataFrame(
-    {
-        "Clusters": ks,
-        "WCSS": wcss,
-    }
+# a curva depende só dos pontos limpos, ou seja, dos parâmetros do OPTICS
+coords_clean = df_clean[["latitude", "longitude"]].to_numpy(dtype=float)
+elbow_job = jobs.submit(
+    f"cotovelo:{session_jobs}",
+    clustering.key[:-1],
+    lambda job: run_elbow(job, coords_clean, max_clusters=10),
 )
+if elbow_job.status == FAILED:
+    st.error(f"Falha ao calcular a curva do cotovelo: {elbow_job.error}")
+    st.stop()
+elbow = latest_result(elbow_job, "ml_last_elbow")
+if elbow is not elbow_job:
+    if elbow is not None:
+        st.caption("Exibindo a última curva concluída enquanto a nova é calculada.")
+    show_job_progress(elbow_job)
+if elbow is not None:
+    wcss_chart_data = elbow.result
+
+    wcss_line = (
+        alt.Chart(wcss_chart_data)
+        .mark_line(color="#3B82F6")
+        .encode(
+            x=alt.X("Clusters:O", title="Número de clusters"),
+            y=alt.Y("WCSS:Q", title="WCSS"),
+        )
+    )
 
-wcss_line = (
-    alt.Chart(wcss_chart_data)
-    .mark_line(color="#3B82F6")
-    .encode(
-        x=alt.X("Clusters:O", title="Número de clusters"),
-        y=alt.Y("WCSS:Q", title="WCSS"),
+    wcss_points = (
+        alt.Chart(wcss_chart_data)
+        .mark_point(size=80)
+        .encode(
+            x=alt.X("Clusters:O"),
+            y=alt.Y("WCSS:Q"),
+            color=alt.value("#3B82F6"),
+            tooltip=[
+                alt.Tooltip("Clusters:O", title="Clusters"),
+                alt.Tooltip("WCSS:Q", title="WCSS", format=",.0f"),
+                alt.Tooltip("Silhueta:Q", title="Silhueta (amostra)", format=".3f"),
+                alt.Tooltip(
+                    "Calinski-Harabasz:Q",
+                    title="Calinski–Harabasz (amostra)",
+                    format=",.0f",
+                ),
+            ],
+        )
     )
-)
 
-wcss_points = (
-    alt.Chart(wcss_chart_data)
-    .mark_point(size=80)
-    .encode(
-        x=alt.X("Clusters:O"),
-        y=alt.Y("WCSS:Q"),
-        color=alt.value("#3B82F6"),
-        tooltip=[
-            alt.Tooltip("Clusters:O", title="Clusters"),
-            alt.Tooltip("WCSS:Q", title="WCSS", format=",.0f"),
-        ],
+    wcss_chart = (wcss_line + wcss_points).properties(height=360)
+
+    st.markdown(
+        "O gráfico do método do cotovelo ajuda a encontrar um número adequado de clusters: "
+        "procure pelo ponto onde a queda de WCSS começa a se estabilizar."
     )
+    st.altair_chart(wcss_chart.interactive(), use_container_width=True)
+
+    silhouette_chart_data = wcss_chart_data.dropna(subset=["Silhueta"])
+    if not silhouette_chart_data.empty:
+        silhouette_chart = (
+            alt.Chart(silhouette_chart_data)
+            .mark_line(color="#10B981", point=True)
+            .encode(
+                x=alt.X("Clusters:O", title="Número de clusters"),
+                y=alt.Y("Silhueta:Q", title="Silhueta"),
+                tooltip=[
+                    alt.Tooltip("Clusters:O", title="Clusters"),
+                    alt.Tooltip("Silhueta:Q", title="Silhueta (amostra)", format=".3f"),
+                    alt.Tooltip(
+                        "Calinski-Harabasz:Q",
+                        title="Calinski–Harabasz (amostra)",
+                        format=",.0f",
+                    ),
+                ],
+            )
+            .properties(height=280)
+        )
+        st.markdown(
+            "A silhueta, calculada numa amostra dos pontos, complementa o cotovelo: "
+            "valores mais altos indicam clusters mais coesos e bem separados."
+        )
+        st.altair_chart(silhouette_chart.interactive(), use_container_width=True)
+
+st.markdown("### Hotspots estatísticos (Getis-Ord Gi*)")
+st.markdown(
+    "O Gi* compara a soma das denúncias de cada célula e das vizinhas (dentro da banda "
+    "de distância) com o esperado se as denúncias estivessem espalhadas ao acaso. "
+    "Escores z altos indicam concentrações estatisticamente significativas (hotspots); "
+    "escores baixos, áreas com menos denúncias que o esperado (coldspots)."
+)
+grid_index = load_grid_index()
+col_shape, col_size, col_band = st.columns(3)
+hotspot_shape = col_shape.selectbox(
+    "Forma da célula", list(GRID_SHAPES), format_func=GRID_SHAPES.get
+)
+hotspot_size = col_size.selectbox("Tamanho da célula (m)", GRID_RESOLUTIONS, index=1)
+hotspot_band = col_band.selectbox(
+    "Banda de distância (m)", DISTANCE_BANDS, index=DISTANCE_BANDS.index(DEFAULT_BAND_M)
+)
+hotspot_types = tuple(
+    sorted(
+        st.multiselect(
+            "Tipos de fonte considerados", grid_index.categories, placeholder="Todos"
+        )
+    )
+)
+hotspot_table = compute_hotspots(
+    hotspot_shape, hotspot_size, hotspot_band, hotspot_types
 )
 
-wcss_chart = (wcss_line + wcss_points).properties(height=360)
 
+def build_hotspot_map_html() -> str:
+    hotspot_map = folium.Map(
+        location=center,
+        zoom_start=12.5,
+        tiles=None if maptiler_key else tile_layer,
+        prefer_canvas=True,
+    )
+    if maptiler_key:
+        folium.TileLayer(
+            tiles=tile_layer,
+            attr="&copy; MapTiler &copy; OpenStreetMap contributors",
+            name="MapTiler Streets",
+        ).add_to(hotspot_map)
+    CellChoroplethLayer(
+        hotspots_feature_collection(
+            grid_index, hotspot_shape, hotspot_size, hotspot_table
+        ),
+        breakdown_property="gi",
+        palette=HOTSPOT_PALETTE,
+        classes=hotspot_table["classe"].to_numpy(),
+        class_labels=HOTSPOT_LABELS,
+        name="Hotspots (Gi*)",
+        legend_title="Gi* por célula",
+    ).add_to(hotspot_map)
+    folium.LayerControl(collapsed=False).add_to(hotspot_map)
+    return hotspot_map._repr_html_()
+
+
+hotspot_map_key = map_cache_key(
+    "machine_learning_hotspots",
+    version,
+    hotspot_shape,
+    hotspot_size,
+    hotspot_band,
+    hotspot_types,
+    tile_layer,
+)
+components.html(
+    cached_map_html(hotspot_map_key, build_hotspot_map_html),
+    height=520,
+    scrolling=False,
+)
+hotspot_summary = (
+    hotspot_table["rotulo"].value_counts().reindex(HOTSPOT_LABELS, fill_value=0)
+)
+st.caption(
+    f"{len(hotspot_table):,} células analisadas; "
+    f"{int(hotspot_summary.filter(like='Hotspot').sum()):,} hotspots e "
+    f"{int(hotspot_summary.filter(like='Coldspot').sum()):,} coldspots significativos a 90% ou mais."
+)
+
+st.markdown("### Episódios espaço-temporais (ST-DBSCAN)")
 st.markdown(
-    "O gráfico do método do cotovelo ajuda a encontrar um número adequado de clusters: "
-    "procure pelo ponto onde a queda de WCSS começa a se estabilizar."
+    "O ST-DBSCAN agrupa denúncias próximas no espaço **e** no tempo: cada episódio reúne "
+    "denúncias a até o raio escolhido umas das outras, com intervalos de até a janela de "
+    "dias. Episódios no mesmo local em períodos diferentes aparecem juntos na tabela, "
+    "o que destaca endereços com problemas recorrentes."
+)
+col_radius, col_window, col_min = st.columns(3)
+episode_radius = col_radius.slider("Raio espacial (m)", 25, 500, DEFAULT_RADIUS_M, 25)
+episode_window = col_window.slider(
+    "Janela de tempo (dias)", 1, 60, DEFAULT_WINDOW_DAYS, 1
+)
+episode_min_samples = col_min.slider(
+    "Mínimo de denúncias por episódio", 3, 30, DEFAULT_MIN_SAMPLES, 1
+)
+episodes = compute_episodes(episode_radius, episode_window, episode_min_samples)
+recurring = episodes[episodes["episodios_no_local"] > 1]
+
+col_episodes, col_recurring = st.columns(2)
+col_episodes.metric("Episódios encontrados", f"{len(episodes):,}")
+col_recurring.metric(
+    "Locais com episódios recorrentes", f"{recurring['local'].nunique():,}"
+)
+
+only_recurring = st.checkbox(
+    "Mostrar apenas locais com episódios recorrentes", value=True
+)
+episodes_display = (recurring if only_recurring else episodes).rename(
+    columns={
+        "local": "Local",
+        "episodios_no_local": "Episódios no local",
+        "denuncias": "Denúncias",
+        "inicio": "Início",
+        "fim": "Fim",
+        "duracao_dias": "Duração (dias)",
+        "endereco": "Endereço mais frequente",
+        "tipo_predominante": "Tipo de fonte predominante",
+    }
+)
+st.dataframe(
+    episodes_display.drop(columns=["episodio", "latitude", "longitude"]),
+    hide_index=True,
+    use_container_width=True,
+    column_config={
+        "Início": st.column_config.DatetimeColumn(format="DD/MM/YYYY HH:mm"),
+        "Fim": st.column_config.DatetimeColumn(format="DD/MM/YYYY HH:mm"),
+    },
 )
-st.altair_chart(wcss_chart.interactive(), use_container_width=True)
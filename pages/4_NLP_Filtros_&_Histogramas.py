@@ -7,9 +7,36 @@ from collections import Counter
 
 import pandas as pd
 import streamlit as st
+import streamlit.components.v1 as components
 import leafmap.foliumap as leafmap
 import altair as alt
 
+from charts import MAX_PARETO_CATEGORIES, pareto_chart, pareto_table
+from dedup import DEFAULT_RADIUS_M, DEFAULT_WINDOW_HOURS, flag_duplicates
+from grid import (
+    GRID_RESOLUTIONS,
+    GRID_SHAPES,
+    GridIndex,
+    build_grid_index,
+    cells_feature_collection,
+)
+from map_cache import cached_map_html, map_cache_key
+from map_layers import (
+    CellChoroplethLayer,
+    LodPointLayer,
+    popup_labels,
+    register_popup_source,
+)
+from rollups import (
+    RESOLUTION_LABELS,
+    build_rollups,
+    pick_resolution,
+    resolutions_from,
+    slice_rollup,
+)
+from snapshot import cache_by_fingerprint, data_version, derive, fingerprint, stamp
+from vector_tiles import VectorTileLayer, register_tile_source
+
 st.set_page_config(page_title="Mapa Interativo de Denúncias", layout="wide")
 
 alt.data_transformers.disable_max_rows()
@@ -109,74 +136,35 @@ def apply_custom_rules(data: pd.DataFrame, rules: list[dict]) -> pd.DataFrame:
     return result
 
 
-def build_pareto_dataframe(data: pd.DataFrame, column: str) -> pd.DataFrame:
-    if data.empty or column not in data.columns:
-        return pd.DataFrame()
-    freq = (
-        data[column]
-        .fillna("Não informado")
-        .astype(str)
-        .value_counts()
-        .reset_index()
-        .rename(columns={"index": column, column: "Denúncias"})
-    )
-    freq["Denúncias"] = pd.to_numeric(freq["Denúncias"], errors="coerce").fillna(0)
-    total = freq["Denúncias"].sum()
-    if total == 0:
-        return pd.DataFrame()
-    freq["% Frequência"] = freq["Denúncias"] / total * 100
-    freq["% Acumulado"] = freq["% Frequência"].cumsum()
-    return freq
-
-
 def render_pareto_chart(data: pd.DataFrame, column: str, title: str) -> None:
-    freq = build_pareto_dataframe(data, column)
+    if data.empty or column not in data.columns:
+        freq = pd.DataFrame()
+    else:
+        freq = pareto_table(data[column])
     if freq.empty:
         st.info(f"Sem dados suficientes para {title}.")
         return
 
-    freq["categoria"] = freq[column].astype(str)
-    order = freq["categoria"].tolist()
-
-    bars = (
-        alt.Chart(freq)
-        .mark_bar(color="#10B981")
-        .encode(
-            x=alt.X("categoria:N", sort=order, title=column),
-            y=alt.Y("Denúncias:Q"),
-            tooltip=[
-                alt.Tooltip("categoria:N", title=column),
-                alt.Tooltip("Denúncias:Q"),
-                alt.Tooltip("% Frequência:Q", format=".1f"),
-                alt.Tooltip("% Acumulado:Q", format=".1f"),
-            ],
-        )
-    )
-
-    line = (
-        alt.Chart(freq)
-        .mark_line(color="#EF4444")
-        .encode(
-            x=alt.X("categoria:N", sort=order),
-            y=alt.Y("% Acumulado:Q"),
-        )
-    )
-
-    points = (
-        alt.Chart(freq)
-        .mark_point(color="#EF4444")
-        .encode(
-            x=alt.X("categoria:N", sort=order),
-            y=alt.Y("% Acumulado:Q"),
-        )
-    )
-
-    chart = alt.layer(bars, line, points).resolve_scale(y="independent").properties(
-        width="container", height=380
+    chart = pareto_chart(
+        freq,
+        category_title=column,
+        bar_color="#10B981",
+        line_color="#EF4444",
     )
     st.subheader(title)
     st.altair_chart(chart, width="stretch")
-    st.dataframe(freq, use_container_width=True, hide_index=True)
+    st.dataframe(
+        freq.rename(
+            columns={
+                "categoria": column,
+                "contagem": "Denúncias",
+                "percentual": "% Frequência",
+                "percentual_acumulado": "% Acumulado",
+            }
+        ),
+        use_container_width=True,
+        hide_index=True,
+    )
 
 
 @st.cache_data(show_spinner=False)
@@ -210,9 +198,11 @@ def load_data() -> pd.DataFrame:
     if "fonte_horario" not in df.columns:
         df["fonte_horario"] = [[] for _ in range(len(df))]
     df["fonte_horario"] = df["fonte_horario"].apply(
-        lambda value: value
-        if isinstance(value, list)
-        else ([] if not value or pd.isna(value) else [str(value)])
+        lambda value: (
+            value
+            if isinstance(value, list)
+            else ([] if not value or pd.isna(value) else [str(value)])
+        )
     )
 
     if "endereco_formatado" not in df.columns:
@@ -278,8 +268,83 @@ def load_data() -> pd.DataFrame:
     df["hora_label"] = df["hora"].apply(
         lambda h: f"{int(h):02d}h" if pd.notna(h) else None
     )
-    return df
+    return stamp(flag_duplicates(df), data_version(), "filtros_nlp")
+
+
+@cache_by_fingerprint(show_spinner=False)
+def category_frequencies(data: pd.DataFrame, column: str) -> pd.DataFrame:
+    values = data[column].fillna("Não informado")
+    return (
+        values.groupby(values, dropna=False)
+        .size()
+        .reset_index(name="contagem")
+        .sort_values("contagem", ascending=False)
+        .reset_index(drop=True)
+    )
+
+
+@st.cache_data(show_spinner=False)
+def load_rollups() -> dict[str, pd.DataFrame]:
+    return build_rollups(load_data())
+
+
+@st.cache_resource(show_spinner=False)
+def load_grid_index() -> GridIndex:
+    return build_grid_index(load_data())
+
+
+def build_map_html(
+    data: pd.DataFrame,
+    basemap: str,
+    light_render: bool,
+    popup_fields: list[str],
+    popup_url: str | None,
+    tile_source: tuple[str, list[str]] | None = None,
+    cells: dict | None = None,
+) -> str:
+    m = leafmap.Map(
+        center=(
+            [data["latitude"].mean(), data["longitude"].mean()]
+            if not data.empty
+            else [-23.415367, -51.931343]
+        ),
+        zoom=12.5,
+        locate_control=True,
+        latlon_control=True,
+        draw_export=True,
+        minimap_control=True,
+    )
+    m.add_basemap(basemap)
 
+    if not data.empty:
+        if cells:
+            CellChoroplethLayer(cells, name="Denúncias por célula").add_to(m)
+        if tile_source:
+            tile_url, categories = tile_source
+            VectorTileLayer(tile_url, categories, popup_url=popup_url).add_to(m)
+        elif not cells:
+            # sem tiles nem grade, os pontos vão junto com a página
+            if light_render and popup_url:
+                LodPointLayer(data, popup_url=popup_url, name="Denúncias").add_to(m)
+            elif light_render:
+                LodPointLayer(
+                    data,
+                    popups=popup_labels(
+                        data, [col for col in popup_fields if col != "Descrição"]
+                    ),
+                    name="Denúncias",
+                ).add_to(m)
+            else:
+                m.add_points_from_xy(
+                    data=data,
+                    x="longitude",
+                    y="latitude",
+                    popup=popup_fields or None,
+                    layer_name="Denúncias",
+                )
+
+    m.add_layer_control()
+    return m.to_html()
 
 
 df = load_data()
@@ -294,21 +359,17 @@ for tokens in df["descricao_tokens"]:
 token_choices = [token for token, _ in token_counter.most_common(300)]
 
 type_options = sorted(
-    {label for label in df.get("Tipo de Fonte", pd.Series(dtype="object")).unique() if label}
-)
-context_options = sorted(
     {
-        ctx
-        for ctx in df.get("fonte_contexto", pd.Series(dtype="object")).unique()
-        if ctx
+        label
+        for label in df.get("Tipo de Fonte", pd.Series(dtype="object")).unique()
+        if label
     }
 )
+context_options = sorted(
+    {ctx for ctx in df.get("fonte_contexto", pd.Series(dtype="object")).unique() if ctx}
+)
 audio_options = sorted(
-    {
-        aud
-        for aud in df.get("fonte_audio", pd.Series(dtype="object")).unique()
-        if aud
-    }
+    {aud for aud in df.get("fonte_audio", pd.Series(dtype="object")).unique() if aud}
 )
 time_options = sorted(
     {
@@ -346,8 +407,17 @@ if isinstance(date_range, (tuple, list)):
 else:
     start_date = end_date = date_range if date_range else min_date
 
+unique_incidents = st.sidebar.checkbox(
+    "Contar incidentes únicos",
+    value=False,
+    help=f"Agrupa as denúncias repetidas de um mesmo incidente (a até {DEFAULT_RADIUS_M} m "
+    f"e {DEFAULT_WINDOW_HOURS} h umas das outras) e conta cada incidente uma vez, "
+    "pela primeira denúncia.",
+)
 night_mode = st.sidebar.checkbox(
-    "Período noturno (20h às 8h)", value=False, help="Seleciona automaticamente o período entre 20:00 e 08:00."
+    "Período noturno (20h às 8h)",
+    value=False,
+    help="Seleciona automaticamente o período entre 20:00 e 08:00.",
 )
 if night_mode:
     hour_range = None  # indicador de período especial
@@ -435,10 +505,7 @@ else:
 
 
 filtered = df.copy()
-filtered = filtered[
-    (filtered["data"] >= start_date)
-    & (filtered["data"] <= end_date)
-]
+filtered = filtered[(filtered["data"] >= start_date) & (filtered["data"] <= end_date)]
 
 if search_address:
     filtered = filtered[
@@ -467,23 +534,17 @@ if search_bairro:
 
 if selected_types:
     filtered = filtered[
-        filtered.get("Tipo de Fonte", "")
-        .astype(str)
-        .isin(selected_types)
+        filtered.get("Tipo de Fonte", "").astype(str).isin(selected_types)
     ]
 
 if selected_contexts:
     filtered = filtered[
-        filtered.get("fonte_contexto", "")
-        .astype(str)
-        .isin(selected_contexts)
+        filtered.get("fonte_contexto", "").astype(str).isin(selected_contexts)
     ]
 
 if selected_audios:
     filtered = filtered[
-        filtered.get("fonte_audio", "")
-        .astype(str)
-        .isin(selected_audios)
+        filtered.get("fonte_audio", "").astype(str).isin(selected_audios)
     ]
 
 if selected_times:
@@ -519,7 +580,30 @@ elif hour_range is not None:
     mask = (filtered["hora"] >= start_hour) & (filtered["hora"] <= end_hour)
     filtered = filtered[mask]
 
+reports_filtered = len(filtered)
+if unique_incidents:
+    filtered = filtered.sort_values("DataInclusao").drop_duplicates("incidente")
+
 filtered = filtered.sort_values("DataInclusao", ascending=False)
+filtered = derive(
+    filtered,
+    df,
+    start_date,
+    end_date,
+    search_address,
+    pattern,
+    search_bairro,
+    selected_types,
+    selected_contexts,
+    selected_audios,
+    selected_times,
+    selected_tokens,
+    custom_rules,
+    selected_custom_rules,
+    night_mode,
+    hour_range,
+    unique_incidents,
+)
 
 st.title("Mapa Interativo de Denúncias de Poluição Sonora em Maringá")
 st.caption(
@@ -537,9 +621,17 @@ total_filtrado = len(filtered)
 periodo_label = f"{start_date:%d/%m/%Y} - {end_date:%d/%m/%Y}"
 
 metric_col1, metric_col2, metric_col3 = st.columns(3)
-metric_col1.metric("Denúncias filtradas", f"{total_filtrado:,}")
+metric_col1.metric(
+    "Incidentes filtrados" if unique_incidents else "Denúncias filtradas",
+    f"{total_filtrado:,}",
+)
 metric_col2.metric("Denúncias totais", f"{total_denuncias:,}")
 metric_col3.metric("Período selecionado", periodo_label)
+if unique_incidents:
+    st.caption(
+        f"{reports_filtered - total_filtrado:,} denúncias repetidas foram agrupadas nos "
+        "incidentes; a tendência temporal continua contando todas as denúncias."
+    )
 
 dimension_col = chart_dimension
 chart_df = pd.DataFrame()
@@ -547,15 +639,7 @@ chart_ready = False
 categories_display: list[str] = []
 
 if not filtered.empty and dimension_col in filtered.columns:
-    work_df = filtered.copy()
-    work_df[dimension_col] = work_df[dimension_col].fillna("Não informado")
-    freq = (
-        work_df.groupby(dimension_col, dropna=False)
-        .size()
-        .reset_index(name="contagem")
-        .sort_values("contagem", ascending=False)
-        .reset_index(drop=True)
-    )
+    freq = category_frequencies(filtered, dimension_col)
     total_freq = freq["contagem"].sum()
     if total_freq > 0:
         freq["percentual"] = freq["contagem"] / total_freq
@@ -591,8 +675,12 @@ else:
 map_data = filtered.copy()
 if chart_ready and restrict_map and categories_display:
     map_data = map_data[
-        map_data[dimension_col].fillna("Não informado").astype(str).isin(categories_display)
+        map_data[dimension_col]
+        .fillna("Não informado")
+        .astype(str)
+        .isin(categories_display)
     ]
+    map_data = derive(map_data, filtered, dimension_col, categories_display)
 
 map_col = st.container()
 
@@ -601,52 +689,106 @@ with map_col:
     default_basemap = "OpenTopoMap"
     index = options.index(default_basemap) if default_basemap in options else 0
     basemap = st.selectbox("Mapa base", options, index, key="map_basemap")
+    vector_tiles = st.checkbox(
+        "Tiles vetoriais (carrega só a área visível)",
+        value=False,
+        help="O mapa pede ao servidor local apenas os tiles da área visível: "
+        "contagens por Tipo de Fonte nos zooms baixos e denúncias individuais "
+        "a partir do zoom 15.",
+    )
+    light_render = st.checkbox(
+        "Renderização leve (canvas com agregação por zoom)",
+        value=True,
+        disabled=vector_tiles,
+        help="Envia as coordenadas num único vetor e agrupa os pontos em células "
+        "nos zooms baixos. Marcadores individuais aparecem a partir do zoom 15.",
+    )
+    lazy_popups = st.checkbox(
+        "Popups sob demanda",
+        value=False,
+        disabled=not (light_render or vector_tiles),
+        help="Os marcadores levam apenas o número da linha; protocolo, descrição e "
+        "demais campos são buscados no servidor local quando o marcador é clicado. "
+        "Exige que o navegador alcance esse servidor (em deploy remoto ou atrás de "
+        "proxy, defina DENUNCIAS_SERVER_URL).",
+    )
 
-    m = leafmap.Map(
-        center=[map_data["latitude"].mean(), map_data["longitude"].mean()]
-        if not map_data.empty
-        else [-23.415367, -51.931343],
-        zoom=12.5,
-        locate_control=True,
-        latlon_control=True,
-        draw_export=True,
-        minimap_control=True,
+    cell_map = st.checkbox(
+        "Coroplético por célula",
+        value=False,
+        help="Agrega as denúncias filtradas numa grade e colore cada célula pela "
+        "contagem; o popup traz a quebra por Tipo de Fonte. Substitui os pontos "
+        "no mapa (os tiles vetoriais continuam disponíveis).",
     )
-    m.add_basemap(basemap)
+    grid_shape, grid_size = "hexagonal", GRID_RESOLUTIONS[1]
+    if cell_map:
+        shape_col, size_col = st.columns(2)
+        grid_shape = shape_col.selectbox(
+            "Forma da célula", list(GRID_SHAPES), format_func=GRID_SHAPES.get
+        )
+        grid_size = size_col.selectbox(
+            "Tamanho da célula",
+            GRID_RESOLUTIONS,
+            index=1,
+            format_func=lambda size: (
+                f"{size} m" if size < 1000 else f"{size // 1000} km"
+            ),
+        )
 
+    popup_fields = [
+        "Protocolo",
+        "DataInclusao",
+        "Descrição",
+        "endereco_formatado",
+        "Tipo de Fonte",
+        "fonte_contexto",
+        "fonte_audio",
+        "bairro_formatado",
+        "custom_rules_label",
+    ]
+    available_fields = [col for col in popup_fields if col in map_data.columns]
+    popup_url = None
     if map_data.empty:
         st.info("Ajuste os filtros para visualizar as denúncias no mapa.")
-    else:
-        popup_fields = [
-            "Protocolo",
-            "DataInclusao",
-            "Descrição",
-            "endereco_formatado",
-            "Tipo de Fonte",
-            "fonte_contexto",
-            "fonte_audio",
-            "bairro_formatado",
-            "custom_rules_label",
-        ]
-        available_fields = [col for col in popup_fields if col in map_data.columns]
-        if available_fields:
-            m.add_points_from_xy(
-                data=map_data,
-                x="longitude",
-                y="latitude",
-                popup=available_fields,
-                layer_name="Denúncias",
-            )
-        else:
-            m.add_points_from_xy(
-                data=map_data,
-                x="longitude",
-                y="latitude",
-                popup=None,
-                layer_name="Denúncias",
-            )
+    elif (vector_tiles or light_render) and lazy_popups:
+        popup_url = register_popup_source(
+            map_data, available_fields, extra_key=repr(custom_rules)
+        )
 
-    m.to_streamlit(height=720)
+    tile_source = None
+    if vector_tiles and not map_data.empty:
+        tile_source = register_tile_source(map_data)
+    cells = None
+    if cell_map and not map_data.empty:
+        grid_index = load_grid_index()
+        cells = cells_feature_collection(
+            grid_index, grid_shape, grid_size, grid_index.positions(map_data)
+        )
+
+    map_key = map_cache_key(
+        "filtros_nlp",
+        fingerprint(map_data),
+        basemap,
+        light_render,
+        popup_url,
+        tile_source,
+        (grid_shape, grid_size) if cell_map else None,
+        available_fields,
+        repr(custom_rules),
+    )
+    map_html = cached_map_html(
+        map_key,
+        lambda: build_map_html(
+            map_data,
+            basemap,
+            light_render,
+            available_fields,
+            popup_url,
+            tile_source,
+            cells,
+        ),
+    )
+    components.html(map_html, height=720)
 
 st.subheader("Detalhes das denúncias exibidas no mapa")
 if map_data.empty:
@@ -658,6 +800,7 @@ else:
         "Descrição",
         "endereco_formatado",
         "bairro_formatado",
+        "denuncias_no_incidente",
         "Tipo de Fonte",
         "fonte_contexto",
         "fonte_audio",
@@ -684,74 +827,17 @@ else:
     chart_render = chart_df.copy()
     chart_render["categoria"] = chart_render[dimension_col].astype(str)
 
-    x_order = chart_render["categoria"].tolist()
-
-    bars = (
-        alt.Chart(chart_render)
-        .mark_bar(color="#3B82F6")
-        .encode(
-            x=alt.X("categoria:N", sort=x_order, title=dimension_col),
-            y=alt.Y("contagem:Q", title="Denúncias"),
-            tooltip=[
-                alt.Tooltip("categoria:N", title=dimension_col),
-                alt.Tooltip("contagem:Q", title="Quantidade"),
-                alt.Tooltip("percentual:Q", title="% Frequência", format=".1f"),
-                alt.Tooltip(
-                    "percentual_acumulado:Q",
-                    title="% Acumulado",
-                    format=".1f",
-                ),
-            ],
-        )
-    )
-
-    line = (
-        alt.Chart(chart_render)
-        .mark_line(color="#F97316")
-        .encode(
-            x=alt.X("categoria:N", sort=x_order, title=dimension_col),
-            y=alt.Y(
-                "percentual_acumulado:Q",
-                axis=alt.Axis(title="% acumulado (%)", format=".1f"),
-            ),
-            tooltip=[
-                alt.Tooltip("categoria:N", title=dimension_col),
-                alt.Tooltip(
-                    "percentual_acumulado:Q",
-                    title="% Acumulado",
-                    format=".1f",
-                ),
-            ],
-        )
-    )
-
-    points = (
-        alt.Chart(chart_render)
-        .mark_point(color="#F97316", size=60)
-        .encode(
-            x=alt.X("categoria:N", sort=x_order, title=dimension_col),
-            y=alt.Y("percentual_acumulado:Q"),
-            tooltip=[
-                alt.Tooltip("categoria:N", title=dimension_col),
-                alt.Tooltip(
-                    "percentual_acumulado:Q",
-                    title="% Acumulado",
-                    format=".1f",
-                ),
-            ],
-        )
-    )
-
-    histogram = (
-        alt.layer(bars, line, points)
-        .resolve_scale(y="independent")
-        .properties(height=380)
-    )
+    histogram = pareto_chart(chart_render, category_title=dimension_col)
 
     st.altair_chart(histogram, width="stretch")
     st.caption(
         "O gráfico combina a frequência absoluta (barras) com o percentual acumulado (linha) para análise de Pareto."
     )
+    if len(chart_render) > MAX_PARETO_CATEGORIES:
+        st.caption(
+            f"Exibindo as {MAX_PARETO_CATEGORIES - 1} maiores categorias no gráfico; "
+            'as demais foram somadas em "Outros" (a tabela traz todas).'
+        )
 
     resumo_cols = [
         dimension_col,
@@ -773,6 +859,74 @@ else:
     with st.expander("Tabela do Pareto (frequência e acumulado)", expanded=False):
         st.dataframe(resumo, width="stretch", hide_index=True)
 
+st.markdown("### Tendência temporal")
+
+rollups = load_rollups()
+auto_resolution = pick_resolution(start_date, end_date)
+trend_resolution = st.selectbox(
+    "Resolução da série",
+    options=["auto", *resolutions_from(auto_resolution)],
+    format_func=lambda r: (
+        f"Automática ({RESOLUTION_LABELS[auto_resolution]})"
+        if r == "auto"
+        else RESOLUTION_LABELS[r]
+    ),
+    key="trend_resolution",
+)
+if trend_resolution == "auto":
+    trend_resolution = auto_resolution
+trend_by = st.radio(
+    "Detalhar tendência por",
+    options=["Total", "Tipo de Fonte"],
+    horizontal=True,
+    key="trend_by",
+)
+
+trend_bairros = None
+if search_bairro:
+    bairro_categories = pd.Series(
+        rollups[trend_resolution]["bairro_formatado"].cat.categories
+    )
+    trend_bairros = bairro_categories[
+        bairro_categories.str.contains(search_bairro, case=False, na=False)
+    ].tolist()
+
+trend = slice_rollup(
+    rollups,
+    trend_resolution,
+    start_date,
+    end_date,
+    bairros=trend_bairros,
+    tipos=selected_types or None,
+    by=None if trend_by == "Total" else "Tipo de Fonte",
+)
+
+if trend.empty or trend["contagem"].sum() == 0:
+    st.info("Sem denúncias no período para montar a série temporal.")
+else:
+    trend_encoding = {
+        "x": alt.X("periodo:T", title=RESOLUTION_LABELS[trend_resolution]),
+        "y": alt.Y("contagem:Q", title="Denúncias"),
+        "tooltip": [
+            alt.Tooltip("periodo:T", title="Período"),
+            alt.Tooltip("contagem:Q", title="Denúncias", format=",.0f"),
+        ],
+    }
+    if trend_by != "Total":
+        trend_encoding["color"] = alt.Color("Tipo de Fonte:N", title="Tipo de Fonte")
+        trend_encoding["tooltip"].append(alt.Tooltip("Tipo de Fonte:N"))
+    trend_chart = (
+        alt.Chart(trend)
+        .mark_line(point=trend_resolution != "hora")
+        .encode(**trend_encoding)
+        .properties(height=320)
+    )
+    st.altair_chart(trend_chart, width="stretch")
+    st.caption(
+        "Série montada a partir de agregações pré-calculadas; considera apenas o período, "
+        "os tipos de fonte e a busca por bairro selecionados."
+    )
+
 st.markdown("## Classificações NLP")
 render_pareto_chart(filtered, "Tipo de Fonte", "Pareto - Tipo de Fonte")
 render_pareto_chart(filtered, "fonte_contexto", "Pareto - Contexto (fonte_contexto)")
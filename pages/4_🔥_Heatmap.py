@@ -3,8 +3,14 @@ import json
 
 import pandas as pd
 import streamlit as st
+import streamlit.components.v1 as components
 import leafmap.foliumap as leafmap
 
+from density import DEFAULT_RADIUS, HeatRasterLayer, register_heat_source
+from map_cache import cached_map_html, map_cache_key
+from snapshot import data_version, stamp
+from vector_tiles import VectorTileLayer, register_tile_source
+
 st.set_page_config(layout="wide")
 
 markdown = """
@@ -19,44 +25,88 @@ st.sidebar.image(logo)
 st.title("Heatmap das denúncias em Maringá")
 
 data_path = Path(__file__).resolve().parent.parent / "mga_denuncias_20-23.geojson"
-with open(data_path, encoding="utf-8") as f:
-    geojson = json.load(f)
-
-records = []
-for feature in geojson.get("features", []):
-    props = feature.get("properties", {}) or {}
-    geom = feature.get("geometry", {}) or {}
-    coords = geom.get("coordinates", [])
-    if len(coords) < 2:
-        continue
-    record = props.copy()
-    record["longitude"] = coords[0]
-    record["latitude"] = coords[1]
-    records.append(record)
-
-df = pd.DataFrame(records)
-df["DataInclusao"] = pd.to_datetime(
-    df.get("DataInclusao_BR", df.get("DataInclusao")),
-    format="%H:%M:%S %d-%m-%Y",
-    errors="coerce",
-    dayfirst=True,
-)
-df = df.dropna(subset=["latitude", "longitude"]).copy()
+
+
+@st.cache_data(show_spinner=False)
+def load_data(version: str) -> pd.DataFrame:
+    """Denúncias com coordenadas, lidas e marcadas uma vez por versão dos dados."""
+    with open(data_path, encoding="utf-8") as f:
+        geojson = json.load(f)
+
+    records = []
+    for feature in geojson.get("features", []):
+        props = feature.get("properties", {}) or {}
+        geom = feature.get("geometry", {}) or {}
+        coords = geom.get("coordinates", [])
+        if len(coords) < 2:
+            continue
+        record = props.copy()
+        record["longitude"] = coords[0]
+        record["latitude"] = coords[1]
+        records.append(record)
+
+    df = pd.DataFrame(records)
+    if df.empty:
+        return df
+    df["DataInclusao"] = pd.to_datetime(
+        df.get("DataInclusao_BR", df.get("DataInclusao")),
+        format="%H:%M:%S %d-%m-%Y",
+        errors="coerce",
+        dayfirst=True,
+    )
+    return stamp(df.dropna(subset=["latitude", "longitude"]).copy(), version, "heatmap")
+
+
+df = load_data(data_version())
 if df.empty:
     st.warning("Nenhuma denúncia encontrada.")
     st.stop()
-df["value"] = 1
-
-center_lat = df["latitude"].astype(float).mean()
-center_lon = df["longitude"].astype(float).mean()
-m = leafmap.Map(center=[center_lat, center_lon], zoom=12, tiles="OpenStreetMap")
-
-m.add_heatmap(
-    data=df,
-    latitude="latitude",
-    longitude="longitude",
-    value="value",
-    name="Mapa de calor",
-    radius=20,
+
+
+def build_heatmap_html(
+    data: pd.DataFrame,
+    heat_url: str,
+    tile_source: tuple[str, list[str]] | None = None,
+) -> str:
+    center_lat = data["latitude"].astype(float).mean()
+    center_lon = data["longitude"].astype(float).mean()
+    m = leafmap.Map(center=[center_lat, center_lon], zoom=12, tiles="OpenStreetMap")
+
+    HeatRasterLayer(
+        heat_url,
+        bounds=[
+            [float(data["latitude"].min()), float(data["longitude"].min())],
+            [float(data["latitude"].max()), float(data["longitude"].max())],
+        ],
+        name="Mapa de calor",
+    ).add_to(m)
+    if tile_source:
+        VectorTileLayer(*tile_source, name="Denúncias (tiles vetoriais)").add_to(m)
+    m.add_layer_control()
+    return m.to_html()
+
+
+radius = st.slider(
+    "Raio do mapa de calor (px)",
+    min_value=5,
+    max_value=60,
+    value=DEFAULT_RADIUS,
+    step=1,
+    help="Largura de banda do núcleo gaussiano, em pixels de tela. A densidade é "
+    "calculada no servidor e enviada como imagem, uma por nível de zoom.",
+)
+show_points = st.checkbox(
+    "Sobrepor as denúncias em tiles vetoriais",
+    value=False,
+    help="Os pontos são pedidos ao servidor local por tile, apenas na área "
+    "visível: contagens por Tipo de Fonte nos zooms baixos e denúncias "
+    "individuais a partir do zoom 15.",
+)
+heat_url = register_heat_source(df, radius=radius)
+tile_source = register_tile_source(df) if show_points else None
+
+map_key = map_cache_key("heatmap", data_version(), heat_url, tile_source)
+components.html(
+    cached_map_html(map_key, lambda: build_heatmap_html(df, heat_url, tile_source)),
+    height=700,
 )
-m.to_streamlit(height=700)
@@ -0,0 +1,141 @@
+"""
+Relatório do tamanho dos mapas de denúncias conforme o envio das coordenadas.
+
+Compara, para o arquivo de denúncias atual:
+
+- os mapas exportados versionados no repositório (`icc.html`, `kuc.html`,
+  `xft.html`), quando presentes;
+- um marcador `folium.Marker` com popup por denúncia, como nas exportações antigas;
+- a camada canvas (`LodPointLayer`) com coordenadas em JSON (6 casas);
+- a camada canvas com coordenadas quantizadas e codificadas em diferenças.
+
+Uso: `python payload_report.py [--precisao METROS] [--sem-marcadores]`
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import re
+from pathlib import Path
+
+import folium
+import numpy as np
+import pandas as pd
+
+from map_layers import DEFAULT_COORD_PRECISION_M, METERS_PER_DEGREE, LodPointLayer
+from snapshot import DATA_PATH
+
+EXPORTED_MAPS = ("icc.html", "kuc.html", "xft.html")
+POPUP_FIELDS = ["Protocolo", "DataInclusao", "Descrição"]
+
+
+def load_points(path: Path = DATA_PATH) -> pd.DataFrame:
+    with path.open(encoding="utf-8") as f:
+        geojson = json.load(f)
+    records = []
+    for feature in geojson.get("features", []):
+        coords = (feature.get("geometry") or {}).get("coordinates", [])
+        if len(coords) >= 2:
+            record = dict(feature.get("properties") or {})
+            record["longitude"], record["latitude"] = coords[0], coords[1]
+            records.append(record)
+    df = pd.DataFrame(records)
+    df["latitude"] = pd.to_numeric(df["latitude"], errors="coerce")
+    df["longitude"] = pd.to_numeric(df["longitude"], errors="coerce")
+    return df.dropna(subset=["latitude", "longitude"]).reset_index(drop=True)
+
+
+def _sizes(mode: str, html: str, coords_bytes: int | None = None) -> dict:
+    raw = html.encode("utf-8")
+    return {
+        "modo": mode,
+        "bytes": len(raw),
+        "bytes_gzip": len(gzip.compress(raw)),
+        "bytes_coordenadas": coords_bytes,
+    }
+
+
+def _marker_coords_bytes(html: str) -> int:
+    # as coordenadas aparecem como "[lat, lon]" em cada L.marker
+    return sum(len(match) for match in re.findall(r"L\.marker\(\s*\[[^\]]*\]", html))
+
+
+def _canvas_map(data: pd.DataFrame, coord_precision: float | None) -> tuple[str, int]:
+    m = folium.Map(location=[data["latitude"].mean(), data["longitude"].mean()])
+    layer = LodPointLayer(data, coord_precision=coord_precision, name="Denúncias")
+    layer.add_to(m)
+    html = m.get_root().render()
+    return html, len(layer.inline_data["coords"].encode("utf-8"))
+
+
+def _marker_map(data: pd.DataFrame) -> str:
+    m = folium.Map(location=[data["latitude"].mean(), data["longitude"].mean()])
+    fields = [field for field in POPUP_FIELDS if field in data.columns]
+    for row in data[["latitude", "longitude", *fields]].itertuples(index=False):
+        popup = "<br>".join(f"<b>{f}</b>: {v}" for f, v in zip(fields, row[2:]))
+        folium.Marker([row[0], row[1]], popup=popup).add_to(m)
+    return m.get_root().render()
+
+
+def quantisation_error_m(data: pd.DataFrame, precision_m: float) -> float:
+    """Maior deslocamento (m) introduzido pela quantização das coordenadas."""
+    step = precision_m / METERS_PER_DEGREE
+    latlon = data[["latitude", "longitude"]].to_numpy(dtype=float)
+    error = np.abs(np.rint(latlon / step) * step - latlon) * METERS_PER_DEGREE
+    error[:, 1] *= np.cos(np.radians(latlon[:, 0]))
+    return float(np.hypot(error[:, 0], error[:, 1]).max()) if len(latlon) else 0.0
+
+
+def build_report(
+    data: pd.DataFrame,
+    precision_m: float = DEFAULT_COORD_PRECISION_M,
+    include_markers: bool = True,
+    root: Path = Path(__file__).resolve().parent,
+) -> pd.DataFrame:
+    rows = []
+    for name in EXPORTED_MAPS:
+        path = root / name
+        if path.exists():
+            html = path.read_text(encoding="utf-8")
+            rows.append(_sizes(f"exportado: {name}", html, _marker_coords_bytes(html)))
+    if include_markers:
+        html = _marker_map(data)
+        rows.append(
+            _sizes("marcadores folium com popup", html, _marker_coords_bytes(html))
+        )
+    html, coords = _canvas_map(data, None)
+    rows.append(_sizes("canvas, coordenadas em JSON", html, coords))
+    html, coords = _canvas_map(data, precision_m)
+    rows.append(
+        _sizes(f"canvas, diferenças quantizadas ({precision_m:g} m)", html, coords)
+    )
+    report = pd.DataFrame(rows)
+    reference = report.loc[
+        report["modo"] == "canvas, coordenadas em JSON", "bytes_coordenadas"
+    ]
+    report["coordenadas_vs_json"] = (
+        report["bytes_coordenadas"] / reference.iloc[0]
+    ).round(3)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--precisao", type=float, default=DEFAULT_COORD_PRECISION_M)
+    parser.add_argument("--sem-marcadores", action="store_true")
+    args = parser.parse_args()
+
+    data = load_points()
+    report = build_report(data, args.precisao, include_markers=not args.sem_marcadores)
+    print(f"Denúncias: {len(data):,}")
+    print(
+        "Erro máximo da quantização: "
+        f"{quantisation_error_m(data, args.precisao):.2f} m"
+    )
+    print(report.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
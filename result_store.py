@@ -0,0 +1,117 @@
+"""
+Armazenamento em disco dos resultados de agrupamento (modelos, rótulos e tabelas).
+
+Os caches em memória (`st.cache_data`, `jobs`) se perdem a cada reinício do
+servidor ou novo worker, que então refaz os ajustes do zero. Aqui cada
+resultado é gravado com `joblib` em `<diretório>/<espaço>/<chave>.joblib`,
+com a chave derivada da versão dos dados e dos parâmetros
+(`result_key`), e qualquer processo que veja o mesmo diretório o reaproveita.
+
+O diretório é `DENUNCIAS_RESULT_DIR` (por padrão, `.cache/resultados` na raiz
+do projeto) e o total é limitado a `DENUNCIAS_RESULT_MAX_MB` (512 MB por
+padrão): a cada gravação, os arquivos lidos há mais tempo são removidos (LRU
+pela data de modificação, renovada a cada leitura). As gravações são
+atômicas (arquivo temporário + `os.replace`), de modo que processos
+concorrentes nunca leem um arquivo pela metade. Falhas de disco não
+interrompem a página: o resultado é apenas recalculado.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import joblib
+
+RESULT_DIR = Path(
+    os.getenv(
+        "DENUNCIAS_RESULT_DIR",
+        Path(__file__).resolve().parent / ".cache" / "resultados",
+    )
+)
+MAX_BYTES = int(float(os.getenv("DENUNCIAS_RESULT_MAX_MB", "512")) * 1024 * 1024)
+# incrementar quando o formato ou o cálculo dos resultados guardados mudar
+STORE_VERSION = 1
+SUFFIX = ".joblib"
+
+_MISSING = object()
+_lock = threading.Lock()
+
+
+def result_key(*parts: object) -> str:
+    """Chave estável a partir da versão dos dados e dos parâmetros do resultado."""
+    return hashlib.sha1(repr((STORE_VERSION, parts)).encode("utf-8")).hexdigest()
+
+
+def _path(namespace: str, key: str) -> Path:
+    return RESULT_DIR / namespace / f"{key}{SUFFIX}"
+
+
+def load_result(namespace: str, key: str, default: Any = None) -> Any:
+    """Resultado guardado em `namespace`/`key`, ou `default` se não houver."""
+    path = _path(namespace, key)
+    try:
+        value = joblib.load(path)
+    except FileNotFoundError:
+        return default
+    except Exception:  # arquivo corrompido ou gravado por outra versão das bibliotecas
+        path.unlink(missing_ok=True)
+        return default
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return value
+
+
+def store_result(namespace: str, key: str, value: Any) -> None:
+    """Grava `value` e remove os resultados mais antigos além de `MAX_BYTES`."""
+    path = _path(namespace, key)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        os.close(fd)
+    except OSError:
+        return
+    try:
+        joblib.dump(value, tmp, compress=3)
+        os.replace(tmp, path)
+    except Exception:  # disco cheio, sem permissão ou valor que não serializa
+        Path(tmp).unlink(missing_ok=True)
+        return
+    try:
+        evict()
+    except OSError:
+        pass
+
+
+def evict(max_bytes: int = MAX_BYTES) -> None:
+    """Remove os arquivos usados há mais tempo até o total caber em `max_bytes`."""
+    with _lock:
+        files = []
+        for path in RESULT_DIR.glob(f"*/*{SUFFIX}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+def cached_result(namespace: str, key: str, compute: Callable[[], Any]) -> Any:
+    """Devolve o resultado guardado para `key` ou chama `compute` e o grava."""
+    value = load_result(namespace, key, _MISSING)
+    if value is _MISSING:
+        value = compute()
+        store_result(namespace, key, value)
+    return value
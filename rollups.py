@@ -0,0 +1,159 @@
+"""
+Agregações temporais pré-calculadas (rollups) das denúncias de poluição sonora.
+
+As contagens são consolidadas uma única vez por carga de dados nas resoluções
+hora, dia, semana ISO e mês, já quebradas por bairro e `Tipo de Fonte`. Os
+painéis de tendência apenas recortam essas tabelas (poucos milhares de linhas)
+em vez de reagrupar os registros brutos a cada interação com os filtros.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterable
+from datetime import date
+
+import pandas as pd
+
+TIME_COLUMN = "DataInclusao"
+ROLLUP_DIMENSIONS = ("bairro_formatado", "Tipo de Fonte")
+MISSING_LABEL = "Não informado"
+
+# resolução -> frequência do pandas usada para completar períodos vazios
+RESOLUTIONS = {
+    "hora": "h",
+    "dia": "D",
+    "semana": "W-MON",
+    "mes": "MS",
+}
+RESOLUTION_LABELS = {
+    "hora": "Hora",
+    "dia": "Dia",
+    "semana": "Semana (ISO)",
+    "mes": "Mês",
+}
+_RESOLUTION_HOURS = {
+    "hora": 1.0,
+    "dia": 24.0,
+    "semana": 24.0 * 7,
+    "mes": 24.0 * 30.44,
+}
+MAX_TREND_POINTS = 400
+
+
+def floor_period(timestamps: pd.Series, resolution: str) -> pd.Series:
+    """Trunca os instantes para o início do período na resolução indicada."""
+    if resolution == "hora":
+        return timestamps.dt.floor("h")
+    if resolution == "dia":
+        return timestamps.dt.floor("D")
+    if resolution == "semana":
+        # semana ISO: começa na segunda-feira
+        day = timestamps.dt.floor("D")
+        return day - pd.to_timedelta(day.dt.dayofweek, unit="D")
+    if resolution == "mes":
+        return timestamps.dt.to_period("M").dt.to_timestamp()
+    raise ValueError(f"Resolução desconhecida: {resolution}")
+
+
+def build_rollups(
+    data: pd.DataFrame,
+    time_col: str = TIME_COLUMN,
+    dimensions: Iterable[str] = ROLLUP_DIMENSIONS,
+) -> dict[str, pd.DataFrame]:
+    """Calcula as contagens por período, bairro e tipo de fonte em todas as resoluções."""
+    dimensions = list(dimensions)
+    columns = ["periodo", *dimensions, "contagem"]
+    if data.empty or time_col not in data.columns:
+        return {res: pd.DataFrame(columns=columns) for res in RESOLUTIONS}
+
+    base = pd.DataFrame({time_col: pd.to_datetime(data[time_col], errors="coerce")})
+    for dim in dimensions:
+        if dim in data.columns:
+            values = data[dim].fillna("").astype(str).str.strip()
+            base[dim] = values.replace("", MISSING_LABEL)
+        else:
+            base[dim] = MISSING_LABEL
+    base = base.dropna(subset=[time_col])
+
+    rollups: dict[str, pd.DataFrame] = {}
+    for resolution in RESOLUTIONS:
+        table = (
+            base.assign(periodo=floor_period(base[time_col], resolution))
+            .groupby(["periodo", *dimensions], observed=True)
+            .size()
+            .reset_index(name="contagem")
+            .sort_values("periodo", kind="stable")
+            .reset_index(drop=True)
+        )
+        for dim in dimensions:
+            table[dim] = table[dim].astype("category")
+        rollups[resolution] = table
+    return rollups
+
+
+def pick_resolution(
+    start: date | pd.Timestamp,
+    end: date | pd.Timestamp,
+    max_points: int = MAX_TREND_POINTS,
+) -> str:
+    """Escolhe a resolução mais fina que mantém a série com até `max_points` períodos."""
+    span = pd.Timestamp(end) - pd.Timestamp(start) + pd.Timedelta(days=1)
+    hours = span / pd.Timedelta(hours=1)
+    for resolution, period_hours in _RESOLUTION_HOURS.items():
+        if hours / period_hours <= max_points:
+            return resolution
+    return "mes"
+
+
+def resolutions_from(finest: str) -> list[str]:
+    """Resoluções de `finest` à mais grossa, as que cabem no limite de pontos da série.
+
+    Com `finest = pick_resolution(início, fim)`, nenhuma opção gera mais de
+    `MAX_TREND_POINTS` períodos para o intervalo.
+    """
+    resolutions = list(_RESOLUTION_HOURS)
+    return resolutions[resolutions.index(finest) :]
+
+
+def slice_rollup(
+    rollups: dict[str, pd.DataFrame],
+    resolution: str,
+    start: date | pd.Timestamp,
+    end: date | pd.Timestamp,
+    bairros: Iterable[str] | None = None,
+    tipos: Iterable[str] | None = None,
+    by: str | None = None,
+) -> pd.DataFrame:
+    """Recorta um rollup pelo intervalo de datas e pelos bairros/tipos selecionados.
+
+    Semanas e meses parcialmente cobertos pelo intervalo entram inteiros. Sem
+    `by`, os períodos sem denúncias são completados com zero.
+    """
+    table = rollups[resolution]
+    keys = ["periodo"] if by is None else ["periodo", by]
+    if table.empty:
+        return pd.DataFrame(columns=[*keys, "contagem"])
+
+    first = floor_period(pd.Series([pd.Timestamp(start)]), resolution).iloc[0]
+    stop = pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+    lo = table["periodo"].searchsorted(first, side="left")
+    hi = table["periodo"].searchsorted(stop, side="left")
+    window = table.iloc[lo:hi]
+
+    if bairros is not None:
+        window = window[window["bairro_formatado"].isin(list(bairros))]
+    if tipos is not None:
+        window = window[window["Tipo de Fonte"].isin(list(tipos))]
+
+    trend = window.groupby(keys, observed=True)["contagem"].sum().reset_index()
+    if by is None:
+        full_range = pd.date_range(
+            first, stop - pd.Timedelta(hours=1), freq=RESOLUTIONS[resolution]
+        )
+        trend = (
+            trend.set_index("periodo")
+            .reindex(full_range, fill_value=0)
+            .rename_axis("periodo")
+            .reset_index()
+        )
+    return trend
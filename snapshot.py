@@ -0,0 +1,142 @@
+"""
+Identificação da versão dos dados de denúncias carregados pelas páginas.
+
+A versão do arquivo GeoJSON (data de modificação + tamanho) e o resumo das
+linhas de um recorte permitem montar chaves de cache baratas, sem serializar
+o conteúdo dos DataFrames a cada interação.
+
+Cada DataFrame pode carregar ainda uma impressão digital em
+`df.attrs["fingerprint"]`: o carregamento marca a base com a versão do
+arquivo (`stamp`) e cada recorte derivado dela recebe a impressão do pai
+combinada com os parâmetros do filtro (`derive`). Ler a impressão
+(`fingerprint`) custa o mesmo para 1 ou 1 milhão de linhas; só frames sem
+marca caem no resumo do conteúdo (`content_digest`: colunas, índice e
+valores), que percorre todas as células e não altera o frame.
+
+Como o pandas copia `attrs` para os resultados de filtros, ordenações e
+cópias, a marca guarda também as colunas e o resumo do índice inteiro
+(`frame_digest`, que depende da ordem das linhas), e é descartada quando eles
+não batem com o frame. O resumo é calculado uma vez por objeto de índice e
+reaproveitado nas chamadas seguintes sobre o mesmo frame.
+
+A impressão identifica a versão dos dados, o conjunto (e a ordem) das linhas
+e as colunas presentes. Quem muda os valores de uma coluna existente deve
+marcar o resultado de novo com `derive`, incluindo nos parâmetros o que
+definiu a mudança.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import weakref
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+DATA_PATH = Path(__file__).resolve().parent / "mga_denuncias_20-23.geojson"
+FINGERPRINT_ATTR = "fingerprint"
+MAX_INDEX_DIGESTS = 64
+
+# id do índice -> (referência fraca ao índice, resumo)
+_index_digests: dict[int, tuple[weakref.ref, str]] = {}
+_lock = threading.Lock()
+
+
+def data_version(path: Path = DATA_PATH) -> str:
+    """Versão do arquivo de dados, alterada sempre que ele é regravado."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return "ausente"
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def frame_digest(data: pd.DataFrame) -> str:
+    """Resumo do conjunto de linhas (índice) de um recorte dos dados carregados."""
+    digest = hashlib.sha1(str(len(data)).encode("ascii"))
+    digest.update(
+        pd.util.hash_pandas_object(data.index, index=False).to_numpy().tobytes()
+    )
+    return digest.hexdigest()[:16]
+
+
+def _column_hashes(values: pd.Series) -> np.ndarray:
+    try:
+        return pd.util.hash_pandas_object(values, index=False).to_numpy()
+    except TypeError:
+        # valores não hasheáveis (ex.: listas de tokens) entram pela representação
+        return pd.util.hash_pandas_object(values.astype(str), index=False).to_numpy()
+
+
+def content_digest(data: pd.DataFrame) -> str:
+    """Resumo de colunas, índice e valores de `data`, sem depender de marcas."""
+    digest = hashlib.sha1(repr((len(data), tuple(data.columns))).encode("utf-8"))
+    digest.update(
+        pd.util.hash_pandas_object(data.index, index=False).to_numpy().tobytes()
+    )
+    for position in range(data.shape[1]):
+        digest.update(_column_hashes(data.iloc[:, position]).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _index_digest(data: pd.DataFrame) -> str:
+    index = data.index
+    with _lock:
+        entry = _index_digests.get(id(index))
+    if entry is not None and entry[0]() is index:
+        return entry[1]
+    digest = frame_digest(data)
+    with _lock:
+        _index_digests[id(index)] = (weakref.ref(index), digest)
+        if len(_index_digests) > MAX_INDEX_DIGESTS:
+            for key in [
+                key for key, (ref, _) in _index_digests.items() if ref() is None
+            ]:
+                del _index_digests[key]
+            while len(_index_digests) > MAX_INDEX_DIGESTS:
+                del _index_digests[next(iter(_index_digests))]
+    return digest
+
+
+def _rows_signature(data: pd.DataFrame) -> tuple:
+    return (tuple(data.columns), _index_digest(data))
+
+
+def stamp(data: pd.DataFrame, *parts: object) -> pd.DataFrame:
+    """Marca `data` com a impressão derivada de `parts` e devolve o próprio frame."""
+    value = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:16]
+    data.attrs[FINGERPRINT_ATTR] = (value, _rows_signature(data))
+    return data
+
+
+def derive(data: pd.DataFrame, parent: pd.DataFrame, *params: object) -> pd.DataFrame:
+    """Marca o recorte `data` de `parent` com a impressão do pai e os parâmetros do filtro."""
+    return stamp(data, fingerprint(parent), *params)
+
+
+def fingerprint(data: pd.DataFrame) -> str:
+    """Impressão digital de `data`: a marca de `stamp`/`derive` ou, sem ela, o resumo do conteúdo.
+
+    Não altera `data`, de modo que serve como `hash_func` do Streamlit.
+    """
+    mark = data.attrs.get(FINGERPRINT_ATTR)
+    if mark is not None and mark[1] == _rows_signature(data):
+        return mark[0]
+    return hashlib.sha1(
+        repr((data_version(), content_digest(data))).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+def cache_by_fingerprint(func: Callable | None = None, **kwargs):
+    """`st.cache_data` que identifica os DataFrames dos argumentos pela impressão digital.
+
+    A chave passa a ser a impressão + os demais parâmetros, sem percorrer o
+    conteúdo dos frames a cada chamada. Aceita os mesmos argumentos de
+    `st.cache_data`.
+    """
+    hash_funcs = {pd.DataFrame: fingerprint, **kwargs.pop("hash_funcs", {})}
+    return st.cache_data(func, hash_funcs=hash_funcs, **kwargs)
@@ -0,0 +1,167 @@
+"""
+Índice espacial das denúncias, montado uma vez por versão dos dados.
+
+Uma `BallTree` com métrica haversine sobre as coordenadas em radianos atende
+às consultas por raio ("denúncias a até 200 m deste endereço"), aos k vizinhos
+mais próximos e aos recortes por retângulo (estes por busca binária na
+latitude ordenada). Todas as distâncias de entrada e saída estão em metros e
+as posições devolvidas se referem à ordem das linhas do DataFrame usado na
+construção.
+
+`neighbour_graph` devolve a vizinhança de todos os pontos como matriz esparsa
+de distâncias, guardada no próprio índice (só os `MAX_GRAPHS` raios usados
+mais recentemente); é a estrutura que o OPTICS (`optics_model`) e as
+estatísticas de hotspot reaproveitam em vez de refazer as buscas.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.neighbors import BallTree
+
+from snapshot import fingerprint
+
+EARTH_RADIUS = 6_371_008.8
+# pontos das páginas e centros das células dos hotspots
+MAX_SPATIAL_INDEXES = 8
+MAX_GRAPHS = 4
+
+
+class SpatialIndex:
+    """Consultas por raio, vizinhos mais próximos e retângulo sobre um conjunto de pontos."""
+
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray):
+        self.latitude = np.asarray(latitude, dtype=float)
+        self.longitude = np.asarray(longitude, dtype=float)
+        self.tree = BallTree(
+            np.radians(np.column_stack([self.latitude, self.longitude])),
+            metric="haversine",
+        )
+        self._lat_order = np.argsort(self.latitude, kind="stable")
+        self._graphs: OrderedDict[tuple[float, int], sparse.csr_matrix] = OrderedDict()
+        # o índice é compartilhado pelas sessões e pelos trabalhos em segundo plano
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    @staticmethod
+    def _query_points(lat: float | np.ndarray, lon: float | np.ndarray) -> np.ndarray:
+        return np.radians(np.column_stack([np.atleast_1d(lat), np.atleast_1d(lon)]))
+
+    def within(
+        self, lat: float, lon: float, meters: float
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Posições e distâncias (m) dos pontos a até `meters`, da mais próxima à mais distante."""
+        positions, distances = self.tree.query_radius(
+            self._query_points(lat, lon),
+            r=meters / EARTH_RADIUS,
+            return_distance=True,
+            sort_results=True,
+        )
+        return positions[0], distances[0] * EARTH_RADIUS
+
+    def nearest(self, lat: float, lon: float, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Posições e distâncias (m) dos `k` pontos mais próximos."""
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        distances, positions = self.tree.query(self._query_points(lat, lon), k=k)
+        return positions[0], distances[0] * EARTH_RADIUS
+
+    def in_bbox(
+        self, west: float, south: float, east: float, north: float
+    ) -> np.ndarray:
+        """Posições (crescentes) dos pontos dentro do retângulo."""
+        lat_sorted = self.latitude[self._lat_order]
+        lo = np.searchsorted(lat_sorted, south, side="left")
+        hi = np.searchsorted(lat_sorted, north, side="right")
+        candidates = self._lat_order[lo:hi]
+        lon = self.longitude[candidates]
+        return np.sort(candidates[(lon >= west) & (lon <= east)])
+
+    def neighbour_graph(
+        self, meters: float, min_neighbours: int = 0
+    ) -> sparse.csr_matrix:
+        """Matriz esparsa (n x n) com a distância, em metros, entre vizinhos.
+
+        Cada linha guarda todos os pontos a até `meters` (inclusive o próprio
+        ponto, com distância zero) e, se forem menos de `min_neighbours`, os
+        mais próximos além do raio até completar essa quantidade.
+        """
+        cache_key = (float(meters), int(min_neighbours))
+        with self._lock:
+            graph = self._graphs.get(cache_key)
+            if graph is not None:
+                self._graphs.move_to_end(cache_key)
+                return graph
+        n = len(self)
+        points = np.asarray(self.tree.data)
+        positions, distances = self.tree.query_radius(
+            points, r=meters / EARTH_RADIUS, return_distance=True
+        )
+        counts = np.fromiter((len(p) for p in positions), dtype=np.int64, count=n)
+        rows = [np.repeat(np.arange(n), counts)]
+        cols = (
+            [np.concatenate(positions).astype(np.int64)]
+            if n
+            else [np.empty(0, np.int64)]
+        )
+        values = [np.concatenate(distances)] if n else [np.empty(0)]
+
+        k = min(min_neighbours, n)
+        short = np.flatnonzero(counts < k)
+        if short.size:
+            knn_distances, knn_positions = self.tree.query(points[short], k=k)
+            beyond = knn_distances > meters / EARTH_RADIUS
+            rows.append(np.repeat(short, beyond.sum(axis=1)))
+            cols.append(knn_positions[beyond])
+            values.append(knn_distances[beyond])
+
+        graph = sparse.csr_matrix(
+            (
+                np.concatenate(values) * EARTH_RADIUS,
+                (np.concatenate(rows), np.concatenate(cols)),
+            ),
+            shape=(n, n),
+        )
+        graph.sort_indices()
+        with self._lock:
+            self._graphs[cache_key] = graph
+            self._graphs.move_to_end(cache_key)
+            while len(self._graphs) > MAX_GRAPHS:
+                self._graphs.popitem(last=False)
+        return graph
+
+
+_indexes: OrderedDict[tuple[str, str, str], SpatialIndex] = OrderedDict()
+# as sessões rodam em threads separadas
+_indexes_lock = threading.Lock()
+
+
+def get_spatial_index(
+    data: pd.DataFrame,
+    latitude: str = "latitude",
+    longitude: str = "longitude",
+) -> SpatialIndex:
+    """Índice de `data`, montado uma vez por impressão digital (`snapshot.fingerprint`)."""
+    key = (fingerprint(data), latitude, longitude)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = SpatialIndex(
+        data[latitude].to_numpy(dtype=float), data[longitude].to_numpy(dtype=float)
+    )
+    with _indexes_lock:
+        index = _indexes.setdefault(key, index)
+        _indexes.move_to_end(key)
+        while len(_indexes) > MAX_SPATIAL_INDEXES:
+            _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,173 @@
+"""
+Agrupamento espaço-temporal (ST-DBSCAN) das denúncias em episódios.
+
+Duas denúncias são vizinhas quando estão a até `radius_m` metros e a até
+`window_days` dias uma da outra. As denúncias são ordenadas pela data e
+divididas em faixas de `window_days` dias; os vizinhos de uma faixa só podem
+estar nela ou na seguinte, então a busca espacial (`BallTree` haversine) é
+feita só nessas duas faixas. O custo acompanha o número de pares próximos no
+espaço *e* no tempo, e não o de pares próximos no espaço ao longo dos três
+anos. A distância combinada `max(d / radius_m, Δt / window_days)` vai para o
+DBSCAN como matriz esparsa pré-calculada com `eps = 1`.
+
+Cada cluster é um episódio, com início e fim. Episódios cujos centros ficam a
+até `radius_m` uns dos outros formam um mesmo local, o que expõe de imediato
+os endereços com episódios recorrentes.
+"""
+
+from __future__ import annotations
+
+import math
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from sklearn.cluster import DBSCAN
+from sklearn.neighbors import BallTree
+
+from spatial_index import EARTH_RADIUS, SpatialIndex
+
+DEFAULT_RADIUS_M = 100
+DEFAULT_WINDOW_DAYS = 14
+DEFAULT_MIN_SAMPLES = 5
+DAY = np.timedelta64(1, "D")
+# média mínima de denúncias por faixa de tempo em `st_neighbour_graph`
+MIN_BAND_POINTS = 2048
+EPISODE_COLUMNS = [
+    "episodio",
+    "local",
+    "episodios_no_local",
+    "denuncias",
+    "inicio",
+    "fim",
+    "duracao_dias",
+    "latitude",
+    "longitude",
+    "endereco",
+    "tipo_predominante",
+]
+
+
+def st_neighbour_graph(
+    index: SpatialIndex, times: np.ndarray, radius_m: float, window_days: float
+) -> sparse.csr_matrix:
+    """Distância combinada (<= 1) entre as denúncias vizinhas no espaço e no tempo.
+
+    Denúncias sem data ficam sem vizinhos (nem elas mesmas) e viram ruído.
+    """
+    n = len(index)
+    times = np.asarray(times, dtype="datetime64[ns]")
+    dated = np.flatnonzero(~np.isnat(times))
+    order = dated[np.argsort(times[dated], kind="stable")]
+    if not order.size:
+        return sparse.csr_matrix((n, n))
+    elapsed = (times[order] - times[order[0]]).astype(np.int64)
+    # faixas com pelo menos `window_days` de largura: pares dentro da janela
+    # estão na mesma faixa ou em faixas consecutivas; janelas curtas usam faixas
+    # mais largas para não montar uma árvore para cada punhado de denúncias
+    window_ns = math.ceil(window_days * (DAY / np.timedelta64(1, "ns")))
+    band_ns = max(window_ns, int(elapsed[-1]) * MIN_BAND_POINTS // len(order), 1)
+    band = elapsed // band_ns
+    points = np.radians(
+        np.column_stack([index.latitude[order], index.longitude[order]])
+    )
+    radius = radius_m / EARTH_RADIUS
+
+    rows, cols = [], []
+    for current in np.unique(band):
+        lo, mid, hi = np.searchsorted(band, [current, current + 1, current + 2])
+        tree = BallTree(points[lo:hi], metric="haversine")
+        found = tree.query_radius(points[lo:mid], r=radius)
+        counts = np.fromiter((len(p) for p in found), dtype=np.int64, count=mid - lo)
+        a = lo + np.repeat(np.arange(mid - lo), counts)
+        b = lo + np.concatenate(found).astype(np.int64)
+        # pares com a faixa seguinte aparecem uma vez: registra os dois sentidos
+        ahead = b >= mid
+        rows += [a, b[ahead]]
+        cols += [b, a[ahead]]
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+
+    gap_days = np.abs(elapsed[rows] - elapsed[cols]) / (DAY / np.timedelta64(1, "ns"))
+    keep = gap_days <= window_days
+    rows, cols, gap_days = rows[keep], cols[keep], gap_days[keep]
+    lat, lon = points[:, 0], points[:, 1]
+    haversine = 2 * np.arcsin(
+        np.sqrt(
+            np.sin((lat[rows] - lat[cols]) / 2) ** 2
+            + np.cos(lat[rows])
+            * np.cos(lat[cols])
+            * np.sin((lon[rows] - lon[cols]) / 2) ** 2
+        )
+    )
+    distance = np.maximum(haversine / radius, gap_days / window_days)
+    graph = sparse.csr_matrix((distance, (order[rows], order[cols])), shape=(n, n))
+    graph.sort_indices()
+    return graph
+
+
+def st_dbscan(
+    index: SpatialIndex,
+    times: np.ndarray,
+    radius_m: float = DEFAULT_RADIUS_M,
+    window_days: float = DEFAULT_WINDOW_DAYS,
+    min_samples: int = DEFAULT_MIN_SAMPLES,
+) -> np.ndarray:
+    """Rótulo do episódio de cada denúncia (-1 para ruído)."""
+    if not len(index):
+        return np.empty(0, dtype=np.int64)
+    graph = st_neighbour_graph(index, times, radius_m, window_days)
+    return DBSCAN(eps=1.0, min_samples=min_samples, metric="precomputed").fit_predict(
+        graph
+    )
+
+
+def _mode(values: pd.Series) -> str:
+    counts = values.dropna().astype(str).str.strip()
+    counts = counts[counts != ""].value_counts()
+    return counts.index[0] if len(counts) else ""
+
+
+def episode_table(
+    data: pd.DataFrame,
+    labels: np.ndarray,
+    radius_m: float = DEFAULT_RADIUS_M,
+    time_col: str = "DataInclusao",
+    latitude: str = "latitude",
+    longitude: str = "longitude",
+) -> pd.DataFrame:
+    """Um episódio por linha, com período, centro e os episódios do mesmo local.
+
+    Ordenado pelos locais com mais episódios e, dentro de cada local, pelo início.
+    """
+    clustered = data.loc[labels >= 0].assign(episodio=labels[labels >= 0])
+    if clustered.empty:
+        return pd.DataFrame(columns=EPISODE_COLUMNS)
+    grouped = clustered.groupby("episodio")
+    table = grouped.agg(
+        denuncias=(time_col, "size"),
+        inicio=(time_col, "min"),
+        fim=(time_col, "max"),
+        latitude=(latitude, "mean"),
+        longitude=(longitude, "mean"),
+    )
+    table["duracao_dias"] = (
+        (table["fim"] - table["inicio"]) / pd.Timedelta(days=1)
+    ).round(1)
+    table["endereco"] = (
+        grouped["endereco_completo"].agg(_mode)
+        if "endereco_completo" in clustered
+        else ""
+    )
+    table["tipo_predominante"] = (
+        grouped["Tipo de Fonte"].agg(_mode) if "Tipo de Fonte" in clustered else ""
+    )
+
+    centers = SpatialIndex(table["latitude"].to_numpy(), table["longitude"].to_numpy())
+    _, local = connected_components(centers.neighbour_graph(radius_m), directed=False)
+    table["local"] = local
+    table["episodios_no_local"] = table.groupby("local")["denuncias"].transform("size")
+    table = table.reset_index().sort_values(
+        ["episodios_no_local", "local", "inicio"], ascending=[False, True, True]
+    )
+    return table[EPISODE_COLUMNS].reset_index(drop=True)
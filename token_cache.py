@@ -0,0 +1,80 @@
+"""
+Cache persistente (SQLite) da análise do spaCy de cada descrição de denúncia.
+
+As descrições não mudam depois de registradas, então a análise de cada texto
+é guardada sob `cache_key(versão do modelo, texto normalizado)` e reaproveitada
+nas execuções seguintes de `NLP_Tokenization.py`; o spaCy só processa os
+textos ausentes. O valor guardado é a lista de pares (texto, lema) que já
+passaram pelos filtros que não dependem das stopwords, de modo que mudar as
+stopwords não exige reprocessar nada no spaCy.
+
+O arquivo é `DENUNCIAS_TOKEN_CACHE` (por padrão, `.cache/tokens.sqlite` na
+raiz do projeto).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+from collections.abc import Iterable, Mapping
+from pathlib import Path
+
+CACHE_PATH = Path(
+    os.getenv(
+        "DENUNCIAS_TOKEN_CACHE",
+        Path(__file__).resolve().parent / ".cache" / "tokens.sqlite",
+    )
+)
+# limite de parâmetros por consulta em versões antigas do SQLite
+MAX_QUERY_VARIABLES = 900
+
+
+def cache_key(model_version: str, text: str) -> str:
+    """Chave da análise de `text` pelo modelo identificado em `model_version`."""
+    return hashlib.sha1(f"{model_version}\0{text}".encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """Tabela chave -> lista de pares (texto, lema) num arquivo SQLite."""
+
+    def __init__(self, path: Path = CACHE_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, list[list[str]]]:
+        """Análises guardadas para as chaves encontradas."""
+        keys = list(keys)
+        found: dict[str, list[list[str]]] = {}
+        for start in range(0, len(keys), MAX_QUERY_VARIABLES):
+            chunk = keys[start : start + MAX_QUERY_VARIABLES]
+            rows = self._conn.execute(
+                f"SELECT key, value FROM tokens WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            found.update((key, json.loads(value)) for key, value in rows)
+        return found
+
+    def put_many(self, items: Mapping[str, list]) -> None:
+        """Grava as análises numa única transação."""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tokens (key, value) VALUES (?, ?)",
+                (
+                    (key, json.dumps(value, ensure_ascii=False))
+                    for key, value in items.items()
+                ),
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> TokenCache:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
@@ -0,0 +1,437 @@
+"""
+Vector tiles (Mapbox Vector Tile) das denúncias, gerados sob demanda.
+
+O navegador pede apenas os tiles `z/x/y` da área visível ao servidor local;
+o custo de carregar o mapa passa a depender do viewport e não do total de
+linhas. Abaixo de `point_zoom`, cada tile traz os pontos agregados numa grade
+de células com a contagem por `Tipo de Fonte` (camada `agregados`); a partir
+dele, traz as denúncias individuais (camada `denuncias`), identificadas pela
+posição da linha para que o popup possa ser buscado sob demanda.
+
+O codificador cobre apenas o necessário para pontos (especificação MVT 2.1),
+sem depender de bibliotecas de protobuf.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from folium.elements import JSCSSMixin
+from folium.map import Layer
+from jinja2 import Template
+
+from local_server import ensure_server, register_route
+from map_layers import DEFAULT_ZOOM_THRESHOLD
+from snapshot import fingerprint
+
+TILE_ROUTE = "tiles"
+TILE_EXTENT = 4096
+TILE_BUFFER = 128
+AGGREGATE_GRID = 16
+AGGREGATE_LAYER = "agregados"
+POINT_LAYER = "denuncias"
+CATEGORY_COLUMN = "Tipo de Fonte"
+MISSING_LABEL = "Não informado"
+CATEGORY_PREFIX = "fonte:"
+MAX_TILE_SOURCES = 16
+MAX_CACHED_TILES = 4096
+CATEGORY_PALETTE = [
+    "#1D4ED8",
+    "#DC2626",
+    "#059669",
+    "#D97706",
+    "#7C3AED",
+    "#DB2777",
+    "#0891B2",
+    "#65A30D",
+    "#9A3412",
+    "#475569",
+]
+
+_MVT_CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+_POINT = 1
+_MOVE_TO_ONE = (1 << 3) | 1
+
+
+# --- codificação protobuf -----------------------------------------------------
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _field_varint(number: int, value: int) -> bytes:
+    return _varint(number << 3) + _varint(value)
+
+
+def _field_bytes(number: int, payload: bytes) -> bytes:
+    return _varint((number << 3) | 2) + _varint(len(payload)) + payload
+
+
+def _packed(number: int, values: list[int]) -> bytes:
+    return _field_bytes(number, b"".join(_varint(value) for value in values))
+
+
+class _LayerEncoder:
+    """Acumula as features de uma camada com chaves e valores deduplicados."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.features: list[bytes] = []
+        self._keys: dict[str, int] = {}
+        self._values: dict[tuple[str, object], int] = {}
+
+    def _key(self, key: str) -> int:
+        return self._keys.setdefault(key, len(self._keys))
+
+    def _value(self, value: object) -> int:
+        kind = "int" if isinstance(value, (int, np.integer)) else "str"
+        token = (kind, int(value) if kind == "int" else str(value))
+        return self._values.setdefault(token, len(self._values))
+
+    def add_point(
+        self, x: int, y: int, properties: dict, feature_id: int | None = None
+    ):
+        tags = []
+        for key, value in properties.items():
+            tags.extend((self._key(key), self._value(value)))
+        body = b""
+        if feature_id is not None:
+            body += _field_varint(1, int(feature_id))
+        if tags:
+            body += _packed(2, tags)
+        body += _field_varint(3, _POINT)
+        body += _packed(4, [_MOVE_TO_ONE, _zigzag(int(x)), _zigzag(int(y))])
+        self.features.append(_field_bytes(2, body))
+
+    def encode(self) -> bytes:
+        body = _field_varint(15, 2) + _field_bytes(1, self.name.encode("utf-8"))
+        body += b"".join(self.features)
+        for key in self._keys:
+            body += _field_bytes(3, key.encode("utf-8"))
+        for kind, value in self._values:
+            if kind == "int":
+                payload = (
+                    _field_varint(5, value)
+                    if value >= 0
+                    else _field_varint(6, _zigzag(value))
+                )
+            else:
+                payload = _field_bytes(1, str(value).encode("utf-8"))
+            body += _field_bytes(4, payload)
+        body += _field_varint(5, TILE_EXTENT)
+        return _field_bytes(3, body)
+
+
+# --- fontes de tiles ----------------------------------------------------------
+
+
+def mercator_xy(
+    latitude: np.ndarray, longitude: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Coordenadas Web Mercator normalizadas em [0, 1] (origem no canto noroeste)."""
+    lat = np.clip(np.asarray(latitude, dtype=float), -85.05112878, 85.05112878)
+    x = (np.asarray(longitude, dtype=float) + 180.0) / 360.0
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / math.pi) / 2.0
+    return x, y
+
+
+@dataclass
+class TileSource:
+    """Pontos de um recorte prontos para o corte em tiles (ordenados por x)."""
+
+    x: np.ndarray
+    y: np.ndarray
+    rows: np.ndarray
+    codes: np.ndarray
+    categories: list[str]
+    point_zoom: int
+
+    @classmethod
+    def from_frame(
+        cls,
+        data: pd.DataFrame,
+        category: str = CATEGORY_COLUMN,
+        latitude: str = "latitude",
+        longitude: str = "longitude",
+        point_zoom: int = DEFAULT_ZOOM_THRESHOLD,
+    ) -> TileSource:
+        x, y = mercator_xy(data[latitude].to_numpy(), data[longitude].to_numpy())
+        if category in data.columns:
+            labels = data[category].astype(object).where(data[category].notna(), "")
+            labels = labels.astype(str).str.strip().replace("", MISSING_LABEL)
+            codes, uniques = pd.factorize(labels, sort=True)
+            categories = list(uniques)
+        else:
+            codes = np.zeros(len(data), dtype=np.int64)
+            categories = [MISSING_LABEL]
+        order = np.argsort(x, kind="stable")
+        return cls(
+            x=x[order],
+            y=y[order],
+            rows=order.astype(np.int64),
+            codes=np.asarray(codes, dtype=np.int64)[order],
+            categories=categories,
+            point_zoom=point_zoom,
+        )
+
+    def render(self, z: int, tx: int, ty: int) -> bytes:
+        """Gera o tile `z/tx/ty` codificado em MVT."""
+        scale = float(1 << z)
+        buffer = TILE_BUFFER / TILE_EXTENT if z >= self.point_zoom else 0.0
+        x0, x1 = (tx - buffer) / scale, (tx + 1 + buffer) / scale
+        y0, y1 = (ty - buffer) / scale, (ty + 1 + buffer) / scale
+        lo, hi = np.searchsorted(self.x, [x0, x1], side="left")
+        window = slice(lo, hi)
+        inside = (self.y[window] >= y0) & (self.y[window] < y1)
+        if buffer == 0.0:
+            inside &= self.x[window] < x1
+        if not inside.any():
+            return b""
+        px = (self.x[window][inside] * scale - tx) * TILE_EXTENT
+        py = (self.y[window][inside] * scale - ty) * TILE_EXTENT
+        codes = self.codes[window][inside]
+        if z >= self.point_zoom:
+            return self._points_layer(px, py, self.rows[window][inside], codes)
+        return self._aggregate_layer(px, py, codes)
+
+    def _points_layer(self, px, py, rows, codes) -> bytes:
+        layer = _LayerEncoder(POINT_LAYER)
+        for x, y, row, code in zip(
+            np.rint(px).astype(int).tolist(),
+            np.rint(py).astype(int).tolist(),
+            rows.tolist(),
+            codes.tolist(),
+        ):
+            layer.add_point(x, y, {"row": row, "tipo": self.categories[code]}, row)
+        return layer.encode()
+
+    def _aggregate_layer(self, px, py, codes) -> bytes:
+        cell_size = TILE_EXTENT / AGGREGATE_GRID
+        cx = np.clip((px // cell_size).astype(np.int64), 0, AGGREGATE_GRID - 1)
+        cy = np.clip((py // cell_size).astype(np.int64), 0, AGGREGATE_GRID - 1)
+        cells = cy * AGGREGATE_GRID + cx
+        n_cells = AGGREGATE_GRID * AGGREGATE_GRID
+        n_categories = len(self.categories)
+        counts = np.bincount(
+            cells * n_categories + codes, minlength=n_cells * n_categories
+        ).reshape(n_cells, n_categories)
+        totals = counts.sum(axis=1)
+        sum_x = np.bincount(cells, weights=px, minlength=n_cells)
+        sum_y = np.bincount(cells, weights=py, minlength=n_cells)
+        layer = _LayerEncoder(AGGREGATE_LAYER)
+        for cell in np.flatnonzero(totals).tolist():
+            total = int(totals[cell])
+            properties = {
+                "total": total,
+                "tipo": self.categories[int(counts[cell].argmax())],
+            }
+            for code in np.flatnonzero(counts[cell]).tolist():
+                properties[CATEGORY_PREFIX + self.categories[code]] = int(
+                    counts[cell, code]
+                )
+            layer.add_point(
+                round(sum_x[cell] / total), round(sum_y[cell] / total), properties
+            )
+        return layer.encode()
+
+
+_tile_sources: OrderedDict[str, TileSource] = OrderedDict()
+_tile_cache: OrderedDict[tuple[str, int, int, int], bytes] = OrderedDict()
+# protege as duas tabelas: o servidor local atende os tiles em outras threads
+_lock = threading.Lock()
+
+
+def _serve_tile(
+    parts: list[str], query: dict[str, list[str]]
+) -> tuple[int, str, bytes]:
+    if len(parts) != 4:
+        return 404, "text/plain; charset=utf-8", b"tile not found"
+    z, x, y = parts[1], parts[2], parts[3].removesuffix(".pbf")
+    if not (z.isdigit() and x.isdigit() and y.isdigit()):
+        return 404, "text/plain; charset=utf-8", b"tile not found"
+    cache_key = (parts[0], int(z), int(x), int(y))
+    with _lock:
+        source = _tile_sources.get(parts[0])
+        body = _tile_cache.get(cache_key)
+        if body is not None:
+            _tile_cache.move_to_end(cache_key)
+    if source is None:
+        return 404, "text/plain; charset=utf-8", b"tile not found"
+    if body is None:
+        body = source.render(int(z), int(x), int(y))
+        with _lock:
+            # a fonte pode ter sido descartada durante a renderização
+            if parts[0] in _tile_sources:
+                _tile_cache[cache_key] = body
+                while len(_tile_cache) > MAX_CACHED_TILES:
+                    _tile_cache.popitem(last=False)
+    return 200, _MVT_CONTENT_TYPE, body
+
+
+def register_tile_source(
+    data: pd.DataFrame,
+    category: str = CATEGORY_COLUMN,
+    point_zoom: int = DEFAULT_ZOOM_THRESHOLD,
+    extra_key: str = "",
+) -> tuple[str, list[str]]:
+    """Disponibiliza `data` como vector tiles no servidor local.
+
+    Devolve o modelo de URL (`.../{z}/{x}/{y}.pbf`) e as categorias presentes.
+    O identificador de cada denúncia nos tiles é a posição da linha em `data`,
+    a mesma usada por `map_layers.register_popup_source`.
+    """
+    key = hashlib.sha1(
+        f"{fingerprint(data)}{category}{point_zoom}{extra_key}".encode("utf-8")
+    ).hexdigest()[:16]
+    with _lock:
+        source = _tile_sources.get(key)
+        if source is not None:
+            _tile_sources.move_to_end(key)
+    if source is None:
+        source = TileSource.from_frame(data, category=category, point_zoom=point_zoom)
+        with _lock:
+            source = _tile_sources.setdefault(key, source)
+            _tile_sources.move_to_end(key)
+            while len(_tile_sources) > MAX_TILE_SOURCES:
+                evicted, _ = _tile_sources.popitem(last=False)
+                for cached in [k for k in _tile_cache if k[0] == evicted]:
+                    del _tile_cache[cached]
+    register_route(TILE_ROUTE, _serve_tile)
+    return (
+        f"{ensure_server()}/{TILE_ROUTE}/{key}/{{z}}/{{x}}/{{y}}.pbf",
+        source.categories,
+    )
+
+
+def category_colors(categories: list[str]) -> dict[str, str]:
+    return {
+        category: CATEGORY_PALETTE[index % len(CATEGORY_PALETTE)]
+        for index, category in enumerate(categories)
+    }
+
+
+class VectorTileLayer(JSCSSMixin, Layer):
+    """Camada Leaflet.VectorGrid para os tiles de `register_tile_source`.
+
+    Parameters
+    ----------
+    url : modelo de URL devolvido por `register_tile_source`.
+    categories : categorias devolvidas por `register_tile_source` (definem as cores).
+    popup_url : prefixo de `register_popup_source` para os popups das denúncias.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function () {
+            var options = {{ this.options_js }};
+            function escapeHtml(value) {
+                return String(value).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+            }
+            function colorOf(tipo) { return options.colors[tipo] || "#475569"; }
+            var styles = {};
+            styles[options.aggregateLayer] = function (properties) {
+                var color = colorOf(properties.tipo);
+                return {
+                    radius: Math.min(26, 4 + 2.2 * Math.sqrt(properties.total)),
+                    fill: true,
+                    fillColor: color,
+                    fillOpacity: 0.6,
+                    color: color,
+                    weight: 1
+                };
+            };
+            styles[options.pointLayer] = function (properties) {
+                var color = colorOf(properties.tipo);
+                return {radius: 4, fill: true, fillColor: color, fillOpacity: 0.85, color: color, weight: 1};
+            };
+            var layer = L.vectorGrid.protobuf(options.url, {
+                rendererFactory: L.canvas.tile,
+                interactive: true,
+                maxZoom: 22,
+                vectorTileLayerStyles: styles,
+                getFeatureId: function (feature) { return feature.properties.row; }
+            });
+            layer.on("click", function (event) {
+                var properties = event.layer.properties || {};
+                var popup = L.popup({maxWidth: 360}).setLatLng(event.latlng);
+                if (properties.total !== undefined) {
+                    var lines = ["<b>" + Number(properties.total).toLocaleString("pt-BR") + " denúncias</b>"];
+                    Object.keys(properties).forEach(function (key) {
+                        if (key.indexOf(options.categoryPrefix) === 0) {
+                            lines.push(escapeHtml(key.slice(options.categoryPrefix.length)) + ": "
+                                + Number(properties[key]).toLocaleString("pt-BR"));
+                        }
+                    });
+                    popup.setContent(lines.join("<br>")).openOn(this._map);
+                    return;
+                }
+                if (!options.popupUrl) {
+                    popup.setContent(escapeHtml(properties.tipo)).openOn(this._map);
+                    return;
+                }
+                popup.setContent("Carregando…").openOn(this._map);
+                fetch(options.popupUrl + properties.row)
+                    .then(function (response) {
+                        if (!response.ok) { throw new Error(response.status); }
+                        return response.text();
+                    })
+                    .then(function (content) { popup.setContent(content); })
+                    .catch(function () { popup.setContent("Detalhes indisponíveis no momento."); });
+            });
+            return layer;
+        })();
+        {% endmacro %}
+        """
+    )
+
+    default_js = [
+        (
+            "vectorGrid",
+            "https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/Leaflet.VectorGrid.bundled.js",
+        )
+    ]
+
+    def __init__(
+        self,
+        url: str,
+        categories: list[str],
+        popup_url: str | None = None,
+        name: str = "Denúncias (tiles vetoriais)",
+        overlay: bool = True,
+        control: bool = True,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "VectorTileLayer"
+        self.options_js = json.dumps(
+            {
+                "url": url,
+                "colors": category_colors(categories),
+                "popupUrl": popup_url,
+                "aggregateLayer": AGGREGATE_LAYER,
+                "pointLayer": POINT_LAYER,
+                "categoryPrefix": CATEGORY_PREFIX,
+            },
+            ensure_ascii=False,
+        ).replace("</", "<\\/")